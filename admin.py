@@ -1,5 +1,9 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.text import Truncator
 from mptt.admin import MPTTModelAdmin
 from .models import (
     ProductType, 
@@ -12,6 +16,7 @@ from .models import (
     Color,
     ProductImage
 )
+from .pagination import LimitedCountPaginator
 
 @admin.register(ProductType)
 class ProductTypeAdmin(admin.ModelAdmin):
@@ -49,6 +54,22 @@ class ProductAttributeAdmin(admin.ModelAdmin):
     inlines = [AttributeOptionInline]
     prepopulated_fields = {'code': ('name',)}
 
+@admin.register(AttributeOption)
+class AttributeOptionAdmin(admin.ModelAdmin):
+    """Список вариантов для всплывающего выбора в значениях атрибутов товара"""
+    list_display = ['display_value', 'value', 'attribute', 'order']
+    list_filter = ['attribute']
+    list_select_related = ['attribute', 'attribute__attribute_group']
+    search_fields = ['value', 'display_value', 'attribute__name']
+    paginator = LimitedCountPaginator
+    show_full_result_count = False
+
+    def lookup_allowed(self, lookup, value, request=None):
+        # Фильтр по типу товара передаёт ScopedRawIdWidget
+        if lookup == 'attribute__attribute_group__product_type__id__exact':
+            return True
+        return super().lookup_allowed(lookup, value, request)
+
 @admin.register(AttributeGroup)
 class AttributeGroupAdmin(admin.ModelAdmin):
     list_display = ['name', 'product_type', 'order']
@@ -60,25 +81,86 @@ class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
 
+class ScopedRawIdWidget(ForeignKeyRawIdWidget):
+    """Raw-id виджет с дополнительными фильтрами во всплывающем списке"""
+
+    def __init__(self, rel, admin_site, params=None, queryset=None, **kwargs):
+        self.params = params or {}
+        self.queryset = queryset
+        super().__init__(rel, admin_site, **kwargs)
+
+    def url_parameters(self):
+        return {**super().url_parameters(), **self.params}
+
+    def label_and_url_for_value(self, value):
+        # Подпись по queryset поля (с select_related), а не по менеджеру модели:
+        # __str__ варианта читает атрибут, иначе это ещё запрос на каждую строку
+        if self.queryset is None:
+            return super().label_and_url_for_value(value)
+        key = self.rel.get_related_field().name
+        try:
+            obj = self.queryset.using(self.db).get(**{key: value})
+        except (ValueError, self.queryset.model.DoesNotExist, ValidationError):
+            return '', ''
+        url = reverse(
+            f'{self.admin_site.name}:{obj._meta.app_label}_{obj._meta.model_name}_change',
+            args=(obj.pk,)
+        )
+        return Truncator(obj).words(14), url
+
 class AttributeValueInline(admin.TabularInline):
     model = AttributeValue
     extra = 1
+    # Поле ввода id с поиском во всплывающем окне вместо select со всеми вариантами
+    raw_id_fields = ['option']
+
+    @staticmethod
+    def get_product_type_id(request, obj=None):
+        obj = obj or getattr(request, '_obj_', None)
+        return obj.category.product_type_id if obj and obj.category_id else None
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        if db_field.name == "option" and request.method == "POST":
-            attribute_id = request.POST.get('attribute')
-            if attribute_id:
-                kwargs["queryset"] = AttributeOption.objects.filter(attribute_id=attribute_id)
+        if db_field.name == 'option':
+            product_type_id = self.get_product_type_id(request)
+            if product_type_id:
+                lookup = 'attribute__attribute_group__product_type'
+                kwargs['queryset'] = AttributeOption.objects.filter(
+                    **{lookup: product_type_id}
+                ).select_related('attribute')
+                kwargs['widget'] = ScopedRawIdWidget(
+                    db_field.remote_field,
+                    self.admin_site,
+                    params={f'{lookup}__id__exact': product_type_id},
+                    queryset=kwargs['queryset'],
+                    using=kwargs.get('using')
+                )
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+    def get_queryset(self, request):
+        # __str__ строки и атрибута читают связанные объекты
+        return super().get_queryset(request).select_related(
+            'product', 'attribute__attribute_group', 'option__attribute'
+        )
+
+    def get_attribute_choices(self, request, obj=None):
+        """Атрибуты типа товара - один запрос на запрос к админке, а не на каждую строку"""
+        if not hasattr(request, '_attribute_choices'):
+            queryset = ProductAttribute.objects.select_related('attribute_group')
+            product_type_id = self.get_product_type_id(request, obj)
+            if product_type_id:
+                queryset = queryset.filter(attribute_group__product_type_id=product_type_id)
+            request._attribute_choices = (
+                queryset,
+                [('', '---------')] + [(attribute.pk, str(attribute)) for attribute in queryset]
+            )
+        return request._attribute_choices
+
     def get_formset(self, request, obj=None, **kwargs):
         formset = super().get_formset(request, obj, **kwargs)
-        if obj:
-            # Исправленный фильтр для атрибутов
-            formset.form.base_fields['attribute'].queryset = \
-                ProductAttribute.objects.filter(
-                    attribute_group__product_type=obj.category.product_type
-                )
+        field = formset.form.base_fields['attribute']
+        field.queryset, choices = self.get_attribute_choices(request, obj)
+        # Готовый список вместо повторного выполнения queryset в каждой форме
+        field.choices = choices
         return formset
 
 @admin.register(Product)
@@ -92,6 +174,10 @@ class ProductAdmin(admin.ModelAdmin):
     ]
     list_filter = ['category', 'is_active']
     list_editable = ['price', 'stock', 'is_active']
+    list_select_related = ['category']
+    # Без полного COUNT(*) по таблице: точное число не больше порога пагинатора
+    paginator = LimitedCountPaginator
+    show_full_result_count = False
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'description']
     readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,128 @@
+import time
+from array import array
+
+from django.core.cache import cache
+
+from .caching import bump_generation, get_generation, make_key
+from .models import AttributeValue
+from .replicas import primary_reads
+
+
+class AttributeIndex:
+    """Инвертированный индекс (код атрибута, значение) -> отсортированные id товаров.
+
+    У каждой пары своя версия в кэше, и ключ списка содержит её: список,
+    прочитанный из БД до invalidate, записывается под старой версией
+    и больше не читается.
+    """
+    namespace = 'attribute-index'
+    timeout = None
+    typecode = 'q'
+
+    def _pack(self, ids):
+        return array(self.typecode, sorted(set(ids))).tobytes()
+
+    def _unpack(self, data):
+        postings = array(self.typecode)
+        postings.frombytes(data)
+        return postings
+
+    def _version_key(self, code, value, generation):
+        return make_key(self.namespace, 'version', code, value, generation=generation)
+
+    def get_versions(self, pairs, generation):
+        keys = {self._version_key(code, value, generation): (code, value) for code, value in pairs}
+        found = cache.get_many(list(keys))
+        versions = {}
+        for key, pair in keys.items():
+            version = found.get(key)
+            if version is None:
+                # Как у поколений: начальное значение от времени, старые ключи не повторяются
+                cache.add(key, int(time.time() * 1000), None)
+                version = cache.get(key, 0)
+            versions[pair] = version
+        return versions
+
+    def get_postings(self, pairs):
+        """Списки id для пар (код, значение); промахи догружаются одним запросом"""
+        pairs = set(pairs)
+        generation = get_generation(self.namespace)
+        # Версии читаются до БД: при гонке с invalidate список уходит под устаревший ключ
+        versions = self.get_versions(pairs, generation)
+        keys = {
+            make_key(self.namespace, code, value, versions[(code, value)], generation=generation): (code, value)
+            for code, value in pairs
+        }
+        cached = cache.get_many(list(keys))
+        postings = {keys[key]: self._unpack(data) for key, data in cached.items()}
+
+        missing = pairs - set(postings)
+        if missing:
+            loaded = {pair: [] for pair in missing}
+            # Списки хранятся без срока - с реплики в них могло бы застрять отставание
+            with primary_reads():
+                rows = list(AttributeValue.objects.filter(
+                    attribute__code__in={code for code, _ in missing},
+                    option__value__in={value for _, value in missing},
+                    product__isnull=False
+                ).values_list('attribute__code', 'option__value', 'product_id'))
+            for code, value, product_id in rows:
+                if (code, value) in loaded:
+                    loaded[(code, value)].append(product_id)
+            packed = {pair: self._pack(ids) for pair, ids in loaded.items()}
+            cache.set_many({
+                make_key(self.namespace, *pair, versions[pair], generation=generation): data
+                for pair, data in packed.items()
+            }, self.timeout)
+            postings.update((pair, self._unpack(data)) for pair, data in packed.items())
+        return postings
+
+    @staticmethod
+    def split_values(values):
+        if not values:
+            return set()
+        if isinstance(values, str):
+            values = values.split(',')
+        return {value.strip() for value in values if value and value.strip()}
+
+    def resolve(self, attributes):
+        """Пересечение по атрибутам и объединение значений внутри атрибута.
+
+        attributes: {код: список значений или строка 'red,blue'}.
+        Возвращает отсортированный список id или None, если фильтров нет.
+        """
+        attributes = {code: self.split_values(values) for code, values in attributes.items()}
+        attributes = {code: values for code, values in attributes.items() if values}
+        if not attributes:
+            return None
+
+        postings = self.get_postings(
+            (code, value) for code, values in attributes.items() for value in values
+        )
+        groups = sorted(
+            (set().union(*(postings[(code, value)] for value in values))
+             for code, values in attributes.items()),
+            key=len
+        )
+        result = groups[0]
+        for group in groups[1:]:
+            if not result:
+                break
+            result = result & group
+        return sorted(result)
+
+    def invalidate(self, pairs):
+        """Смена версии затронутых списков, они перестроятся при следующем запросе"""
+        generation = get_generation(self.namespace)
+        for code, value in set(pairs):
+            try:
+                cache.incr(self._version_key(code, value, generation))
+            except ValueError:
+                # Версии нет - следующее чтение заведёт новую от текущего времени
+                pass
+
+    def invalidate_all(self):
+        bump_generation(self.namespace)
+
+
+attribute_index = AttributeIndex()
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+
+from .caching import bump_generation, get_generation, make_key
+from .models import AttributeOption
+from .replicas import primary_reads
+
+
+class AttributeOptionsMap:
+    """Карта id атрибута -> варианты значений с ETag на каждый атрибут.
+
+    Вся таблица вариантов собирается одним запросом, хранится в кэше Django
+    и в памяти процесса; сигналы AttributeOption меняют поколение.
+    """
+    namespace = 'attribute-options'
+    fields = ('id', 'value', 'display_value', 'order')
+
+    def __init__(self):
+        self._local = None
+
+    @primary_reads()
+    def build(self):
+        options = {}
+        for row in AttributeOption.objects.order_by('attribute_id', 'order', 'value').values(
+            'attribute_id', *self.fields
+        ):
+            options.setdefault(row.pop('attribute_id'), []).append(row)
+        return {
+            'options': options,
+            'etags': {
+                attribute_id: hashlib.md5(
+                    json.dumps(rows, ensure_ascii=False).encode()
+                ).hexdigest()
+                for attribute_id, rows in options.items()
+            },
+            'last_modified': time.time()
+        }
+
+    def get(self):
+        """Актуальная карта: память процесса, затем общий кэш, затем БД"""
+        generation = get_generation(self.namespace)
+        local = self._local
+        if local is not None and local[0] == generation:
+            return local[1]
+        key = make_key(self.namespace, 'map', generation=generation)
+        data = cache.get(key)
+        if data is None:
+            data = self.build()
+            cache.set(key, data, None)
+        self._local = (generation, data)
+        return data
+
+    def options(self, attribute_ids):
+        data = self.get()
+        return {pk: data['options'].get(pk, []) for pk in attribute_ids}
+
+    def etag(self, attribute_ids):
+        etags = self.get()['etags']
+        return hashlib.md5(
+            ','.join(f'{pk}:{etags.get(pk, "")}' for pk in attribute_ids).encode()
+        ).hexdigest()
+
+    def last_modified(self):
+        return self.get()['last_modified']
+
+    def invalidate(self):
+        bump_generation(self.namespace)
+
+
+attribute_options = AttributeOptionsMap()
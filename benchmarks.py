@@ -0,0 +1,208 @@
+"""Бенчмарк API каталога: число запросов, задержка p50/p95, процессорное
+время, размер ответа и пик памяти.
+
+Каталог генерируется синтетически, результаты сравниваются с сохранёнными
+в benchmark_baseline.json. Запуск: manage.py catalog_benchmark.
+"""
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .category_stats import rebuild_category_stats
+from .models import (
+    AttributeGroup,
+    AttributeOption,
+    AttributeValue,
+    Category,
+    Product,
+    ProductAttribute,
+    ProductDocument,
+    ProductImage,
+    ProductType
+)
+from .response_cache import get_response_cache
+from .signals import products_bulk_changed
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+DEFAULT_SIZE = {
+    'categories': 30,
+    'attributes': 4,
+    'options': 8,
+    'products': 500,
+    'images': 2,
+}
+
+
+def seed_catalog(categories=30, attributes=4, options=8, products=500, images=2, seed=0):
+    """Синтетический каталог заданного размера"""
+    rnd = random.Random(seed)
+    product_type = ProductType.objects.create(name='Бенчмарк', slug=f'bench-{seed}')
+
+    nodes = []
+    for i in range(categories):
+        parent = rnd.choice(nodes) if nodes and i % 3 else None
+        nodes.append(Category.objects.create(
+            name=f'Категория {i}',
+            slug=f'bench-category-{seed}-{i}',
+            parent=parent,
+            product_type=product_type
+        ))
+
+    group = AttributeGroup.objects.create(name='Характеристики', product_type=product_type)
+    attribute_options = {}
+    for i in range(attributes):
+        code = ('size', 'color')[i] if i < 2 else f'bench-attr-{seed}-{i}'
+        attribute, _ = ProductAttribute.objects.get_or_create(
+            code=code,
+            defaults={'name': code.title(), 'type': 'choice', 'attribute_group': group}
+        )
+        attribute_options[attribute] = AttributeOption.objects.bulk_create([
+            AttributeOption(attribute=attribute, value=f'v{j}', display_value=f'Значение {j}', order=j)
+            for j in range(options)
+        ])
+
+    created = Product.objects.bulk_create([
+        Product(
+            name=f'Товар {i} {rnd.choice(["хлопок", "лён", "шерсть"])}',
+            slug=f'bench-product-{seed}-{i}',
+            category=rnd.choice(nodes),
+            description=f'Описание товара {i} ' * 20,
+            price=Decimal(rnd.randint(100, 20000)),
+            stock=rnd.randint(0, 50)
+        )
+        for i in range(products)
+    ])
+    AttributeValue.objects.bulk_create([
+        AttributeValue(product=product, attribute=attribute, option=rnd.choice(choices))
+        for product in created
+        for attribute, choices in attribute_options.items()
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f'products/bench/{product.pk}-{j}.jpg', order=j)
+        for product in created
+        for j in range(images)
+    ])
+    products_bulk_changed.send(sender=Product, product_ids=[product.pk for product in created])
+    # В тестовой транзакции on_commit не срабатывает, агрегаты категорий считаются сразу
+    rebuild_category_stats()
+    return {
+        'categories': nodes,
+        'attributes': list(attribute_options),
+        'products': created,
+    }
+
+
+def get_scenarios(catalog):
+    """Типичные запросы витрины: (имя, URL)"""
+    root = catalog['categories'][0]
+    size, color = catalog['attributes'][:2]
+    products_url = reverse('products-list')
+    return [
+        ('product_list', products_url),
+        ('product_list_filtered', f'{products_url}?category={root.slug}&size=v1,v2&color=v3&min_price=500'),
+        ('product_list_ordered_deep', f'{products_url}?ordering=price&page=3'),
+        ('product_list_grid', f'{products_url}?fields=id,name,slug,price,category_name'),
+        ('product_list_cursor', f'{products_url}?pagination=cursor&ordering=price'),
+        ('product_list_search', f'{products_url}?search=хлопок'),
+        ('product_retrieve', reverse('products-detail', args=[catalog['products'][0].pk])),
+        ('product_facets', f"{reverse('products-facets')}?size=v1&color=v2"),
+        ('category_list', reverse('categories-list')),
+        ('category_tree', f"{reverse('categories-tree')}?counts=true"),
+        ('attribute_options', reverse('attribute-options', args=[size.pk])),
+        ('product_list_full', f'{products_url}?page_size=100'),
+        ('product_list_full_gzip', f'{products_url}?page_size=100'),
+    ]
+
+
+# Заголовки сценариев, проверяющих согласование формата и сжатия
+SCENARIO_HEADERS = {
+    'product_list_full_gzip': {'Accept-Encoding': 'gzip'},
+}
+
+
+def measure(client, url, repeat=20, headers=None):
+    """Один холодный запрос (кэши сброшены) и repeat тёплых"""
+    cache.clear()
+    get_response_cache().local.clear()
+    ProductDocument.objects.all().delete()
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, headers=headers)
+    if response.status_code != 200:
+        raise AssertionError(f'{url}: HTTP {response.status_code}')
+    # Считаем сразу: следующий запрос очистит queries_log через request_started
+    query_count = len(queries)
+
+    timings = []
+    cpu_timings = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            client.get(url, headers=headers)
+            cpu_timings.append((time.process_time() - cpu_started) * 1000)
+            timings.append((time.perf_counter() - started) * 1000)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'queries': query_count,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'cpu_ms': round(statistics.median(cpu_timings), 2),
+        # Тело ответа как на проводе, после сжатия
+        'bytes': len(response.content),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(client, catalog, repeat=20):
+    return {
+        name: measure(client, url, repeat, SCENARIO_HEADERS.get(name))
+        for name, url in get_scenarios(catalog)
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results, size, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'size': size, 'scenarios': results}, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, budget=1.5):
+    """Регрессии относительно базовой линии.
+
+    Число запросов не должно расти вовсе, время, размер ответа и память -
+    не больше чем в budget раз. Метрики, которых нет в базовой линии, не сравниваются.
+    """
+    regressions = []
+    for name, current in results.items():
+        expected = baseline['scenarios'].get(name)
+        if expected is None:
+            continue
+        if current['queries'] > expected['queries']:
+            regressions.append(f"{name}: запросов {current['queries']} > {expected['queries']}")
+        for metric in ('p50_ms', 'p95_ms', 'cpu_ms', 'bytes', 'peak_kb'):
+            if metric in expected and current[metric] > expected[metric] * budget:
+                regressions.append(
+                    f'{name}: {metric} {current[metric]} > {expected[metric]} x {budget}'
+                )
+    return regressions
@@ -0,0 +1,37 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+
+def _generation_key(namespace):
+    return f'catalog:generation:{namespace}'
+
+
+def get_generation(namespace):
+    """Текущее поколение пространства ключей кэша"""
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        # Начальное значение от времени, чтобы после вытеснения не повторять старые ключи
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def bump_generation(namespace):
+    """Инвалидация всех ключей пространства сменой поколения"""
+    key = _generation_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_generation(namespace)
+        return cache.incr(key)
+
+
+def make_key(namespace, *parts, generation=None):
+    """Ключ кэша с поколением и хэшем произвольных частей"""
+    if generation is None:
+        generation = get_generation(namespace)
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'catalog:{namespace}:{generation}:{digest}'
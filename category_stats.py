@@ -0,0 +1,154 @@
+"""Агрегаты товаров по категориям (CategoryStats) с накоплением по предкам.
+
+Поддерево считается целиком, как и фильтр ?category= в списке товаров:
+товар дочерней категории учитывается во всех её предках.
+Изменение товара пересчитывает только цепочку предков его категорий,
+изменение дерева категорий - всю таблицу.
+
+Таблицу заполняет сигнал изменения дерева и команда catalog_category_stats;
+чтение без строки статистики отдаёт нули и ничего не пересчитывает.
+"""
+import threading
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+
+from .caching import bump_generation
+from .models import Category, CategoryStats, Product
+
+# Больше затронутых категорий - дешевле пересчитать всё одним GROUP BY
+MAX_INCREMENTAL = 50
+
+FULL = object()
+
+_pending = threading.local()
+
+
+def _aggregates(prefix, condition=Q()):
+    active = condition & Q(is_active=True)
+    return {
+        f'{prefix}product_count': Count('id', filter=active),
+        f'{prefix}in_stock_count': Count('id', filter=active & Q(stock__gt=0)),
+        f'{prefix}min_price': Min('price', filter=active),
+        f'{prefix}max_price': Max('price', filter=active),
+    }
+
+
+def _save(stats):
+    CategoryStats.objects.bulk_create(
+        [CategoryStats(category_id=pk, **values) for pk, values in stats.items()],
+        update_conflicts=True,
+        unique_fields=['category'],
+        update_fields=['product_count', 'in_stock_count', 'min_price', 'max_price', 'updated_at']
+    )
+    bump_generation('category-counts')
+
+
+def rebuild_category_stats():
+    """Полный пересчёт: один GROUP BY по категориям и свёртка по родителям в памяти"""
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    stats = {
+        pk: {'product_count': 0, 'in_stock_count': 0, 'min_price': None, 'max_price': None}
+        for pk in parents
+    }
+    for row in Product.objects.order_by().values('category_id').annotate(**_aggregates('')):
+        pk = row['category_id']
+        while pk is not None:
+            total = stats[pk]
+            total['product_count'] += row['product_count']
+            total['in_stock_count'] += row['in_stock_count']
+            if row['min_price'] is not None:
+                if total['min_price'] is None:
+                    total['min_price'], total['max_price'] = row['min_price'], row['max_price']
+                else:
+                    total['min_price'] = min(total['min_price'], row['min_price'])
+                    total['max_price'] = max(total['max_price'], row['max_price'])
+            pk = parents.get(pk)
+    _save(stats)
+
+
+def _ancestors(category_ids):
+    """{id: (tree_id, lft, rght)} категорий category_ids и их предков двумя запросами"""
+    nodes = Category.objects.filter(pk__in=list(category_ids)).values_list('tree_id', 'lft', 'rght')
+    conditions = [Q(tree_id=tree_id, lft__lte=lft, rght__gte=rght) for tree_id, lft, rght in nodes]
+    if not conditions:
+        return {}
+    return {
+        pk: (tree_id, lft, rght)
+        for pk, tree_id, lft, rght in Category.objects.filter(reduce(or_, conditions)).values_list(
+            'id', 'tree_id', 'lft', 'rght'
+        )
+    }
+
+
+def refresh_category_stats(category_ids):
+    """Пересчёт категорий category_ids и всех их предков одним агрегатом"""
+    affected = _ancestors(category_ids)
+    if not affected:
+        return
+    if len(affected) > MAX_INCREMENTAL:
+        return rebuild_category_stats()
+
+    aggregates = {}
+    for pk, (tree_id, lft, rght) in affected.items():
+        aggregates.update(_aggregates(
+            f'c{pk}_', Q(category__tree_id=tree_id, category__lft__range=(lft, rght))
+        ))
+    # Товары только внешних диапазонов: вложенные узлы в них уже входят
+    outer = [
+        Q(category__tree_id=tree_id, category__lft__range=(lft, rght))
+        for pk, (tree_id, lft, rght) in affected.items()
+        if not any(
+            other != pk and other_tree == tree_id and other_lft < lft and rght < other_rght
+            for other, (other_tree, other_lft, other_rght) in affected.items()
+        )
+    ]
+    row = Product.objects.filter(reduce(or_, outer)).order_by().aggregate(**aggregates)
+    _save({
+        pk: {
+            name: row[f'c{pk}_{name}']
+            for name in ('product_count', 'in_stock_count', 'min_price', 'max_price')
+        }
+        for pk in affected
+    })
+
+
+def schedule_category_stats(category_ids=FULL):
+    """Пересчёт после коммита; все вызовы в транзакции сворачиваются в один"""
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    if category_ids is FULL:
+        pending.add(FULL)
+    else:
+        pending.update(pk for pk in category_ids if pk is not None)
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    # Один вызов забирает всё накопленное, остальные колбэки транзакции пустые
+    category_ids, _pending.ids = getattr(_pending, 'ids', None), set()
+    if not category_ids:
+        return
+    if FULL in category_ids:
+        rebuild_category_stats()
+    else:
+        refresh_category_stats(category_ids)
+
+
+def stats_data(stats):
+    """Словарь для API; при отсутствии строки статистики - нули"""
+    def price(value):
+        return None if value is None else str(Decimal(value).quantize(Decimal('0.01')))
+
+    if stats is None:
+        return {'product_count': 0, 'in_stock_count': 0, 'min_price': None, 'max_price': None}
+    return {
+        'product_count': stats.product_count,
+        'in_stock_count': stats.in_stock_count,
+        'min_price': price(stats.min_price),
+        'max_price': price(stats.max_price),
+    }
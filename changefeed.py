@@ -0,0 +1,91 @@
+"""Лента изменений товаров для синхронизации внешних систем.
+
+Изменённые товары выбираются по (updated_at, id), удалённые - из
+ProductTombstone по (deleted_at, product_id). Водяной знак - непрозрачная
+строка с последней отданной парой (время, id).
+
+updated_at проставляется при save(), а видна строка только после коммита:
+транзакция, начатая раньше, может закоммитить меньшее время уже после того,
+как водяной знак его прошёл. Поэтому лента отдаёт только изменения старше
+SETTLE_SECONDS - окно должно быть больше самой долгой транзакции записи.
+
+Настройки CATALOG_CHANGEFEED (словарь, см. DEFAULTS).
+"""
+import base64
+import heapq
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Product, ProductTombstone
+
+DEFAULTS = {
+    # Задержка ленты относительно записи, секунды
+    'SETTLE_SECONDS': 5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_CHANGEFEED', {})}
+
+
+def encode_watermark(moment, pk):
+    raw = f'{moment.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_watermark(value):
+    """Водяной знак из ответа или ISO-время; (None, 0) - с начала"""
+    if not value:
+        return None, 0
+    try:
+        moment, pk = base64.urlsafe_b64decode(value.encode('ascii')).decode().split('|')
+        moment = datetime.fromisoformat(moment)
+        return moment, int(pk)
+    except (ValueError, UnicodeError):
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f'Некорректный водяной знак: {value}')
+        return moment, 0
+
+
+def _after(time_field, id_field, moment, pk):
+    if moment is None:
+        return Q()
+    return Q(**{f'{time_field}__gt': moment}) | Q(**{time_field: moment, f'{id_field}__gt': pk})
+
+
+def get_changes(since=None, limit=500):
+    """Изменения после водяного знака в порядке (время, id), не новее окна записи"""
+    moment, pk = decode_watermark(since)
+    # Строки моложе окна ещё могут догнать незакоммиченные транзакции с меньшим временем
+    horizon = timezone.now() - timedelta(seconds=get_config()['SETTLE_SECONDS'])
+
+    changed = Product.objects.filter(
+        _after('updated_at', 'id', moment, pk), updated_at__lt=horizon
+    ).order_by('updated_at', 'id').values_list('updated_at', 'id', 'is_active')[:limit + 1]
+    deleted = ProductTombstone.objects.filter(
+        _after('deleted_at', 'product_id', moment, pk), deleted_at__lt=horizon
+    ).order_by('deleted_at', 'product_id').values_list('deleted_at', 'product_id')[:limit + 1]
+
+    events = heapq.merge(
+        ((updated_at, product_id, 'changed', is_active) for updated_at, product_id, is_active in changed),
+        ((deleted_at, product_id, 'deleted', None) for deleted_at, product_id in deleted),
+        key=lambda event: (event[0], event[1])
+    )
+    events = list(events)
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    result = {'changed': [], 'deleted': [], 'has_more': has_more, 'next': since}
+    for moment, product_id, kind, is_active in events:
+        if kind == 'changed':
+            result['changed'].append({'id': product_id, 'updated_at': moment, 'is_active': is_active})
+        else:
+            result['deleted'].append({'id': product_id, 'deleted_at': moment})
+    if events:
+        result['next'] = encode_watermark(events[-1][0], events[-1][1])
+    return result
@@ -0,0 +1,128 @@
+import threading
+
+from django.db import transaction
+
+from .models import Product, ProductDocument
+from .profiling import profiled
+from .replicas import primary_reads
+from .serializers import ProductSerializer
+
+_pending = threading.local()
+
+# Версия формата документа: увеличивается при изменении полей ProductSerializer.
+# Документы другой версии читаются как отсутствующие и пересобираются командой
+SCHEMA_VERSION = 2
+SCHEMA_KEY = 'schema_version'
+
+
+def current_documents():
+    """Документы текущей версии формата"""
+    return ProductDocument.objects.filter(**{f'data__{SCHEMA_KEY}': SCHEMA_VERSION})
+
+
+def build_documents(product_ids):
+    """Сборка документов через ProductSerializer одним набором запросов"""
+    products = Product.objects.filter(id__in=product_ids).select_related(
+        'category'
+    ).prefetch_related(
+        'images',
+        'attribute_values',
+        'attribute_values__attribute',
+        'attribute_values__option'
+    )
+    return {
+        product.id: {**ProductSerializer(product).data, SCHEMA_KEY: SCHEMA_VERSION}
+        for product in products
+    }
+
+
+def refresh_documents(product_ids):
+    """Пересборка и сохранение документов товаров"""
+    with primary_reads():
+        documents = build_documents(set(product_ids))
+    ProductDocument.objects.bulk_create(
+        [ProductDocument(product_id=pk, data=data) for pk, data in documents.items()],
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['data', 'updated_at']
+    )
+    return documents
+
+
+def refresh_missing_documents(chunk_size=1000):
+    """Сборка отсутствующих и устаревших документов (команда build_product_documents)"""
+    total = 0
+    last_id = 0
+    while True:
+        product_ids = list(
+            Product.objects.filter(pk__gt=last_id).exclude(
+                pk__in=current_documents().values('product_id')
+            ).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not product_ids:
+            return total
+        refresh_documents(product_ids)
+        total += len(product_ids)
+        last_id = product_ids[-1]
+
+
+def absolute_urls(document, request):
+    """Ссылки на изображения - абсолютные, как у ProductSerializer с request в контексте.
+
+    Документы собираются без запроса и хранят ссылки storage.url().
+    """
+    if request is None:
+        return document
+    document = dict(document)
+    if document.get('main_image'):
+        document['main_image'] = request.build_absolute_uri(document['main_image'])
+    if document.get('main_image_srcset'):
+        document['main_image_srcset'] = {
+            width: request.build_absolute_uri(url) for width, url in document['main_image_srcset'].items()
+        }
+    if document.get('images'):
+        document['images'] = [
+            dict(
+                image,
+                image=image['image'] and request.build_absolute_uri(image['image']),
+                srcset={width: request.build_absolute_uri(url) for width, url in image['srcset'].items()}
+            )
+            for image in document['images']
+        ]
+    return document
+
+
+@profiled('documents')
+def get_documents(product_ids, request=None):
+    """Документы в порядке product_ids.
+
+    Недостающие собираются в памяти и не сохраняются: чтение не пишет в БД,
+    документы создают сигналы после коммита и команда build_product_documents.
+    """
+    documents = dict(
+        current_documents().filter(product_id__in=product_ids).values_list('product_id', 'data')
+    )
+    missing = [pk for pk in product_ids if pk not in documents]
+    if missing:
+        documents.update(build_documents(missing))
+    return [absolute_urls(documents[pk], request) for pk in product_ids if pk in documents]
+
+
+def invalidate_documents(product_ids):
+    """Удаление устаревших документов и пересборка после коммита"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    ProductDocument.objects.filter(product_id__in=product_ids).delete()
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(product_ids)
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    # Один вызов забирает всё накопленное, остальные колбэки транзакции пустые
+    product_ids, _pending.ids = getattr(_pending, 'ids', None), set()
+    if product_ids:
+        refresh_documents(product_ids)
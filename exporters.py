@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+import zlib
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from .models import AttributeOption, AttributeValue, Category, Product, ProductAttribute
+
+
+class ProductExporter:
+    """Потоковая выгрузка активных товаров в JSONL/CSV/XML (фид в духе Google Merchant).
+
+    Товары читаются пачками по ключу id, атрибуты подставляются из справочника
+    вариантов в памяти, поэтому память не растёт с размером каталога.
+    Строки JSONL/CSV совместимы с ProductImporter (category - slug, attr_<код>).
+    """
+    formats = ('jsonl', 'csv', 'xml')
+    content_types = {
+        'jsonl': 'application/x-ndjson',
+        'csv': 'text/csv',
+        'xml': 'application/xml'
+    }
+    attribute_prefix = 'attr_'
+    columns = ['id', 'name', 'slug', 'category', 'description', 'price', 'stock', 'is_active', 'image']
+    product_fields = ['id', 'name', 'slug', 'category_id', 'description', 'price', 'stock', 'is_active', 'main_image']
+    xml_namespace = 'http://base.google.com/ns/1.0'
+    # Атрибуты, у которых в фиде есть собственные теги g:<код>
+    xml_attributes = ('color', 'size', 'material', 'pattern', 'gender', 'age_group')
+
+    def __init__(self, fmt, chunk_size=1000, compress=False, base_url=''):
+        if fmt not in self.formats:
+            raise ValueError(f'Неизвестный формат: {fmt}')
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.base_url = base_url.rstrip('/')
+        self.product_url = getattr(settings, 'CATALOG_EXPORT_PRODUCT_URL', '/products/{slug}/')
+        self.currency = getattr(settings, 'CATALOG_EXPORT_CURRENCY', 'RUB')
+
+    @property
+    def content_type(self):
+        return 'application/gzip' if self.compress else self.content_types[self.fmt]
+
+    @property
+    def filename(self):
+        return f'catalog.{self.fmt}' + ('.gz' if self.compress else '')
+
+    def load_lookups(self):
+        """Справочники в памяти вместо prefetch на каждую пачку"""
+        self.categories = {
+            pk: (slug, name)
+            for pk, slug, name in Category.objects.values_list('id', 'slug', 'name')
+        }
+        self.attributes = dict(ProductAttribute.objects.order_by('code').values_list('id', 'code'))
+        self.options = {
+            pk: (attribute_id, value, display_value)
+            for pk, attribute_id, value, display_value in AttributeOption.objects.order_by(
+                'order', 'value'
+            ).values_list('id', 'attribute_id', 'value', 'display_value')
+        }
+        self.option_order = {pk: i for i, pk in enumerate(self.options)}
+        self.image_storage = Product._meta.get_field('main_image').storage
+
+    def products(self):
+        """Активные товары пачками по id (keyset), без OFFSET и COUNT"""
+        last_id = 0
+        while True:
+            rows = list(
+                Product.objects.filter(is_active=True, id__gt=last_id).order_by('id').values(
+                    *self.product_fields
+                )[:self.chunk_size].iterator(chunk_size=self.chunk_size)
+            )
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            values = {}
+            for product_id, option_id in AttributeValue.objects.filter(
+                product_id__in=[row['id'] for row in rows],
+                option__isnull=False
+            ).values_list('product_id', 'option_id').iterator(chunk_size=self.chunk_size):
+                values.setdefault(product_id, []).append(option_id)
+            yield [self.build_item(row, values.get(row['id'], ())) for row in rows]
+            if len(rows) < self.chunk_size:
+                return
+
+    def build_item(self, row, option_ids):
+        slug, category_name = self.categories.get(row['category_id'], ('', ''))
+        attributes = {}
+        for option_id in sorted(option_ids, key=self.option_order.get):
+            attribute_id, value, display_value = self.options[option_id]
+            attributes.setdefault(self.attributes[attribute_id], []).append((value, display_value))
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'slug': row['slug'],
+            'category': slug,
+            'category_name': category_name,
+            'description': row['description'],
+            'price': str(row['price']),
+            'stock': row['stock'],
+            'is_active': row['is_active'],
+            'image': self.image_url(row['main_image']),
+            'attributes': attributes
+        }
+
+    def image_url(self, name):
+        if not name:
+            return ''
+        url = self.image_storage.url(name)
+        return url if '://' in url else self.base_url + url
+
+    def product_link(self, item):
+        return self.base_url + self.product_url.format(slug=item['slug'], id=item['id'])
+
+    # Форматы: каждый метод отдаёт строки частями, по одной на пачку товаров
+
+    def render_jsonl(self):
+        for items in self.products():
+            yield ''.join(
+                json.dumps(dict(item, attributes={
+                    code: [value for value, _ in values]
+                    for code, values in item['attributes'].items()
+                }), ensure_ascii=False) + '\n'
+                for item in items
+            )
+
+    def render_csv(self):
+        codes = list(self.attributes.values())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns + [self.attribute_prefix + code for code in codes])
+        for items in self.products():
+            for item in items:
+                writer.writerow(
+                    [item[column] for column in self.columns] + [
+                        ','.join(value for value, _ in item['attributes'].get(code, ()))
+                        for code in codes
+                    ]
+                )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def render_xml(self):
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<rss version="2.0" xmlns:g="{self.xml_namespace}">\n<channel>\n'
+            f'<title>{escape(getattr(settings, "CATALOG_EXPORT_TITLE", "Catalog"))}</title>\n'
+            f'<link>{escape(self.base_url or "/")}</link>\n'
+        )
+        for items in self.products():
+            yield ''.join(self.xml_item(item) for item in items)
+        yield '</channel>\n</rss>\n'
+
+    def xml_item(self, item):
+        fields = [
+            ('g:id', item['id']),
+            ('g:title', item['name']),
+            ('g:description', item['description']),
+            ('g:link', self.product_link(item)),
+            ('g:image_link', item['image']),
+            ('g:price', f"{item['price']} {self.currency}"),
+            ('g:availability', 'in_stock' if item['stock'] > 0 else 'out_of_stock'),
+            ('g:product_type', item['category_name']),
+        ]
+        fields += [
+            (f'g:{code}', '/'.join(display for _, display in values))
+            for code, values in item['attributes'].items()
+            if code in self.xml_attributes
+        ]
+        return '<item>\n' + ''.join(
+            f'<{tag}>{escape(str(value))}</{tag}>\n' for tag, value in fields if value != ''
+        ) + '</item>\n'
+
+    def stream(self):
+        """Выгрузка частями bytes, при compress - потоковый gzip"""
+        self.load_lookups()
+        chunks = (chunk.encode('utf-8') for chunk in getattr(self, f'render_{self.fmt}')())
+        if not self.compress:
+            yield from chunks
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -1,5 +1,9 @@
+from django.db.models import FloatField, Value
 from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
 from .models import Product, Category, AttributeValue
+from .attribute_index import attribute_index
+from .search import get_search_backend
 
 class ProductFilter(filters.FilterSet):
     """Фильтры для товаров каталога"""
@@ -38,14 +42,37 @@ class ProductFilter(filters.FilterSet):
 
     def filter_size(self, queryset, name, value):
         """Фильтр по размеру"""
-        return queryset.filter(
-            attribute_values__attribute__code='size',
-            attribute_values__option__value=value
-        ).distinct()
+        return self.filter_attribute(queryset, 'size', value)
 
     def filter_color(self, queryset, name, value):
         """Фильтр по цвету"""
-        return queryset.filter(
-            attribute_values__attribute__code='color',
-            attribute_values__option__value=value
-        ).distinct()
\ No newline at end of file
+        return self.filter_attribute(queryset, 'color', value)
+
+    def filter_attribute(self, queryset, code, value):
+        """Фильтр по атрибуту через индекс, значения через запятую - ИЛИ"""
+        product_ids = attribute_index.resolve({code: value})
+        if product_ids is None:
+            return queryset
+        return queryset.filter(id__in=product_ids)
+
+class FullTextSearchFilter(SearchFilter):
+    """Полнотекстовый поиск через индекс БД; без индекса - обычный icontains"""
+    relevance_field = 'relevance'
+
+    def get_search_terms(self, request):
+        # ?search=" или ?search=" " дают пустые термины - поиска по ним нет
+        return [term for term in super().get_search_terms(request) if term.strip()]
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        backend = get_search_backend() if terms else None
+        rank = self.relevance_field in request.query_params.get('ordering', '')
+        if backend is None:
+            queryset = super().filter_queryset(request, queryset, view)
+            if rank:
+                # Сортировка по релевантности без поиска не меняет порядок
+                queryset = queryset.annotate(**{
+                    self.relevance_field: Value(0.0, output_field=FloatField())
+                })
+            return queryset
+        return backend.search(queryset, ' '.join(terms), rank=rank)
@@ -0,0 +1,116 @@
+"""Производные изображения товаров (уменьшенные копии в WebP).
+
+Имена файлов строятся из хэша содержимого оригинала, поэтому повторная
+загрузка того же файла не создаёт новых копий, а CDN может кэшировать
+их бессрочно. Результат хранится в JSON-поле модели:
+{'source': имя оригинала, 'files': {ширина: путь}}.
+
+Настройки CATALOG_IMAGE_VARIANTS (словарь, см. DEFAULTS).
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WIDTHS': (320, 640, 1280),
+    'FORMAT': 'WEBP',
+    'EXTENSION': 'webp',
+    'QUALITY': 80,
+    'UPLOAD_TO': 'products/variants',
+}
+
+# Модель -> (поле оригинала, поле вариантов, поле id товара)
+SOURCES = {
+    Product: ('main_image', 'main_image_variants', 'id'),
+    ProductImage: ('image', 'variants', 'product_id'),
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_IMAGE_VARIANTS', {})}
+
+
+def is_stale(name, variants):
+    """Нужно ли пересобрать варианты для текущего оригинала"""
+    return (variants or {}).get('source', '') != (name or '')
+
+
+def render_variants(name, storage=None):
+    """Варианты изображения name; уже существующие файлы не пересоздаются"""
+    storage = storage or default_storage
+    if not name:
+        return {}
+    config = get_config()
+    with storage.open(name, 'rb') as source:
+        content = source.read()
+    # Формат и качество входят в имя: смена настроек не отдаёт старые файлы под новыми
+    digest = hashlib.sha256(
+        content + f"|{config['FORMAT']}|{config['QUALITY']}".encode()
+    ).hexdigest()[:24]
+    prefix = f"{config['UPLOAD_TO'].rstrip('/')}/{digest[:2]}/{digest}"
+
+    files = {}
+    image = None
+    for width in sorted(config['WIDTHS']):
+        path = f"{prefix}-{width}.{config['EXTENSION']}"
+        if not storage.exists(path):
+            if image is None:
+                image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            # Увеличивать не имеет смысла - ширина ограничена оригиналом
+            if width > image.width and files:
+                break
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, config['FORMAT'], quality=config['QUALITY'])
+            path = storage.save(path, ContentFile(output.getvalue()))
+        files[str(width)] = path
+    return {'source': name, 'files': files}
+
+
+def srcset(variants, storage=None, request=None):
+    """Карта ширина -> URL для srcset; с request - абсолютные URL, как у ImageField"""
+    storage = storage or default_storage
+    urls = {
+        width: storage.url(path)
+        for width, path in (variants or {}).get('files', {}).items()
+    }
+    if request is not None:
+        urls = {width: request.build_absolute_uri(url) for width, url in urls.items()}
+    return urls
+
+
+def refresh_variants(model, pks):
+    """Пересборка устаревших вариантов объектов model; возвращает id затронутых товаров"""
+    source_field, variants_field, product_field = SOURCES[model]
+    storage = model._meta.get_field(source_field).storage
+    product_ids = set()
+    for pk, name, variants, product_id in model.objects.filter(pk__in=pks).values_list(
+        'pk', source_field, variants_field, product_field
+    ):
+        if not is_stale(name, variants):
+            continue
+        try:
+            rendered = render_variants(name, storage)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # Битый или пропавший файл не должен ронять уже закоммиченное сохранение
+            logger.exception('Не удалось собрать варианты изображения %s', name)
+            continue
+        # update() без save(), чтобы не запускать сигналы повторно
+        model.objects.filter(pk=pk).update(**{variants_field: rendered})
+        product_ids.add(product_id)
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+    return product_ids
@@ -0,0 +1,315 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import AttributeOption, AttributeValue, Category, Product, ProductAttribute
+from .signals import products_bulk_changed
+
+
+class ProductImporter:
+    """Потоковый импорт товаров из CSV/JSONL пачками через bulk_create/bulk_update.
+
+    Колонки: name, slug, category (slug категории), description, price, stock,
+    is_active и атрибуты как attr_<код> (в JSONL также словарь attributes).
+    В JSONL значение атрибута - строка или список строк (несколько вариантов).
+    """
+    formats = ('csv', 'jsonl')
+    attribute_prefix = 'attr_'
+    update_fields = ['name', 'category', 'description', 'price', 'stock', 'is_active', 'updated_at']
+
+    def __init__(self, upsert=False, chunk_size=1000, create_options=False, max_errors=1000):
+        self.upsert = upsert
+        self.chunk_size = chunk_size
+        self.create_options = create_options
+        self.max_errors = max_errors
+        self.report = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+
+    def load_lookups(self):
+        """Справочники в памяти вместо запроса на каждую строку"""
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.attributes = dict(ProductAttribute.objects.values_list('code', 'id'))
+        self.options = {
+            (attribute_id, value): option_id
+            for option_id, attribute_id, value in AttributeOption.objects.values_list(
+                'id', 'attribute_id', 'value'
+            )
+        }
+
+    def rows(self, stream, fmt):
+        """Строки файла как (номер строки, словарь или ошибка разбора)"""
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+        elif fmt == 'jsonl':
+            for line_num, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict):
+                        raise ValueError('ожидается объект')
+                    yield line_num, row
+                except ValueError as e:
+                    yield line_num, ValueError(f'Некорректный JSON: {e}')
+        else:
+            raise ValueError(f'Неизвестный формат: {fmt}')
+
+    def run(self, stream, fmt):
+        self.load_lookups()
+        rows = self.rows(stream, fmt)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.process_chunk(chunk)
+        return self.report
+
+    def add_error(self, line, errors):
+        self.report['skipped'] += 1
+        if len(self.report['errors']) < self.max_errors:
+            self.report['errors'].append({'line': line, 'errors': errors})
+
+    def clean_row(self, row):
+        """Проверка строки; возвращает (данные, ошибки)"""
+        errors = {}
+        data = {}
+
+        data['name'] = (row.get('name') or '').strip()
+        if not data['name']:
+            errors['name'] = 'Обязательное поле'
+        else:
+            self.validate_field('name', data['name'], errors)
+
+        category = (row.get('category') or '').strip()
+        data['category_id'] = self.categories.get(category)
+        if data['category_id'] is None:
+            errors['category'] = f'Категория не найдена: {category}'
+
+        try:
+            data['price'] = Decimal(str(row.get('price', '')).strip())
+            if data['price'] < 0 or not data['price'].is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            errors['price'] = 'Некорректная цена'
+        else:
+            self.validate_field('price', data['price'], errors)
+
+        try:
+            data['stock'] = int(row.get('stock') or 0)
+            if data['stock'] < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors['stock'] = 'Некорректный остаток'
+        else:
+            self.validate_field('stock', data['stock'], errors)
+
+        is_active = row.get('is_active')
+        if is_active in (None, ''):
+            is_active = True
+        elif isinstance(is_active, str):
+            is_active = is_active.strip().lower() not in ('0', 'false', 'no', 'нет')
+        data['is_active'] = bool(is_active)
+        data['description'] = row.get('description') or ''
+        data['slug'] = (row.get('slug') or '').strip()
+        if data['slug']:
+            self.validate_field('slug', data['slug'], errors)
+        else:
+            # Slug из длинного названия обрезается до длины поля
+            data['slug'] = (
+                slugify(data['name']) or slugify(data['name'], allow_unicode=True)
+            )[:Product._meta.get_field('slug').max_length].rstrip('-')
+
+        attributes = dict(row.get('attributes') or {})
+        attributes.update(
+            (key[len(self.attribute_prefix):], value)
+            for key, value in row.items()
+            if key and key.startswith(self.attribute_prefix)
+        )
+        data['attributes'] = {}
+        for code, values in attributes.items():
+            values = [
+                str(value).strip()
+                for value in (values if isinstance(values, list) else [values])
+                if value not in (None, '')
+            ]
+            if not values:
+                continue
+            attribute_id = self.attributes.get(code)
+            if attribute_id is None:
+                errors[f'{self.attribute_prefix}{code}'] = 'Атрибут не найден'
+                continue
+            resolved = []
+            for value in dict.fromkeys(values):
+                option_id = self.options.get((attribute_id, value))
+                if option_id is None and not self.create_options:
+                    errors[f'{self.attribute_prefix}{code}'] = f'Значение не найдено: {value}'
+                    break
+                resolved.append((value, option_id))
+            else:
+                data['attributes'][attribute_id] = resolved
+        return data, errors
+
+    def validate_field(self, name, value, errors):
+        """Ограничения поля модели (длина, разрядность), чтобы пачка не упала в БД"""
+        try:
+            Product._meta.get_field(name).run_validators(value)
+        except ValidationError as e:
+            errors[name] = ' '.join(e.messages)
+
+    def assign_unique_slugs(self, items):
+        """Дедупликация slug пачкой: base, base-2, base-3... без запроса на строку"""
+        max_length = Product._meta.get_field('slug').max_length
+        pending = {id(data): (data, data['slug'], 1) for data in items}
+        taken = set()
+        while pending:
+            candidates = {
+                key: base if n == 1 else f'{base[:max_length - len(str(n)) - 1]}-{n}'
+                for key, (data, base, n) in pending.items()
+            }
+            existing = set(Product.objects.filter(
+                slug__in=candidates.values()
+            ).values_list('slug', flat=True))
+            for key, slug in candidates.items():
+                data, base, n = pending.pop(key)
+                if slug in existing or slug in taken:
+                    pending[key] = (data, base, n + 1)
+                else:
+                    data['slug'] = slug
+                    taken.add(slug)
+
+    def create_missing_options(self, items):
+        missing = {
+            (attribute_id, value)
+            for data in items
+            for attribute_id, values in data['attributes'].items()
+            for value, option_id in values
+            if option_id is None
+        }
+        if not missing:
+            return
+        AttributeOption.objects.bulk_create(
+            [AttributeOption(attribute_id=a, value=v, display_value=v) for a, v in missing],
+            ignore_conflicts=True
+        )
+        for option_id, attribute_id, value in AttributeOption.objects.filter(
+            attribute_id__in={a for a, _ in missing},
+            value__in={v for _, v in missing}
+        ).values_list('id', 'attribute_id', 'value'):
+            self.options[(attribute_id, value)] = option_id
+
+    def process_chunk(self, chunk):
+        items = []
+        seen_slugs = set()
+        for line, row in chunk:
+            if isinstance(row, Exception):
+                self.add_error(line, {'row': str(row)})
+                continue
+            data, errors = self.clean_row(row)
+            if self.upsert and data.get('slug') in seen_slugs:
+                errors['slug'] = 'Повторяющийся slug'
+            if errors:
+                self.add_error(line, errors)
+                continue
+            seen_slugs.add(data['slug'])
+            data['line'] = line
+            items.append(data)
+        if not items:
+            return
+
+        # Конкурентный импорт мог занять slug между проверкой и вставкой:
+        # пачка повторяется один раз, со второй неудачи её строки уходят в ошибки
+        slugs = [data['slug'] for data in items]
+        for attempt in range(2):
+            for data, slug in zip(items, slugs):
+                data['slug'] = slug
+                data.pop('product', None)
+                data.pop('existing', None)
+            try:
+                created, updated = self.save_chunk(items)
+            except IntegrityError as e:
+                if attempt:
+                    for data in items:
+                        self.add_error(data['line'], {'row': f'Ошибка сохранения: {e}'})
+                    return
+            else:
+                break
+
+        self.report['created'] += created
+        self.report['updated'] += updated
+
+    def save_chunk(self, items):
+        """Запись пачки в одной транзакции; возвращает (создано, обновлено)"""
+        with transaction.atomic():
+            existing = {}
+            if self.upsert:
+                existing = Product.objects.in_bulk(
+                    [data['slug'] for data in items], field_name='slug'
+                )
+            new_items = [data for data in items if data['slug'] not in existing]
+            self.assign_unique_slugs(new_items)
+            if self.create_options:
+                self.create_missing_options(items)
+
+            now = timezone.now()
+            to_update = []
+            for data in items:
+                product = existing.get(data['slug'])
+                if product is None:
+                    continue
+                for field in ('name', 'category_id', 'description', 'price', 'stock', 'is_active'):
+                    setattr(product, field, data[field])
+                product.updated_at = now
+                data['product'] = product
+                data['existing'] = True
+                to_update.append(product)
+            if to_update:
+                Product.objects.bulk_update(to_update, self.update_fields)
+
+            created = Product.objects.bulk_create([
+                Product(**{
+                    field: data[field]
+                    for field in ('name', 'slug', 'category_id', 'description', 'price', 'stock', 'is_active')
+                })
+                for data in new_items
+            ])
+            for data, product in zip(new_items, created):
+                data['product'] = product
+
+            # Значения атрибутов заменяются только для переданных атрибутов,
+            # удаление старых - по одному запросу на набор атрибутов.
+            # Без post_delete на каждую строку: индекс, документы и updated_at
+            # обновляет один products_bulk_changed ниже
+            replaced = [data for data in items if data['attributes']]
+            stale = {}
+            for data in replaced:
+                if data.get('existing'):
+                    stale.setdefault(frozenset(data['attributes']), []).append(data['product'].pk)
+            for attribute_ids, product_ids in stale.items():
+                values = AttributeValue.objects.filter(
+                    product_id__in=product_ids,
+                    attribute_id__in=attribute_ids
+                )
+                values._raw_delete(values.db)
+            AttributeValue.objects.bulk_create([
+                AttributeValue(
+                    product=data['product'],
+                    attribute_id=attribute_id,
+                    option_id=option_id or self.options[(attribute_id, value)]
+                )
+                for data in replaced
+                for attribute_id, values in data['attributes'].items()
+                for value, option_id in values
+            ])
+
+            products_bulk_changed.send(
+                sender=Product,
+                product_ids=[data['product'].pk for data in items]
+            )
+        return len(created), len(to_update)
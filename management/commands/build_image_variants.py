@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from catalog.images import SOURCES, is_stale, render_variants
+from catalog.models import Product
+from catalog.signals import products_bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Создаёт производные изображения товаров в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Число процессов, по умолчанию по числу CPU')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересобрать варианты для всех изображений, а не только устаревших'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        pending = {}
+        for model, (source_field, variants_field, product_field) in SOURCES.items():
+            rows = model.objects.exclude(**{source_field: ''}).exclude(
+                **{f'{source_field}__isnull': True}
+            ).values_list('pk', source_field, variants_field, product_field).iterator()
+            pending[model] = [
+                (pk, name, product_id)
+                for pk, name, variants, product_id in rows
+                if options['force'] or is_stale(name, variants)
+            ]
+        names = sorted({name for rows in pending.values() for _, name, _ in rows})
+        if not names:
+            self.stdout.write('Все варианты актуальны')
+            return
+
+        # Дочерние процессы работают только с файлами и не трогают БД; соединение
+        # вызывающего кода не закрывается - команда может идти внутри atomic()
+        results = {}
+        failed = {}
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(render_variants, name): name for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # Битый файл пропускается, варианты остаются устаревшими до исправления
+                    failed[name] = e
+                    self.stderr.write(f'{name}: {e}')
+
+        product_ids = set()
+        for model, rows in pending.items():
+            _, variants_field, _ = SOURCES[model]
+            rows = [row for row in rows if row[1] in results]
+            model.objects.bulk_update(
+                [model(pk=pk, **{variants_field: results[name]}) for pk, name, _ in rows],
+                [variants_field],
+                batch_size=options['batch_size']
+            )
+            product_ids.update(product_id for _, _, product_id in rows)
+        Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+        products_bulk_changed.send(sender=Product, product_ids=product_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {len(results)}, товаров: {len(product_ids)}'
+        ))
+        if failed:
+            self.stderr.write(self.style.ERROR(f'Ошибок: {len(failed)}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from catalog.documents import refresh_documents, refresh_missing_documents
+from catalog.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Собирает недостающие и устаревшие документы товаров (read model); --all - пересобирает все'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Пересобрать и существующие документы')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['all']:
+            total = refresh_missing_documents(options['chunk_size'])
+        else:
+            total = 0
+            ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(ids), options['chunk_size']):
+                total += len(refresh_documents(ids[start:start + options['chunk_size']]))
+        self.stdout.write(self.style.SUCCESS(f'Собрано документов: {total}'))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from catalog import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк API каталога на синтетических данных во временной БД'
+
+    def add_arguments(self, parser):
+        for name, default in benchmarks.DEFAULT_SIZE.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--budget',
+            type=float,
+            default=1.5,
+            help='Допустимый рост времени и памяти относительно базовой линии'
+        )
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Сохранить результаты как новую базовую линию'
+        )
+
+    def handle(self, *args, **options):
+        size = {name: options[name] for name in benchmarks.DEFAULT_SIZE}
+
+        # Данные генерируются в отдельной тестовой БД, рабочая не затрагивается
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False):
+                catalog = benchmarks.seed_catalog(**size)
+                results = benchmarks.run_benchmarks(Client(), catalog, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, metrics in results.items():
+            self.stdout.write(
+                f"{name:<28} запросов {metrics['queries']:>3}  "
+                f"p50 {metrics['p50_ms']:>8} мс  p95 {metrics['p95_ms']:>8} мс  "
+                f"CPU {metrics['cpu_ms']:>8} мс  ответ {metrics['bytes']:>8} Б  "
+                f"память {metrics['peak_kb']:>9} КБ"
+            )
+
+        if options['update_baseline']:
+            benchmarks.save_baseline(results, size)
+            self.stdout.write(self.style.SUCCESS('Базовая линия обновлена'))
+            return
+
+        baseline = benchmarks.load_baseline()
+        if baseline.get('size') != size:
+            self.stderr.write('Размер каталога отличается от базовой линии, время несопоставимо')
+        regressions = benchmarks.compare(results, baseline, options['budget'])
+        if regressions:
+            raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog.category_stats import rebuild_category_stats
+from catalog.models import CategoryStats
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает агрегаты товаров по категориям'
+
+    def handle(self, *args, **options):
+        rebuild_category_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано категорий: {CategoryStats.objects.count()}'
+        ))
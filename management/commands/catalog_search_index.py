@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Создаёт полнотекстовый индекс товаров и заполняет его'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-rebuild',
+            action='store_true',
+            help='Только создать индекс, не перестраивая содержимое'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(require_index=False)
+        if backend is None:
+            raise CommandError('Полнотекстовый поиск не поддерживается для этой БД')
+        backend.ensure_index()
+        if not options['no_rebuild']:
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Индекс готов: {type(backend).__name__}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.similarity import is_available, rebuild_neighbors
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает похожие товары (нужны numpy и scipy)'
+
+    def handle(self, *args, **options):
+        if not is_available():
+            raise CommandError('Для расчёта похожих товаров установите numpy и scipy')
+        total = rebuild_neighbors()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано товаров: {total}'))
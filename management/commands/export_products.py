@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from catalog.exporters import ProductExporter
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка активных товаров в JSONL, CSV или XML-фид'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Файл выгрузки, по умолчанию stdout')
+        parser.add_argument('--format', choices=ProductExporter.formats, default='jsonl')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать выгрузку gzip')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--base-url',
+            default='',
+            help='Адрес сайта для ссылок на товары и изображения'
+        )
+
+    def handle(self, *args, **options):
+        exporter = ProductExporter(
+            options['format'],
+            chunk_size=options['chunk_size'],
+            compress=options['gzip'],
+            base_url=options['base_url']
+        )
+        if options['path'] == '-':
+            for chunk in exporter.stream():
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['path'], 'wb') as output:
+            for chunk in exporter.stream():
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Выгрузка сохранена: {options['path']}"))
@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importers import ProductImporter
+
+
+class Command(BaseCommand):
+    help = 'Импорт товаров из CSV или JSONL пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу CSV или JSONL')
+        parser.add_argument(
+            '--format',
+            choices=ProductImporter.formats,
+            help='Формат файла, по умолчанию по расширению'
+        )
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Обновлять существующие товары с тем же slug'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--create-options',
+            action='store_true',
+            help='Создавать отсутствующие значения атрибутов'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ProductImporter.formats:
+            raise CommandError(f'Неизвестный формат: {fmt}')
+
+        importer = ProductImporter(
+            upsert=options['upsert'],
+            chunk_size=options['chunk_size'],
+            create_options=options['create_options']
+        )
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = importer.run(stream, fmt)
+
+        for error in report['errors']:
+            self.stderr.write(f"Строка {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: {report['created']}, обновлено: {report['updated']}, "
+            f"пропущено: {report['skipped']}"
+        ))
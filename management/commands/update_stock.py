@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.stock import StockUpdater
+
+
+class Command(BaseCommand):
+    help = 'Пакетное обновление остатков из файла склада CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу CSV или JSONL')
+        parser.add_argument(
+            '--format',
+            choices=StockUpdater.formats,
+            help='Формат файла, по умолчанию по расширению'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in StockUpdater.formats:
+            raise CommandError(f'Неизвестный формат: {fmt}')
+
+        updater = StockUpdater(chunk_size=options['chunk_size'])
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = updater.run(stream, fmt)
+
+        for error in report['errors']:
+            self.stderr.write(f"Строка {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Обновлено: {report['updated']}, пропущено: {report['skipped']}"
+        ))
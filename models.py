@@ -50,6 +50,28 @@ class Category(MPTTModel):
     def __str__(self):
         return self.name
 
+class CategoryStats(models.Model):
+    """Агрегаты активных товаров категории вместе со всем поддеревом"""
+    category = models.OneToOneField(
+        Category,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Категория'
+    )
+    product_count = models.PositiveIntegerField('Товаров', default=0)
+    in_stock_count = models.PositiveIntegerField('В наличии', default=0)
+    min_price = models.DecimalField('Мин. цена', max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField('Макс. цена', max_digits=10, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField('Обновлено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Статистика категории'
+        verbose_name_plural = 'Статистика категорий'
+
+    def __str__(self):
+        return str(self.category_id)
+
 class Size(models.Model):
     name = models.CharField('Значение', max_length=10, unique=True)  # XS, S, M, L и т.д.
     display_name = models.CharField('Отображаемое имя', max_length=50)
@@ -117,20 +139,124 @@ class Product(models.Model):
         null=True,
         blank=True
     )
+    # Производные изображения: {'source': имя оригинала, 'files': {ширина: путь}}
+    main_image_variants = models.JSONField('Варианты главного изображения', default=dict, blank=True)
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
+        indexes = [
+            # Лента изменений: выборка по (updated_at, id) после водяного знака
+            models.Index(fields=['updated_at', 'id'], name='catalog_product_changes_idx'),
+        ]
+
+    # Поля, изменения которых отслеживают сигналы (signals.py)
+    TRACKED_FIELDS = ('name', 'slug', 'category_id', 'price', 'stock', 'is_active')
 
     def __str__(self):
         return self.name
 
+    def previous_values(self, update_fields=None):
+        """Значения TRACKED_FIELDS в БД до сохранения; {} для нового товара.
+
+        Читаются только поля, которые сохранение может изменить:
+        с update_fields остальные заведомо совпадают с текущими.
+        """
+        if self._state.adding or self.pk is None:
+            return {}
+        # Отложенные поля (only/defer) не сохраняются и не читаются
+        loaded = [field for field in self.TRACKED_FIELDS if field in self.__dict__]
+        fields = loaded
+        if update_fields is not None:
+            updated = {self._meta.get_field(name).attname for name in update_fields}
+            fields = [field for field in fields if field in updated]
+        previous = {field: self.__dict__[field] for field in loaded}
+        if fields:
+            stored = type(self)._base_manager.filter(pk=self.pk).values(*fields).first()
+            if stored is None:
+                return {}
+            previous.update(stored)
+        return previous
+
+    def tracked_changes(self, fields):
+        """Изменилось ли при последнем save() хоть одно из fields; новый товар - изменён"""
+        previous = getattr(self, '_previous_values', None)
+        if not previous:
+            return True
+        return any(
+            field in previous and previous[field] != self.__dict__.get(field)
+            for field in fields
+        )
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        # Сигналы post_save сравнивают с этими значениями, что именно изменилось
+        self._previous_values = self.previous_values(kwargs.get('update_fields'))
         super().save(*args, **kwargs)
 
+class ProductTombstone(models.Model):
+    """Запись об удалённом товаре для ленты изменений"""
+    product_id = models.BigIntegerField('ID товара', unique=True)
+    slug = models.SlugField('URL', null=True, blank=True)
+    deleted_at = models.DateTimeField('Удален', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Удалённый товар'
+        verbose_name_plural = 'Удалённые товары'
+        indexes = [
+            models.Index(fields=['deleted_at', 'product_id'], name='catalog_tombstone_changes_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.product_id)
+
+class ProductDocument(models.Model):
+    """Денормализованный документ товара для чтения (готовый ответ API)"""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document',
+        verbose_name='Товар'
+    )
+    data = models.JSONField('Документ')
+    updated_at = models.DateTimeField('Обновлен', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Документ товара'
+        verbose_name_plural = 'Документы товаров'
+
+    def __str__(self):
+        return str(self.product_id)
+
+class ProductNeighbor(models.Model):
+    """Похожий товар (предрасчёт по атрибутам, категории и цене)"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+        verbose_name='Товар'
+    )
+    neighbor = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий товар'
+    )
+    rank = models.PositiveSmallIntegerField('Место')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий товар'
+        verbose_name_plural = 'Похожие товары'
+        ordering = ['product', 'rank']
+        unique_together = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id}"
+
 class ProductImage(models.Model):
     product = models.ForeignKey(
         Product,
@@ -142,6 +268,7 @@ class ProductImage(models.Model):
         'Изображение',
         upload_to='products/%Y/%m/%d/'
     )
+    variants = models.JSONField('Варианты изображения', default=dict, blank=True)
     order = models.IntegerField('Порядок', default=0)
 
     class Meta:
@@ -1,8 +1,63 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .caching import make_key
+from .profiling import profile_phase
+from .response_cache import catalog_version
+
+class CountProfilingPaginator(Paginator):
+    """Paginator, выделяющий COUNT(*) в отдельную фазу профиля"""
+
+    @cached_property
+    def count(self):
+        with profile_phase('count'):
+            return super().count
+
+class LimitedCountPaginator(Paginator):
+    """Paginator без полного COUNT(*): считает не больше count_limit строк.
+
+    На больших таблицах точное число заменяется оценкой статистики PostgreSQL
+    (для запроса без фильтров) либо самим порогом - номера страниц дальше
+    порога в админке всё равно не нужны.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        queryset = self.object_list.order_by()
+        count = queryset.values('pk')[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        return max(self.estimate(queryset) or 0, self.count_limit)
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
 
 class StandardResultsSetPagination(PageNumberPagination):
     """Стандартный пагинатор для каталога"""
+    django_paginator_class = CountProfilingPaginator
     page_size = 12  # Товаров на странице
     page_size_query_param = 'page_size'
     max_page_size = 100
@@ -18,6 +73,7 @@ class StandardResultsSetPagination(PageNumberPagination):
         })
 
 class ProductPagination(PageNumberPagination):
+    django_paginator_class = CountProfilingPaginator
     page_size = 12
     page_size_query_param = 'page_size'
     max_page_size = 100
@@ -31,4 +87,148 @@ class ProductPagination(PageNumberPagination):
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data
-        })
\ No newline at end of file
+        })
+
+class ProductCursorPagination(BasePagination):
+    """Keyset-пагинация товаров по (поле сортировки, id) без COUNT(*) и OFFSET"""
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_param = 'ordering'
+    ordering_fields = ('price', 'created_at', 'name')
+    default_ordering = '-created_at'
+    count_cache_timeout = 300  # Приблизительный total из кэша; None - не отдавать
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request, view)
+        cursor = self.decode_cursor(request)
+        self.count = self.get_cached_count(queryset, request, compute=cursor is None)
+
+        # При движении назад идём в обратном порядке и разворачиваем страницу
+        reverse = cursor is not None and cursor['reverse']
+        descending = self.descending != reverse
+        sign = '-' if descending else ''
+        queryset = queryset.order_by(sign + self.field, sign + 'id')
+        if cursor is not None:
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': cursor['value']}) |
+                Q(**{self.field: cursor['value'], f'id__{lookup}': cursor['id']})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, view):
+        """Первое допустимое поле из ?ordering=, иначе сортировка view"""
+        terms = request.query_params.get(self.ordering_param, '').split(',')
+        ordering = getattr(view, 'ordering', None) or self.default_ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        for term in [t.strip() for t in terms] + list(ordering):
+            if term.removeprefix('-') in self.ordering_fields:
+                return term.removeprefix('-'), term.startswith('-')
+        return self.default_ordering.removeprefix('-'), self.default_ordering.startswith('-')
+
+    def get_cached_count(self, queryset, request, compute):
+        """Общее количество считается только на первой странице и берётся из кэша.
+
+        Ключ содержит версию каталога: любое изменение товаров сбрасывает счётчик.
+        """
+        if self.count_cache_timeout is None:
+            return None
+        params = sorted(
+            (key, value) for key, value in request.query_params.lists()
+            if key not in (self.cursor_query_param, self.page_size_query_param)
+        )
+        cache_key = make_key('keyset-count', params, generation=catalog_version())
+        count = cache.get(cache_key)
+        if count is None and compute:
+            with profile_phase('count'):
+                count = queryset.count()
+            cache.set(cache_key, count, self.count_cache_timeout)
+        return count
+
+    def encode_cursor(self, item, reverse):
+        # Строка страницы - объект модели или словарь из .values()
+        if isinstance(item, dict):
+            value, pk = item[self.field], item['id']
+        else:
+            value, pk = getattr(item, self.field), item.pk
+        payload = {
+            'f': ('-' if self.descending else '') + self.field,
+            'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+            'i': pk,
+            'r': reverse,
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            ordering = ('-' if self.descending else '') + self.field
+            if payload['f'] != ordering or not isinstance(payload['i'], int):
+                raise ValueError(payload['f'])
+            return {
+                'value': str(payload['v']),
+                'id': payload['i'],
+                'reverse': bool(payload['r']),
+            }
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1], False)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[0], True)
+        )
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count  # Приблизительное, из кэша
+        response.update({
+            'page_size': self.page_size,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+        return Response(response)
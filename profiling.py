@@ -0,0 +1,149 @@
+"""Профилирование запросов API каталога по фазам.
+
+Включается настройкой CATALOG_PROFILING_ENABLED и подключением
+catalog.profiling.CatalogProfilingMiddleware. Доля профилируемых запросов -
+CATALOG_PROFILING_SAMPLE_RATE (0..1). Результат отдаётся заголовком
+Server-Timing и записью в лог catalog.profiling.
+"""
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('catalog.profiling')
+
+_current_profile = ContextVar('catalog_profile', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """SQL без литералов и длины списков IN - для поиска повторов (N+1)"""
+    return _IN_LISTS.sub('IN (...)', _LITERALS.sub('?', sql))
+
+
+class RequestProfile:
+    """Время и число SQL-запросов по фазам одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.phase_queries = Counter()
+        self.stack = []
+        self.queries = 0
+        self.query_time = 0.0
+        self.fingerprints = Counter()
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: учитываем каждый запрос в текущей фазе
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started
+            self.queries += 1
+            self.phase_queries[self.stack[-1] if self.stack else 'other'] += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold=2):
+        return [
+            {'sql': sql[:300], 'count': count}
+            for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+    def as_dict(self):
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'db_ms': round(self.query_time * 1000, 2),
+            'queries': self.queries,
+            'phases': {
+                name: {
+                    'ms': round(duration * 1000, 2),
+                    'queries': self.phase_queries.get(name, 0)
+                }
+                for name, duration in self.phases.items()
+            },
+            'duplicates': self.duplicates(),
+        }
+
+    def server_timing(self):
+        data = self.as_dict()
+        entries = [
+            f'{name};dur={phase["ms"]};desc="{phase["queries"]} queries"'
+            for name, phase in data['phases'].items()
+        ]
+        duplicates = sum(item['count'] - 1 for item in data['duplicates'])
+        entries.append(
+            f'db;dur={data["db_ms"]};desc="{data["queries"]} queries, {duplicates} duplicates"'
+        )
+        entries.append(f'total;dur={data["total_ms"]}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def profile_phase(name):
+    """Замер фазы; без активного профиля почти ничего не стоит"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - started)
+        profile.stack.pop()
+
+
+def profiled(name):
+    """Декоратор: выполнение функции как фаза профиля"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class CatalogProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        enabled = getattr(settings, 'CATALOG_PROFILING_ENABLED', False)
+        sample_rate = getattr(settings, 'CATALOG_PROFILING_SAMPLE_RATE', 1.0)
+        if not enabled or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        response['Server-Timing'] = profile.server_timing()
+        logger.info(
+            'catalog profile %s %s',
+            request.method,
+            request.path,
+            extra={'catalog_profile': profile.as_dict(), 'path': request.path}
+        )
+        return response
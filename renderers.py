@@ -0,0 +1,107 @@
+"""Быстрые рендереры ответов каталога.
+
+OrjsonRenderer выдаёт те же байты, что JSONRenderer DRF, но кодирует
+через orjson; Decimal, datetime и прочие нестандартные типы уходят
+в encoders.JSONEncoder DRF, поэтому формат значений не меняется.
+MessagePackRenderer (application/msgpack) выбирается заголовком Accept
+или ?format=msgpack.
+
+orjson и msgpack необязательны: без них подключаются стандартные рендереры.
+Настройки CATALOG_RENDERERS (словарь, см. DEFAULTS).
+"""
+from django.conf import settings
+from rest_framework.utils import encoders
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULTS = {
+    # JSON через orjson вместо json.dumps
+    'FAST_JSON': False,
+    # MessagePack по Accept: application/msgpack
+    'MSGPACK': True,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_RENDERERS', {})}
+
+
+_encoder = encoders.JSONEncoder()
+
+
+class OrjsonRenderer(JSONRenderer):
+    """JSONRenderer на orjson; отступы и ensure_ascii - через json.dumps родителя"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        content = orjson.dumps(
+            data,
+            default=_encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        # Как в JSONRenderer: U+2028/U+2029 экранируются для совместимости с JavaScript
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack; значения нестандартных типов - как в JSON-ответе"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+def get_renderer_classes(classes=None):
+    """Рендереры с заменой JSON и MessagePack по настройкам.
+
+    classes - явный набор view: в нём только JSON заменяется на orjson,
+    MessagePack добавляется лишь к рендерерам по умолчанию DRF.
+    """
+    config = get_config()
+    defaults = classes is None
+    classes = list(api_settings.DEFAULT_RENDERER_CLASSES if defaults else classes)
+    if config['FAST_JSON'] and orjson is not None:
+        classes = [OrjsonRenderer if cls is JSONRenderer else cls for cls in classes]
+    if defaults and config['MSGPACK'] and msgpack is not None:
+        classes.append(MessagePackRenderer)
+    return classes
+
+
+def json_renderer():
+    """Рендерер для ответов, собираемых без согласования (дерево категорий, async-страница)"""
+    if get_config()['FAST_JSON'] and orjson is not None:
+        return OrjsonRenderer()
+    return JSONRenderer()
+
+
+class FastRenderersMixin:
+    """Набор рендереров по CATALOG_RENDERERS, проверяется на каждый запрос"""
+
+    def get_renderers(self):
+        # renderer_classes, заданный у view или action, сохраняется
+        classes = None if self.renderer_classes is APIView.renderer_classes else self.renderer_classes
+        return [renderer() for renderer in get_renderer_classes(classes)]
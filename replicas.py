@@ -0,0 +1,204 @@
+"""Чтение каталога с реплик БД.
+
+ReplicaRouter отправляет чтения на реплику только внутри запроса,
+помеченного ReplicaReadMixin (или декоратором replica_reads): безопасный
+метод и у клиента нет свежей записи. После успешного небезопасного
+запроса клиент получает cookie и STICKY_SECONDS читает с основной БД.
+Реплика с отставанием больше MAX_LAG_SECONDS или недоступная
+пропускается до следующей проверки; без живых реплик чтения идут в default.
+
+Подключение в настройках проекта:
+
+    DATABASES = {'default': {...}, 'replica': {..., 'TEST': {'MIRROR': 'default'}}}
+    DATABASE_ROUTERS = ['catalog.replicas.ReplicaRouter']
+    CATALOG_REPLICAS = {'DATABASES': ['replica']}
+
+Соединения стоит держать постоянными: CONN_MAX_AGE (например, 60) и
+CONN_HEALTH_CHECKS = True у каждой БД - иначе каждый запрос открывает
+новое соединение, а с проверкой Django сам заменит оборванное.
+
+Кэши без срока жизни (индекс атрибутов, диапазоны категорий, карта
+вариантов, дерево категорий) и документы товаров заполняются чтением
+с основной БД (primary_reads): отставшая копия жила бы в них до следующей
+инвалидации. Кэши ответов и фасетов, заполненные с реплики, могут
+отставать от записи на MAX_LAG_SECONDS до своего TIMEOUT или смены версии.
+
+Настройки CATALOG_REPLICAS (словарь, см. DEFAULTS).
+"""
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DATABASES': [],
+    'STICKY_SECONDS': 10,
+    'STICKY_COOKIE': 'catalog_primary',
+    'MAX_LAG_SECONDS': 5,
+    # Как часто процесс перепроверяет отставание и доступность реплики
+    'HEALTH_CHECK_INTERVAL': 5,
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Алиас реплики для чтений текущего запроса; None - основная БД
+read_database = ContextVar('catalog_read_database', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_REPLICAS', {})}
+
+
+def replication_lag(alias):
+    """Отставание реплики в секундах; None - не удалось определить"""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        # На основной БД (или без репликации) pg_last_xact_replay_timestamp() - NULL
+        cursor.execute(
+            'SELECT CASE WHEN pg_is_in_recovery() '
+            'THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END'
+        )
+        lag = cursor.fetchone()[0]
+    return None if lag is None else float(lag)
+
+
+class ReplicaHealth:
+    """Состояние реплик процесса с перепроверкой не чаще HEALTH_CHECK_INTERVAL"""
+
+    def __init__(self):
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, alias, config):
+        now = time.monotonic()
+        checked_at, healthy = self.checked.get(alias, (None, False))
+        if checked_at is not None and now - checked_at < config['HEALTH_CHECK_INTERVAL']:
+            return healthy
+        with self.lock:
+            try:
+                lag = replication_lag(alias)
+                healthy = lag is not None and lag <= config['MAX_LAG_SECONDS']
+                if not healthy:
+                    logger.warning('Реплика %s отстаёт: %s с', alias, lag)
+            except DatabaseError:
+                logger.warning('Реплика %s недоступна', alias, exc_info=True)
+                healthy = False
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+    def reset(self):
+        self.checked.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+def is_sticky(request, config):
+    try:
+        return float(request.COOKIES.get(config['STICKY_COOKIE'], 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def choose_replica(request):
+    """Алиас реплики для чтений запроса или None"""
+    config = get_config()
+    if not config['DATABASES'] or request.method not in SAFE_METHODS or is_sticky(request, config):
+        return None
+    healthy = [alias for alias in config['DATABASES'] if replica_health.is_healthy(alias, config)]
+    return random.choice(healthy) if healthy else None
+
+
+def mark_sticky(request, response):
+    """После успешной записи клиент читает с основной БД STICKY_SECONDS"""
+    config = get_config()
+    if config['DATABASES'] and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            config['STICKY_COOKIE'],
+            str(time.time() + config['STICKY_SECONDS']),
+            max_age=config['STICKY_SECONDS'],
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+class ReplicaRouter:
+    """Чтения помеченных запросов - на реплику, всё остальное - в default"""
+
+    def db_for_read(self, model, **hints):
+        # Небезопасные запросы реплику не получают, поэтому записанное ими читается с default
+        return read_database.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, объекты из разных алиасов совместимы
+        pool = {DEFAULT_DB_ALIAS, *get_config()['DATABASES']}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы ViewSet читают с реплики, если клиент не писал только что"""
+
+    def dispatch(self, request, *args, **kwargs):
+        token = read_database.set(choose_replica(request))
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_database.reset(token)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return mark_sticky(request, response)
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока - с основной БД, даже в запросе на реплике.
+
+    Для чтений, которые заполняют кэши без срока или пишут read model.
+    Работает и как декоратор.
+    """
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def replica_reads(view):
+    """То же для функциональных view, в том числе асинхронных"""
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # Проверка отставания - синхронный запрос к реплике
+            token = read_database.set(await sync_to_async(choose_replica)(request))
+            try:
+                return mark_sticky(request, await view(request, *args, **kwargs))
+            finally:
+                read_database.reset(token)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = read_database.set(choose_replica(request))
+            try:
+                return mark_sticky(request, view(request, *args, **kwargs))
+            finally:
+                read_database.reset(token)
+    return wrapper
@@ -0,0 +1,254 @@
+"""Кэш ответов каталога с версионной инвалидацией.
+
+Ключ - путь и нормализованные параметры запроса плюс версия каталога,
+которую сигналы увеличивают при любом изменении товаров и категорий,
+кроме резерва остатка без перехода через ноль (он виден через TIMEOUT).
+Локальный LRU процесса стоит перед общим кэшем Django, холодный ключ
+пересчитывает только один воркер (блокировка через cache.add).
+
+Для JSON и MessagePack кэшируются и готовые байты ответа, сжатые под
+Accept-Encoding клиента (br, если установлен brotli, иначе gzip):
+горячая страница не рендерится и не сжимается повторно.
+
+Настройки CATALOG_RESPONSE_CACHE (словарь, см. DEFAULTS).
+"""
+import gzip
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+
+from .caching import bump_generation, get_generation, make_key
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_MAX_BYTES': 32 * 1024 * 1024,
+    'LOCK_TIMEOUT': 10,
+    'LOCK_WAIT': 3.0,
+    # Кэш отрендеренных и сжатых ответов
+    'PRECOMPRESS': True,
+    'COMPRESS_MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+VERSION_NAMESPACE = 'catalog'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_RESPONSE_CACHE', {})}
+
+
+def catalog_version():
+    return get_generation(VERSION_NAMESPACE)
+
+
+def bump_catalog_version():
+    return bump_generation(VERSION_NAMESPACE)
+
+
+class LocalLRUCache:
+    """LRU в памяти процесса, ограниченный числом записей и объёмом в байтах"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = value
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class ResponseCache:
+    namespace = 'responses'
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.local = LocalLRUCache(self.config['LOCAL_MAX_ENTRIES'], self.config['LOCAL_MAX_BYTES'])
+
+    @property
+    def shared(self):
+        return caches[self.config['ALIAS']]
+
+    def make_key(self, *parts):
+        return make_key(self.namespace, *parts, generation=catalog_version())
+
+    def get(self, key):
+        data = self.local.get(key)
+        if data is None:
+            data = self.shared.get(key)
+            if data is None:
+                return None
+            self.local.set(key, data)
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.shared.set(key, data, self.config['TIMEOUT'])
+        self.local.set(key, data)
+
+    def get_or_compute(self, key, compute):
+        """Значение из кэша или compute() -> (значение, можно_кэшировать)"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        lock_key = f'{key}:lock'
+        if not self.shared.add(lock_key, 1, self.config['LOCK_TIMEOUT']):
+            # Ключ уже считает другой воркер - ждём его результат
+            deadline = time.monotonic() + self.config['LOCK_WAIT']
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.get(key)
+                if value is not None:
+                    return value
+            value, cacheable = compute()
+            return value
+
+        try:
+            value, cacheable = compute()
+            if cacheable:
+                self.set(key, value)
+            return value
+        finally:
+            self.shared.delete(lock_key)
+
+
+def choose_encoding(accept_encoding):
+    """Лучшее доступное сжатие из Accept-Encoding: 'br', 'gzip' или None"""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    # Больший q выигрывает, при равенстве - первый в available
+    coding = max(available, key=lambda coding: accepted.get(coding, accepted.get('*', 0)))
+    return coding if accepted.get(coding, accepted.get('*', 0)) > 0 else None
+
+
+def compress(content, encoding, config):
+    """(байты, Content-Encoding); маленькие ответы не сжимаются"""
+    if encoding is None or len(content) < config['COMPRESS_MIN_SIZE']:
+        return content, None
+    if encoding == 'br':
+        return brotli.compress(content, quality=config['BROTLI_QUALITY']), 'br'
+    return gzip.compress(content, config['GZIP_LEVEL'], mtime=0), 'gzip'
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+class ResponseCacheMixin:
+    """Кэширование ответов GET: действия view вызывают cached_response"""
+    cached_actions = ('list', 'retrieve', 'batch', 'similar')
+    # Форматы, для которых кэшируются готовые байты (не HTML браузерного API)
+    precompressed_formats = ('json', 'msgpack')
+
+    def get_response_cache_key(self, request):
+        params = sorted(
+            (key, tuple(values)) for key, values in request.query_params.lists()
+            if any(values)
+        )
+        return (request.get_host(), request.path, params)
+
+    def cached_response(self, request, compute):
+        """Ответ из кэша; compute() строит Response, кэшируются только 200"""
+        if (
+            request.method != 'GET'
+            or self.action not in self.cached_actions
+            or not get_config()['ENABLED']
+        ):
+            return compute()
+
+        cache = get_response_cache()
+        key = cache.make_key(*self.get_response_cache_key(request))
+        renderer = request.accepted_renderer
+        config = get_config()
+        if not config['PRECOMPRESS'] or renderer.format not in self.precompressed_formats:
+            response, data = self.cached_data(cache, key, compute)
+            return response or Response(data)
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        rendered_key = f'{key}:{request.accepted_media_type}:{encoding}'
+        rendered = cache.get(rendered_key)
+        if rendered is None:
+            response, data = self.cached_data(cache, key, compute)
+            if response is not None and response.status_code != 200:
+                return response
+            content = renderer.render(data, request.accepted_media_type, self.get_renderer_context())
+            rendered = compress(content, encoding, config)
+            cache.set(rendered_key, rendered)
+
+        content, content_encoding = rendered
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = HttpResponse(content, content_type=content_type)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        # Тело зависит и от формата (rendered_key содержит тип), и от сжатия
+        patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+        return response
+
+    def cached_data(self, cache, key, compute):
+        """(свежий Response или None, данные ответа)"""
+        computed = []
+
+        def build():
+            response = compute()
+            computed.append(response)
+            return response.data, response.status_code == 200
+
+        data = cache.get_or_compute(key, build)
+        return (computed[0] if computed else None), data
@@ -0,0 +1,185 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+
+class BaseSearchBackend:
+    """Полнотекстовый индекс по названию и описанию товара"""
+    # Нужно ли обновлять индекс вручную при сохранении товара
+    manual_sync = False
+
+    def __init__(self):
+        self.table = Product._meta.db_table
+        self._available = None
+
+    def is_available(self):
+        if self._available is None:
+            with connection.cursor() as cursor:
+                self._available = self.index_exists(cursor)
+        return self._available
+
+    def index_exists(self, cursor):
+        raise NotImplementedError
+
+    def ensure_index(self):
+        raise NotImplementedError
+
+    def rebuild(self):
+        pass
+
+    def update(self, product):
+        pass
+
+    def update_many(self, product_ids):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def search(self, queryset, query, rank=False):
+        """Фильтр по совпадению; rank=True добавляет аннотацию relevance"""
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector в генерируемой колонке с GIN-индексом, синхронизируется самой БД"""
+    column = 'search_vector'
+
+    def __init__(self):
+        super().__init__()
+        self.config = getattr(settings, 'CATALOG_SEARCH_CONFIG', 'russian')
+
+    def index_exists(self, cursor):
+        columns = connection.introspection.get_table_description(cursor, self.table)
+        return any(column.name == self.column for column in columns)
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {self.column} tsvector "
+                f"GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('{self.config}', coalesce(name, '')), 'A') || "
+                f"setweight(to_tsvector('{self.config}', coalesce(description, '')), 'B')"
+                f") STORED"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_search_gin "
+                f"ON {self.table} USING gin ({self.column})"
+            )
+        self._available = True
+
+    def search(self, queryset, query, rank=False):
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        queryset = queryset.filter(RawSQL(
+            f'{self.table}.{self.column} @@ {tsquery}', [query], output_field=BooleanField()
+        ))
+        if rank:
+            queryset = queryset.annotate(relevance=RawSQL(
+                f'ts_rank_cd({self.table}.{self.column}, {tsquery})', [query], output_field=FloatField()
+            ))
+        return queryset
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """Таблица FTS5 для локальной разработки и тестов"""
+    manual_sync = True
+
+    def __init__(self):
+        super().__init__()
+        self.fts_table = f'{self.table}_fts'
+
+    def index_exists(self, cursor):
+        return self.fts_table in connection.introspection.table_names(cursor)
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} "
+                f"USING fts5(name, description, tokenize='unicode61 remove_diacritics 2')"
+            )
+        self._available = True
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.fts_table}')
+            cursor.execute(
+                f'INSERT INTO {self.fts_table} (rowid, name, description) '
+                f'SELECT id, name, description FROM {self.table}'
+            )
+
+    def update(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.fts_table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.fts_table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.description]
+            )
+
+    def update_many(self, product_ids):
+        product_ids = list(product_ids)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.fts_table} WHERE rowid IN ({placeholders})', product_ids
+            )
+            cursor.execute(
+                f'INSERT INTO {self.fts_table} (rowid, name, description) '
+                f'SELECT id, name, description FROM {self.table} WHERE id IN ({placeholders})',
+                product_ids
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.fts_table} WHERE rowid = %s', [product_id])
+
+    @staticmethod
+    def to_match(query):
+        # Каждое слово - префиксный поиск в кавычках, слова через AND
+        return ' '.join(f'"{term.replace(chr(34), chr(34) * 2)}"*' for term in query.split())
+
+    def search(self, queryset, query, rank=False):
+        match = self.to_match(query)
+        if not match:
+            # MATCH '' - синтаксическая ошибка FTS5
+            return queryset
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {self.fts_table} WHERE {self.fts_table} MATCH %s', [match]
+        ))
+        if rank:
+            # bm25 отрицательный: чем меньше, тем релевантнее; название весомее описания
+            queryset = queryset.annotate(relevance=RawSQL(
+                f'SELECT -bm25({self.fts_table}, 2.0, 1.0) FROM {self.fts_table} '
+                f'WHERE {self.fts_table} MATCH %s AND rowid = {self.table}.id',
+                [match],
+                output_field=FloatField()
+            ))
+        return queryset
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+_backends = {}
+
+
+def get_search_backend(require_index=True):
+    """Бэкенд полнотекстового поиска для текущей БД или None.
+
+    CATALOG_SEARCH_BACKEND: 'auto' (по vendor БД), 'postgresql', 'sqlite' или None.
+    """
+    name = getattr(settings, 'CATALOG_SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = connection.vendor
+    if name not in SEARCH_BACKENDS:
+        return None
+    if name not in _backends:
+        _backends[name] = SEARCH_BACKENDS[name]()
+    backend = _backends[name]
+    if require_index and not backend.is_available():
+        return None
+    return backend
@@ -1,12 +1,32 @@
 from rest_framework import serializers
 from .models import Category, Product, Size, Color, AttributeValue, AttributeOption, ProductAttribute, ProductImage
+from .category_stats import stats_data
+from .images import srcset
+
+class DynamicFieldsMixin:
+    """Ограничение набора полей: fields - оставить только эти, omit - убрать"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        omit = kwargs.pop('omit', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in omit or ():
+            self.fields.pop(name, None)
 
 class CategorySerializer(serializers.ModelSerializer):
     parent_name = serializers.CharField(source='parent.name', read_only=True)
+    stats = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'parent', 'parent_name', 'is_active']
+        fields = ['id', 'name', 'slug', 'parent', 'parent_name', 'is_active', 'stats']
+
+    def get_stats(self, obj):
+        # Строка CategoryStats подгружается select_related('stats')
+        return stats_data(getattr(obj, 'stats', None))
 
 class SizeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -45,14 +65,21 @@ class AttributeValueSerializer(serializers.ModelSerializer):
         return None
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'order']
+        fields = ['id', 'image', 'srcset', 'order']
+
+    def get_srcset(self, obj):
+        return srcset(obj.variants, request=self.context.get('request'))
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_slug = serializers.CharField(source='category.slug', read_only=True)
     attributes = serializers.SerializerMethodField()
+    main_image_srcset = serializers.SerializerMethodField()
+    images = ProductImageSerializer(many=True, read_only=True)
     
     class Meta:
         model = Product
@@ -60,10 +87,14 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug',
             'category', 'category_name', 'category_slug',
             'price', 'stock', 'is_active',
-            'description', 'images', 'attributes',
+            'description', 'main_image', 'main_image_srcset',
+            'images', 'attributes',
             'created_at'
         ]
 
+    def get_main_image_srcset(self, obj):
+        return srcset(obj.main_image_variants, request=self.context.get('request'))
+
     def get_attributes(self, obj):
         attributes = {}
         for value in obj.attribute_values.all():
@@ -1,8 +1,68 @@
-from django.db.models import Q
-from .models import Product, AttributeValue
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from .models import Product, AttributeValue, Category
+from .attribute_index import attribute_index
+from .caching import make_key
+from .category_stats import stats_data
+from .profiling import profiled
+from .replicas import primary_reads
+from .response_cache import catalog_version
 
 class CatalogService:
+    # Атрибуты, доступные для фильтрации через параметры запроса
+    FILTER_ATTRIBUTES = ('size', 'color')
+    # Границы ценовых диапазонов для фасета цены, None - без верхней границы
+    PRICE_BUCKETS = (0, 1000, 3000, 5000, 10000, None)
+    # Больше id из индекса - фильтр подзапросом, а не списком параметров IN (...)
+    MAX_INLINE_IDS = 1000
+
+    @classmethod
+    def parse_filters(cls, params):
+        """Нормализованный набор фильтров из параметров запроса"""
+        def price(value):
+            try:
+                return Decimal(value).normalize() if value else None
+            except InvalidOperation:
+                return None
+
+        return {
+            'min_price': price(params.get('min_price')),
+            'max_price': price(params.get('max_price')),
+            'category': params.get('category') or None,
+            'in_stock': params.get('in_stock') == 'true',
+            'attributes': {
+                code: sorted(attribute_index.split_values(params.get(code)))
+                for code in cls.FILTER_ATTRIBUTES
+            }
+        }
+
+    @staticmethod
+    def filters_key(filters):
+        """Хэшируемый ключ нормализованных фильтров (для кэша)"""
+        return tuple(sorted(
+            (name, tuple(sorted((code, tuple(values)) for code, values in value.items()))
+             if isinstance(value, dict) else str(value))
+            for name, value in filters.items()
+        ))
+
     @staticmethod
+    def get_category_range(slug):
+        """Диапазон поддерева (tree_id, lft, rght) категории по slug, из кэша"""
+        cache_key = make_key('category-range', slug)
+        category_range = cache.get(cache_key)
+        if category_range is None:
+            # Несуществующий slug кэшируется пустым кортежем; без срока - поэтому с основной БД
+            with primary_reads():
+                category_range = Category.objects.filter(slug=slug).values_list(
+                    'tree_id', 'lft', 'rght'
+                ).first() or ()
+            cache.set(cache_key, category_range, None)
+        return tuple(category_range) or None
+
+    @staticmethod
+    @profiled('filter')
     def get_filtered_products(queryset, filters=None):
         """Фильтрация товаров с оптимизацией запросов"""
         if not filters:
@@ -14,23 +74,154 @@ class CatalogService:
         if filters.get('max_price'):
             queryset = queryset.filter(price__lte=filters['max_price'])
 
-        # Фильтр по категории
+        # Фильтр по категории: всё поддерево одним диапазоном MPTT (tree_id, lft..rght)
         if filters.get('category'):
+            category_range = CatalogService.get_category_range(filters['category'])
+            if category_range is None:
+                return queryset.none()
+            tree_id, lft, rght = category_range
             queryset = queryset.filter(
-                Q(category__slug=filters['category']) |
-                Q(category__parent__slug=filters['category'])
+                category__tree_id=tree_id,
+                category__lft__range=(lft, rght)
             )
 
-        # Фильтр по атрибутам
+        # Фильтр по атрибутам: пересечение списков id из индекса вместо JOIN на каждый атрибут,
+        # несколько значений одного атрибута через запятую объединяются (color=red,blue)
         if filters.get('attributes'):
-            for attr_code, value in filters['attributes'].items():
-                queryset = queryset.filter(
-                    attribute_values__attribute__code=attr_code,
-                    attribute_values__option__value=value
-                )
+            product_ids = attribute_index.resolve(filters['attributes'])
+            if product_ids is not None and len(product_ids) <= CatalogService.MAX_INLINE_IDS:
+                queryset = queryset.filter(id__in=product_ids)
+            elif product_ids is not None:
+                for code, values in filters['attributes'].items():
+                    if values:
+                        queryset = queryset.filter(id__in=AttributeValue.objects.filter(
+                            attribute__code=code, option__value__in=values
+                        ).values('product_id'))
 
         # Фильтр по наличию
         if filters.get('in_stock'):
             queryset = queryset.filter(stock__gt=0)
 
-        return queryset.distinct()
\ No newline at end of file
+        # Без JOIN по атрибутам дубликатов нет, DISTINCT не нужен
+        return queryset
+
+    @classmethod
+    @profiled('facets')
+    def get_facets(cls, queryset, filters):
+        """Счётчики фасетов; каждый фасет считается без собственного фильтра"""
+        def without(name, code=None):
+            reduced = dict(filters, attributes=dict(filters.get('attributes') or {}))
+            if code is not None:
+                reduced['attributes'].pop(code, None)
+            elif name == 'price':
+                reduced['min_price'] = reduced['max_price'] = None
+            else:
+                reduced[name] = None
+            return cls.get_filtered_products(queryset, reduced)
+
+        # Атрибуты: выбранные считаются каждый без своего фильтра,
+        # остальные - одним сгруппированным запросом под всеми фильтрами
+        selected = [code for code, values in (filters.get('attributes') or {}).items() if values]
+        option_rows = list(cls._count_options(
+            AttributeValue.objects.exclude(attribute__code__in=selected),
+            cls.get_filtered_products(queryset, filters)
+        ))
+        for code in selected:
+            option_rows += cls._count_options(
+                AttributeValue.objects.filter(attribute__code=code),
+                without('attributes', code)
+            )
+        attributes = {}
+        for row in option_rows:
+            attributes.setdefault(row['attribute__code'], []).append({
+                'id': row['option_id'],
+                'value': row['option__value'],
+                'display_value': row['option__display_value'],
+                'count': row['count']
+            })
+
+        categories = [
+            {
+                'id': row['category_id'],
+                'name': row['category__name'],
+                'slug': row['category__slug'],
+                'count': row['count']
+            }
+            for row in without('category').order_by().values(
+                'category_id', 'category__name', 'category__slug'
+            ).annotate(count=Count('id')).order_by('-count', 'category__name')
+        ]
+
+        # Все ценовые диапазоны - одним агрегатом
+        buckets = list(zip(cls.PRICE_BUCKETS, cls.PRICE_BUCKETS[1:]))
+        aggregates = {}
+        for i, (low, high) in enumerate(buckets):
+            condition = Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            aggregates[f'bucket_{i}'] = Count('id', filter=condition)
+        price_stats = without('price').order_by().aggregate(
+            min_price=Min('price'), max_price=Max('price'), **aggregates
+        )
+        prices = {
+            'min': price_stats['min_price'],
+            'max': price_stats['max_price'],
+            'buckets': [
+                {'min': low, 'max': high, 'count': price_stats[f'bucket_{i}']}
+                for i, (low, high) in enumerate(buckets)
+            ]
+        }
+
+        return {'attributes': attributes, 'categories': categories, 'price': prices}
+
+    @classmethod
+    def get_cached_facets(cls, queryset, filters, timeout=300, search=''):
+        """Фасеты из кэша по нормализованным фильтрам, поисковому запросу и версии каталога.
+
+        queryset уже отфильтрован поиском, search входит только в ключ.
+        """
+        cache_key = make_key('facets', cls.filters_key(filters), search, generation=catalog_version())
+        data = cache.get(cache_key)
+        if data is None:
+            data = cls.get_facets(queryset, filters)
+            cache.set(cache_key, data, timeout)
+        return data
+
+    @staticmethod
+    def _count_options(values, products):
+        return values.filter(
+            product__in=products.order_by().values('id'),
+            option__isnull=False
+        ).values(
+            'attribute__code', 'option_id', 'option__value', 'option__display_value', 'option__order'
+        ).annotate(count=Count('product_id', distinct=True)).order_by(
+            'attribute__code', 'option__order', 'option__value'
+        )
+
+    @staticmethod
+    def build_category_tree(with_counts=False):
+        """Вложенное дерево активных категорий одним запросом"""
+        # get_cached_trees() раскладывает узлы по cache_tree_children без доп. запросов,
+        # агрегаты поддерева уже посчитаны в CategoryStats
+        queryset = Category.objects.order_by('tree_id', 'lft')
+        if with_counts:
+            # Без строки CategoryStats (таблица ещё не заполнена командой) - нули
+            queryset = queryset.select_related('stats')
+        nodes = queryset.get_cached_trees()
+
+        def serialize(node):
+            children = [
+                serialize(child) for child in node.get_children() if child.is_active
+            ]
+            data = {
+                'id': node.id,
+                'name': node.name,
+                'slug': node.slug,
+                'product_type': node.product_type_id,
+                'children': children
+            }
+            if with_counts:
+                data.update(stats_data(getattr(node, 'stats', None)))
+            return data
+
+        return [serialize(node) for node in nodes if node.is_active]
@@ -0,0 +1,359 @@
+from functools import partial
+
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from mptt.signals import node_moved
+
+from .attribute_index import attribute_index
+from .attribute_options import attribute_options
+from .caching import bump_generation
+from .category_stats import schedule_category_stats
+from .documents import invalidate_documents
+from .images import SOURCES as IMAGE_SOURCES, is_stale, refresh_variants
+from .models import (
+    AttributeOption,
+    AttributeValue,
+    Category,
+    Product,
+    ProductAttribute,
+    ProductImage,
+    ProductNeighbor,
+    ProductTombstone,
+    ProductType
+)
+from .response_cache import bump_catalog_version
+from .search import get_search_backend
+from .similarity import schedule_neighbors
+from .suggest import get_config as get_suggest_config, suggest_index
+
+# Массовые изменения товаров в обход save() (импорт, bulk_update).
+# Аргумент product_ids - id созданных или изменённых товаров,
+# необязательный fields - изменённые поля, если известны (None - любые);
+# 'in_stock' среди них - остаток мог перейти через ноль, одно 'stock' - только число.
+products_bulk_changed = Signal()
+
+
+def _index_pairs(attribute_value):
+    """Пары (код, значение) индекса, которые затрагивает строка AttributeValue"""
+    if not (attribute_value.product_id and attribute_value.attribute_id and attribute_value.option_id):
+        return set()
+    try:
+        return {(attribute_value.attribute.code, attribute_value.option.value)}
+    except (ProductAttribute.DoesNotExist, AttributeOption.DoesNotExist):
+        return set()
+
+
+# Инвертированный индекс атрибутов
+
+@receiver(pre_save, sender=AttributeValue)
+def remember_indexed_pairs(sender, instance, **kwargs):
+    instance._index_pairs_before = set()
+    if instance.pk:
+        instance._index_pairs_before = set(
+            AttributeValue.objects.filter(
+                pk=instance.pk,
+                product__isnull=False,
+                option__isnull=False
+            ).values_list('attribute__code', 'option__value')
+        )
+
+
+@receiver(post_save, sender=AttributeValue)
+def update_index_on_value_save(sender, instance, **kwargs):
+    before = getattr(instance, '_index_pairs_before', set())
+    attribute_index.invalidate(before | _index_pairs(instance))
+
+
+@receiver(post_delete, sender=AttributeValue)
+def update_index_on_value_delete(sender, instance, **kwargs):
+    attribute_index.invalidate(_index_pairs(instance))
+
+
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+@receiver(post_save, sender=AttributeOption)
+@receiver(post_delete, sender=AttributeOption)
+def reset_index_on_attribute_change(sender, **kwargs):
+    # Смена кода атрибута или значения варианта меняет ключи индекса
+    attribute_index.invalidate_all()
+
+
+# Карта вариантов атрибутов
+
+@receiver(post_save, sender=AttributeOption)
+@receiver(post_delete, sender=AttributeOption)
+def reset_attribute_options(sender, **kwargs):
+    attribute_options.invalidate()
+
+
+# Диапазоны MPTT для фильтра по категории
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def reset_category_ranges(sender, **kwargs):
+    # Любое изменение дерева сдвигает lft/rght соседних узлов
+    bump_generation('category-range')
+
+
+# Кэш дерева категорий
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def reset_category_tree(sender, **kwargs):
+    bump_generation('category-tree')
+
+
+@receiver(post_save, sender=Product)
+def reset_category_counts_on_save(sender, instance, created, **kwargs):
+    if created or instance.tracked_changes(('category_id', 'is_active')):
+        bump_generation('category-counts')
+
+
+@receiver(post_delete, sender=Product)
+def reset_category_counts_on_delete(sender, **kwargs):
+    bump_generation('category-counts')
+
+
+# Документы товаров (read model)
+
+@receiver(post_save, sender=Product)
+def refresh_document_on_product_save(sender, instance, **kwargs):
+    invalidate_documents([instance.pk])
+
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_document_on_child_change(sender, instance, **kwargs):
+    if instance.product_id:
+        invalidate_documents([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+def refresh_documents_on_category_save(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_documents(
+            Product.objects.filter(category=instance).values_list('id', flat=True)
+        )
+
+
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_save, sender=AttributeOption)
+def refresh_documents_on_attribute_save(sender, instance, created, **kwargs):
+    if created:
+        return
+    lookup = 'attribute' if sender is ProductAttribute else 'option'
+    invalidate_documents(
+        AttributeValue.objects.filter(
+            **{lookup: instance}, product__isnull=False
+        ).values_list('product_id', flat=True)
+    )
+
+
+# Полнотекстовый индекс
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None and backend.manual_sync:
+        backend.update(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None and backend.manual_sync:
+        backend.remove(instance.pk)
+
+
+# Массовые изменения
+
+@receiver(products_bulk_changed)
+def refresh_after_bulk_change(sender, product_ids, fields=None, **kwargs):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    fields = None if fields is None else set(fields)
+    if fields is None:
+        attribute_index.invalidate_all()
+    if fields is None or fields & {'category', 'is_active'}:
+        bump_generation('category-counts')
+    if fields != {'stock'}:
+        # Число на складе без смены наличия не сбрасывает весь кэш ответов:
+        # остаток в закэшированных ответах устаревает не дольше их TIMEOUT
+        bump_catalog_version()
+    invalidate_documents(product_ids)
+    backend = get_search_backend()
+    if backend is not None and backend.manual_sync and (fields is None or fields & {'name', 'description'}):
+        backend.update_many(product_ids)
+
+
+# Версия каталога для кэша ответов
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+@receiver(post_save, sender=AttributeOption)
+@receiver(post_delete, sender=AttributeOption)
+def bump_catalog_version_on_change(sender, **kwargs):
+    bump_catalog_version()
+
+
+# Лента изменений: изменения дочерних строк сдвигают updated_at товара
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product_on_child_change(sender, instance, **kwargs):
+    if instance.product_id:
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+def touch_products_on_category_save(sender, instance, created, **kwargs):
+    if not created:
+        Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Product)
+def create_tombstone(sender, instance, **kwargs):
+    ProductTombstone.objects.update_or_create(
+        product_id=instance.pk,
+        defaults={'slug': instance.slug, 'deleted_at': timezone.now()}
+    )
+
+
+# Производные изображения
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, **kwargs):
+    source_field, variants_field, _ = IMAGE_SOURCES[sender]
+    if is_stale(getattr(instance, source_field).name, getattr(instance, variants_field)):
+        # После коммита: файл оригинала уже сохранён, транзакция не держит блокировки
+        transaction.on_commit(partial(build_image_variants, sender, instance.pk))
+
+
+def build_image_variants(model, pk):
+    product_ids = refresh_variants(model, [pk])
+    if product_ids:
+        products_bulk_changed.send(sender=model, product_ids=product_ids)
+
+
+# Агрегаты категорий
+
+@receiver(post_save, sender=Product)
+def refresh_category_stats_on_save(sender, instance, created, **kwargs):
+    if created or instance.tracked_changes(('category_id', 'is_active', 'stock', 'price')):
+        previous = getattr(instance, '_previous_values', {})
+        schedule_category_stats({previous.get('category_id'), instance.category_id})
+
+
+@receiver(post_delete, sender=Product)
+def refresh_category_stats_on_delete(sender, instance, **kwargs):
+    schedule_category_stats([instance.category_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def rebuild_category_stats_on_tree_change(sender, **kwargs):
+    schedule_category_stats()
+
+
+@receiver(products_bulk_changed)
+def refresh_category_stats_after_bulk_change(sender, product_ids, fields=None, **kwargs):
+    if fields is None or set(fields) & {'category', 'is_active'}:
+        # Прежние категории неизвестны - пересчёт целиком
+        schedule_category_stats()
+    elif set(fields) & {'in_stock', 'price'}:
+        schedule_category_stats(
+            Product.objects.filter(pk__in=list(product_ids)).order_by().values_list(
+                'category_id', flat=True
+            ).distinct()
+        )
+
+
+# Похожие товары
+
+@receiver(post_save, sender=Product)
+def refresh_neighbors_on_save(sender, instance, created, **kwargs):
+    if created or instance.tracked_changes(('category_id', 'is_active', 'price')):
+        schedule_neighbors([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def refresh_neighbors_on_delete(sender, instance, **kwargs):
+    # Строки самого товара удалит каскад, списки, где он был соседом, пересчитываются
+    schedule_neighbors(
+        ProductNeighbor.objects.filter(neighbor=instance).values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+def refresh_neighbors_on_value_change(sender, instance, **kwargs):
+    if instance.product_id:
+        schedule_neighbors([instance.product_id])
+
+
+@receiver(products_bulk_changed)
+def refresh_neighbors_after_bulk_change(sender, product_ids, fields=None, **kwargs):
+    if fields is None or set(fields) & {'category', 'is_active', 'price'}:
+        schedule_neighbors(product_ids)
+
+
+# Подсказки поиска
+
+SUGGEST_FIELDS = ('name', 'slug', 'is_active')
+
+
+@receiver(request_started)
+def warm_up_suggest(sender, **kwargs):
+    # Первый запрос идёт уже в рабочем процессе (после fork), не в manage.py
+    if suggest_index.index is None and get_suggest_config()['WARM_UP']:
+        suggest_index.warm_up()
+
+
+@receiver(post_save, sender=Product)
+def reset_suggest_on_product_save(sender, instance, created, **kwargs):
+    if created or instance.tracked_changes(SUGGEST_FIELDS):
+        # После коммита, иначе другой процесс догрузит товар по старым данным
+        transaction.on_commit(partial(suggest_index.record_change, [instance.pk]))
+
+
+@receiver(post_delete, sender=Product)
+def reset_suggest_on_product_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(suggest_index.record_change, [instance.pk]))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=AttributeOption)
+@receiver(post_delete, sender=AttributeOption)
+def reset_suggest(sender, **kwargs):
+    transaction.on_commit(suggest_index.invalidate)
+
+
+@receiver(products_bulk_changed)
+def reset_suggest_after_bulk_change(sender, product_ids, fields=None, **kwargs):
+    # Веса по остаткам и частоте вариантов обновятся при следующей пересборке
+    if fields is None or set(fields) & set(SUGGEST_FIELDS):
+        transaction.on_commit(partial(suggest_index.record_change, product_ids))
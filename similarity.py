@@ -0,0 +1,248 @@
+"""Похожие товары: косинусное сходство разреженных векторов признаков.
+
+Товар кодируется вектором из вариантов атрибутов, категории и ценового
+диапазона (геометрическая шкала). Соседи ищутся только внутри типа товара,
+пачками строк через умножение матриц; результат - таблица ProductNeighbor.
+
+Пересчёт требует numpy и scipy; без них готовая таблица продолжает
+отдаваться, а изменения товаров просто не пересчитываются.
+Пересчёт после изменений собирает матрицу всего типа товара, поэтому
+идёт в фоновом потоке процесса: изменения копятся DEBOUNCE_SECONDS
+и считаются одним проходом, не задерживая сохраняющий запрос.
+Настройки CATALOG_SIMILAR_PRODUCTS (словарь, см. DEFAULTS).
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import AttributeValue, Product, ProductNeighbor
+from .response_cache import bump_catalog_version
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TOP_K': 12,
+    'CATEGORY_WEIGHT': 1.0,
+    'PRICE_WEIGHT': 1.0,
+    'PRICE_BAND_RATIO': 1.5,
+    'BATCH_SIZE': 1000,
+    # Ограничение плотной матрицы сходства одной пачки (строк x товаров)
+    'MAX_BATCH_CELLS': 20_000_000,
+    # Пересчитывать соседей изменённых товаров после коммита
+    'INCREMENTAL': True,
+    # Пересчёт в фоновом потоке; False - синхронно в колбэке коммита
+    'BACKGROUND': True,
+    # Сколько копить изменения перед фоновым пересчётом, секунды
+    'DEBOUNCE_SECONDS': 2,
+}
+
+_pending = threading.local()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_SIMILAR_PRODUCTS', {})}
+
+
+def is_available():
+    return np is not None
+
+
+def price_band(price, ratio):
+    return int(math.floor(math.log(max(float(price), 1.0), ratio)))
+
+
+def load_group(product_type_id, config):
+    """id активных товаров типа и нормированная матрица признаков (CSR)"""
+    products = list(
+        Product.objects.filter(
+            is_active=True, category__product_type_id=product_type_id
+        ).order_by('id').values_list('id', 'category_id', 'price')
+    )
+    ids = [pk for pk, _, _ in products]
+    position = {pk: i for i, pk in enumerate(ids)}
+    columns = {}
+    rows, cols, data = [], [], []
+
+    def add(row, key, weight):
+        rows.append(row)
+        cols.append(columns.setdefault(key, len(columns)))
+        data.append(weight)
+
+    for i, (pk, category_id, price) in enumerate(products):
+        add(i, ('category', category_id), config['CATEGORY_WEIGHT'])
+        add(i, ('price', price_band(price, config['PRICE_BAND_RATIO'])), config['PRICE_WEIGHT'])
+    for product_id, option_id in AttributeValue.objects.filter(
+        product__is_active=True,
+        product__category__product_type_id=product_type_id,
+        option__isnull=False
+    ).values_list('product_id', 'option_id').distinct():
+        add(position[product_id], ('option', option_id), 1.0)
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), (rows, cols)),
+        shape=(len(ids), max(len(columns), 1))
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return ids, sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def top_neighbors(matrix, rows, k, config):
+    """Пачками: индексы строк, индексы k соседей и их сходство, по убыванию"""
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if k <= 0 or not len(rows):
+        return
+    step = max(1, min(config['BATCH_SIZE'], config['MAX_BATCH_CELLS'] // n))
+    transposed = matrix.T.tocsc()
+    for start in range(0, len(rows), step):
+        batch = np.asarray(rows[start:start + step])
+        scores = (matrix[batch] @ transposed).toarray()
+        scores[np.arange(len(batch)), batch] = -1
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        yield batch, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def compute_group(product_type_id, product_ids=None, config=None):
+    """Пересчёт соседей товаров типа (всех или только product_ids)"""
+    config = config or get_config()
+    ids, matrix = load_group(product_type_id, config)
+    if product_ids is None:
+        rows = list(range(len(ids)))
+    else:
+        wanted = set(product_ids)
+        rows = [i for i, pk in enumerate(ids) if pk in wanted]
+
+    neighbors = []
+    for batch, top, top_scores in top_neighbors(matrix, rows, config['TOP_K'], config):
+        for row, columns, scores in zip(batch, top, top_scores):
+            rank = 0
+            for column, score in zip(columns, scores):
+                # Без общих признаков товар не считается похожим
+                if score <= 0:
+                    break
+                neighbors.append(ProductNeighbor(
+                    product_id=ids[row], neighbor_id=ids[column], rank=rank, score=float(score)
+                ))
+                rank += 1
+
+    with transaction.atomic():
+        changed = [ids[row] for row in rows]
+        ProductNeighbor.objects.filter(product_id__in=changed).delete()
+        ProductNeighbor.objects.bulk_create(neighbors, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_neighbors():
+    """Полный пересчёт таблицы по всем типам товаров"""
+    config = get_config()
+    ProductNeighbor.objects.filter(product__is_active=False).delete()
+    total = 0
+    for product_type_id in Product.objects.filter(is_active=True).order_by().values_list(
+        'category__product_type_id', flat=True
+    ).distinct():
+        total += compute_group(product_type_id, config=config)
+    bump_catalog_version()
+    return total
+
+
+def refresh_neighbors(product_ids):
+    """Пересчёт изменённых товаров и товаров, у которых они в списке похожих.
+
+    Новые вхождения изменённого товара в чужие списки появятся
+    при полном пересчёте (команда catalog_similar_products).
+    """
+    product_ids = set(product_ids)
+    product_ids |= set(
+        ProductNeighbor.objects.filter(neighbor_id__in=product_ids).values_list('product_id', flat=True)
+    )
+    ProductNeighbor.objects.filter(product_id__in=product_ids, product__is_active=False).delete()
+    groups = {}
+    for pk, product_type_id in Product.objects.filter(
+        pk__in=product_ids, is_active=True
+    ).values_list('id', 'category__product_type_id'):
+        groups.setdefault(product_type_id, set()).add(pk)
+    config = get_config()
+    for product_type_id, ids in groups.items():
+        compute_group(product_type_id, ids, config)
+    bump_catalog_version()
+
+
+def schedule_neighbors(product_ids):
+    """Пересчёт после коммита; все вызовы в транзакции сворачиваются в один"""
+    if not is_available() or not get_config()['INCREMENTAL']:
+        return
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(pk for pk in product_ids if pk is not None)
+    transaction.on_commit(_refresh_pending)
+
+
+class BackgroundRefresher:
+    """Фоновый поток процесса: копит id и пересчитывает их раз в DEBOUNCE_SECONDS"""
+
+    def __init__(self):
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def add(self, product_ids):
+        with self.lock:
+            self.pending.update(product_ids)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def run(self):
+        try:
+            while True:
+                time.sleep(get_config()['DEBOUNCE_SECONDS'])
+                with self.lock:
+                    product_ids, self.pending = self.pending, set()
+                    if not product_ids:
+                        self.worker = None
+                        return
+                _refresh(product_ids)
+        except Exception:
+            logger.exception('Ошибка фонового пересчёта похожих товаров')
+        finally:
+            connections.close_all()
+            with self.lock:
+                # После ошибки следующий add() запускает новый поток; накопленные id остаются в pending
+                if self.worker is threading.current_thread():
+                    self.worker = None
+
+
+background_refresher = BackgroundRefresher()
+
+
+def _refresh(product_ids):
+    try:
+        refresh_neighbors(product_ids)
+    except Exception:
+        # Рекомендации не должны ломать сохранение товара
+        logger.exception('Ошибка пересчёта похожих товаров')
+
+
+def _refresh_pending():
+    # Один вызов забирает всё накопленное, остальные колбэки транзакции пустые
+    product_ids, _pending.ids = getattr(_pending, 'ids', None), set()
+    if not product_ids:
+        return
+    if get_config()['BACKGROUND']:
+        background_refresher.add(product_ids)
+    else:
+        _refresh(product_ids)
@@ -0,0 +1,193 @@
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .importers import ProductImporter
+from .models import Product
+from .signals import products_bulk_changed
+
+
+class InsufficientStock(Exception):
+    """Остатка не хватает для резерва; вся операция откатывается"""
+
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+        super().__init__(f'Недостаточно товара {product_id} для резерва {quantity}')
+
+
+def normalize_items(items):
+    """{product_id: количество} из списка {'product': id, 'quantity': n}; повторы суммируются"""
+    if not isinstance(items, list):
+        raise ValueError('Ожидается список {"product": id, "quantity": n}')
+    quantities = {}
+    for item in items:
+        try:
+            product_id = int(item['product'])
+            quantity = int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Ожидается список {"product": id, "quantity": n}')
+        if quantity <= 0:
+            raise ValueError(f'Количество должно быть положительным: {product_id}')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        raise ValueError('Пустой список товаров')
+    return quantities
+
+
+def parse_items(data):
+    """{product_id: количество} из тела запроса {"items": [...]}"""
+    if not isinstance(data, dict):
+        raise ValueError('Ожидается объект {"items": [...]}')
+    return normalize_items(data.get('items') or [])
+
+
+def send_stock_changed(product_ids, availability_changed):
+    """Сигнал об остатках: переход через ноль меняет наличие, остальное - только число"""
+    availability_changed = set(availability_changed)
+    quantity_only = [pk for pk in product_ids if pk not in availability_changed]
+    if quantity_only:
+        products_bulk_changed.send(sender=Product, product_ids=quantity_only, fields=['stock'])
+    if availability_changed:
+        products_bulk_changed.send(
+            sender=Product, product_ids=sorted(availability_changed), fields=['stock', 'in_stock']
+        )
+
+
+def reserve_stock(quantities):
+    """Атомарный резерв нескольких товаров: условный UPDATE stock = stock - n WHERE stock >= n.
+
+    Без чтения остатка в Python, поэтому параллельные резервы не перетирают
+    друг друга. Строки блокируются в порядке id, чтобы не было взаимных блокировок.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for product_id, quantity in sorted(quantities.items()):
+            updated = Product.objects.filter(
+                pk=product_id, is_active=True, stock__gte=quantity
+            ).update(stock=F('stock') - quantity, updated_at=now)
+            if not updated:
+                raise InsufficientStock(product_id, quantity)
+        # Строки заблокированы этой транзакцией: ноль сейчас - значит, резерв забрал последнее
+        sold_out = Product.objects.filter(pk__in=list(quantities), stock=0).values_list('id', flat=True)
+        send_stock_changed(list(quantities), sold_out)
+
+
+def release_stock(quantities):
+    """Возврат резерва: stock = stock + n; возвращает id ненайденных товаров"""
+    now = timezone.now()
+    missing = []
+    with transaction.atomic():
+        for product_id, quantity in sorted(quantities.items()):
+            if not Product.objects.filter(pk=product_id).update(
+                stock=F('stock') + quantity, updated_at=now
+            ):
+                missing.append(product_id)
+        released = [product_id for product_id in quantities if product_id not in missing]
+        if released:
+            # Остаток равен возвращённому количеству - до возврата товара не было
+            back_in_stock = Product.objects.filter(
+                reduce(or_, (Q(pk=product_id, stock=quantities[product_id]) for product_id in released))
+            ).values_list('id', flat=True)
+            send_stock_changed(released, back_in_stock)
+    return missing
+
+
+class StockUpdater:
+    """Пакетное обновление остатков из файла склада (CSV/JSONL) без загрузки моделей.
+
+    Колонки: slug или id товара и stock (новый остаток) либо delta (изменение).
+    Каждая пачка - один UPDATE ... SET stock = CASE id WHEN ... END.
+    Отрицательный итог при delta обрезается до нуля.
+    """
+    formats = ProductImporter.formats
+
+    def __init__(self, chunk_size=1000, max_errors=1000):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.report = {'updated': 0, 'skipped': 0, 'errors': []}
+
+    def run(self, stream, fmt):
+        rows = ProductImporter().rows(stream, fmt)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.process_chunk(chunk)
+        return self.report
+
+    def add_error(self, line, errors):
+        self.report['skipped'] += 1
+        if len(self.report['errors']) < self.max_errors:
+            self.report['errors'].append({'line': line, 'errors': errors})
+
+    def clean_row(self, row):
+        """(ключ товара, 'stock' или 'delta', число) либо словарь ошибок"""
+        if row.get('id') not in (None, ''):
+            try:
+                key = ('id', int(row['id']))
+            except (TypeError, ValueError):
+                return {'id': 'Некорректный id'}
+        elif str(row.get('slug') or '').strip():
+            key = ('slug', str(row['slug']).strip())
+        else:
+            return {'slug': 'Не указан slug или id'}
+
+        mode = 'stock' if row.get('stock') not in (None, '') else 'delta'
+        try:
+            value = int(row.get(mode))
+        except (TypeError, ValueError):
+            return {mode: 'Некорректное число'}
+        if mode == 'stock' and value < 0:
+            return {'stock': 'Остаток не может быть отрицательным'}
+        return key, mode, value
+
+    def process_chunk(self, chunk):
+        cleaned = []
+        for line, row in chunk:
+            if isinstance(row, Exception):
+                self.add_error(line, {'row': str(row)})
+                continue
+            result = self.clean_row(row)
+            if isinstance(result, dict):
+                self.add_error(line, result)
+            else:
+                cleaned.append((line, *result))
+
+        slugs = {key for line, (kind, key), mode, value in cleaned if kind == 'slug'}
+        ids = {key for line, (kind, key), mode, value in cleaned if kind == 'id'}
+        by_slug = dict(Product.objects.filter(slug__in=slugs).order_by().values_list('slug', 'id')) if slugs else {}
+        known_ids = set(Product.objects.filter(pk__in=ids).order_by().values_list('id', flat=True)) if ids else set()
+
+        # Несколько строк одного товара в пачке сворачиваются: stock задаёт базу, delta прибавляется
+        changes = {}
+        for line, (kind, key), mode, value in cleaned:
+            product_id = by_slug.get(key) if kind == 'slug' else (key if key in known_ids else None)
+            if product_id is None:
+                self.add_error(line, {kind: f'Товар не найден: {key}'})
+                continue
+            base, delta = changes.get(product_id, (None, 0))
+            changes[product_id] = (value, 0) if mode == 'stock' else (base, delta + value)
+        if not changes:
+            return
+
+        whens = []
+        for product_id, (base, delta) in changes.items():
+            if base is not None:
+                stock = Value(max(base + delta, 0))
+            else:
+                stock = Greatest(F('stock') + delta, Value(0))
+            whens.append(When(pk=product_id, then=stock))
+
+        with transaction.atomic():
+            self.report['updated'] += Product.objects.filter(pk__in=list(changes)).update(
+                stock=Case(*whens, default=F('stock'), output_field=models.PositiveIntegerField()),
+                updated_at=timezone.now()
+            )
+            # Наличие по файлу склада не отслеживается - считается изменившимся у всех
+            send_stock_changed(list(changes), changes)
@@ -0,0 +1,317 @@
+"""Подсказки поиска по мере ввода из индекса префиксов в памяти процесса.
+
+Индекс - отсортированный список различных слов названий, массив смещений
+и массив номеров записей (array); поиск префикса - два bisect по списку слов.
+Записи: товары, категории и варианты атрибутов (display_value).
+Индекс собирается при первом запросе подсказок или заранее, в фоне, после
+запуска рабочего процесса (WARM_UP или suggest_index.warm_up() из post-fork
+хука сервера) - не в AppConfig.ready, который идёт и в manage.py, и до fork.
+
+Изменения товаров не пересобирают индекс: сигналы пишут id товаров в журнал
+в общем кэше, процесс догружает только их в небольшую дельту поверх индекса.
+Изменения категорий и вариантов, массовые изменения больше MAX_DELTA товаров
+меняют поколение 'suggest'; процесс, увидевший новое поколение, пересобирает
+индекс в фоне и до готовности отвечает по старому.
+
+Настройки CATALOG_SUGGEST (словарь, см. DEFAULTS).
+"""
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Count, Q
+
+from .caching import bump_generation, get_generation, make_key
+from .models import AttributeOption, Category, CategoryStats, Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    # Сколько самых тяжёлых совпадений префикса просматривается при ранжировании
+    'MAX_CANDIDATES': 1000,
+    'MIN_QUERY_LENGTH': 1,
+    # Сборка индекса в фоне по первому запросу процесса (любому); False - по первому запросу подсказок
+    'WARM_UP': False,
+    # Пересборка после изменений в фоновом потоке; False - синхронно в запросе
+    'BACKGROUND_REBUILD': True,
+    # Изменённых товаров в дельте поверх индекса до полной пересборки
+    'MAX_DELTA': 1000,
+    # Срок записей журнала изменений; процесс, отставший дольше, пересобирает индекс
+    'JOURNAL_TIMEOUT': 3600,
+    # Веса типов записей
+    'WEIGHTS': {'product': 1.0, 'category': 1.5, 'option': 1.2},
+}
+
+NAMESPACE = 'suggest'
+
+_word_re = re.compile(r'\w+')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_SUGGEST', {})}
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, без диакритики латиницы, слова через пробел"""
+    text = unicodedata.normalize('NFKD', str(text).casefold().replace('ё', 'е'))
+    # NFKD раскладывает «й» на «и» + кратку - её сохраняем, остальные знаки убираем
+    text = ''.join(
+        char for char in text
+        if not unicodedata.combining(char) or char == '\u0306'
+    )
+    return ' '.join(_word_re.findall(unicodedata.normalize('NFC', text)))
+
+
+class PrefixIndex:
+    """Неизменяемый индекс префиксов над списком записей"""
+
+    def __init__(self, entries):
+        # entries: (тип, id, текст, вес, дополнительные поля)
+        # Номера записей идут по убыванию веса: меньший номер - более тяжёлая запись
+        self.entries = sorted(entries, key=lambda entry: -entry[3])
+        self.tokens = [tuple(normalize(entry[2]).split()) for entry in self.entries]
+        pairs = sorted(
+            (word, number)
+            for number, tokens in enumerate(self.tokens)
+            for word in set(tokens)
+        )
+        # Каждое слово хранится один раз; его записи - postings[offsets[i]:offsets[i + 1]]
+        self.words = []
+        self.offsets = array('I')
+        self.postings = array('I')
+        for word, group in groupby(pairs, key=lambda pair: pair[0]):
+            self.words.append(word)
+            self.offsets.append(len(self.postings))
+            self.postings.extend(number for _, number in group)
+        self.offsets.append(len(self.postings))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def span(self, prefix):
+        """Границы номеров записей со словами на prefix в массиве postings"""
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + '\U0010ffff', start)
+        return self.offsets[start], self.offsets[end]
+
+    def search(self, query, limit, max_candidates, exclude=()):
+        """Записи по убыванию оценки: [(оценка, запись)]; exclude - ключи (тип, id) пропускаемых записей"""
+        words = normalize(query).split()
+        if not words or not self.words:
+            return []
+        # Кандидаты по самому редкому слову запроса, остальные слова проверяются по записи
+        start, end = min((self.span(word) for word in words), key=lambda span: span[1] - span[0])
+        candidates = set(self.postings[start:end])
+        if len(candidates) > max_candidates:
+            # Самые тяжёлые записи по всему диапазону префикса, а не первые по алфавиту слова
+            candidates = heapq.nsmallest(max_candidates, candidates)
+        scored = []
+        for number in candidates:
+            tokens = self.tokens[number]
+            if exclude and self.entries[number][:2] in exclude:
+                continue
+            if not all(any(token.startswith(word) for token in tokens) for word in words):
+                continue
+            weight = self.entries[number][3]
+            # Совпадение с начала названия и короткие названия выше
+            score = weight * (2.0 if tokens[0].startswith(words[0]) else 1.0) / (1 + 0.05 * len(tokens))
+            scored.append((score, -number, number))
+        return [(score, self.entries[number]) for score, _, number in heapq.nlargest(limit, scored)]
+
+
+def product_entries(config, queryset):
+    weight = config['WEIGHTS']['product']
+    return [
+        ('product', pk, name, weight * (1.5 if stock > 0 else 1.0), {'slug': slug})
+        for pk, name, slug, stock in queryset.filter(is_active=True).values_list(
+            'id', 'name', 'slug', 'stock'
+        ).iterator(chunk_size=2000)
+    ]
+
+
+def build_entries(config):
+    weights = config['WEIGHTS']
+    entries = product_entries(config, Product.objects.all())
+
+    counts = dict(CategoryStats.objects.values_list('category_id', 'product_count'))
+    for pk, name, slug in Category.objects.filter(is_active=True).values_list('id', 'name', 'slug'):
+        weight = weights['category'] * (1 + math.log1p(counts.get(pk, 0)))
+        entries.append(('category', pk, name, weight, {'slug': slug}))
+
+    for pk, display_value, value, code, usage in AttributeOption.objects.annotate(
+        usage=Count('product_values', filter=Q(product_values__product__is_active=True))
+    ).values_list('id', 'display_value', 'value', 'attribute__code', 'usage'):
+        weight = weights['option'] * (1 + math.log1p(usage))
+        entries.append(('option', pk, display_value, weight, {'attribute': code, 'value': value}))
+    return entries
+
+
+class SuggestIndex:
+    """Индекс процесса и дельта изменённых товаров поверх него.
+
+    Дельта - словарь (тип, id) -> запись или None (товар удалён или скрыт)
+    и маленький PrefixIndex по её записям; записи индекса с ключами из дельты
+    при поиске пропускаются. Полная пересборка дельту сбрасывает.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.generation = None
+        # Последний применённый номер журнала изменений
+        self.sequence = 0
+        self.overlay = ({}, PrefixIndex([]))
+        self.lock = threading.Lock()
+        self.rebuilding = False
+        self.warming = False
+
+    @staticmethod
+    def _sequence_key(generation):
+        return make_key(NAMESPACE, 'sequence', generation=generation)
+
+    @staticmethod
+    def _change_key(generation, sequence):
+        return make_key(NAMESPACE, 'change', sequence, generation=generation)
+
+    def build(self, generation):
+        # Номер журнала читается до выборки: изменения во время сборки применятся ещё раз
+        sequence = cache.get(self._sequence_key(generation), 0)
+        started = time.monotonic()
+        index = PrefixIndex(build_entries(get_config()))
+        logger.info(
+            'Индекс подсказок: %d записей за %.0f мс',
+            len(index), (time.monotonic() - started) * 1000
+        )
+        return index, generation, sequence
+
+    def install(self, index, generation, sequence):
+        self.index, self.generation, self.sequence = index, generation, sequence
+        self.overlay = ({}, PrefixIndex([]))
+
+    def warm_up(self):
+        """Сборка в фоне, чтобы её не ждал первый запрос подсказок.
+
+        Вызывать в рабочем процессе: по первому запросу (WARM_UP) или из
+        post-fork хука сервера (gunicorn post_fork, uWSGI @postfork); поток,
+        запущенный до fork, в рабочий процесс не переходит.
+        """
+        if self.index is not None or self.warming:
+            return
+        self.warming = True
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            # Запрос, пришедший до конца сборки, ждёт её на блокировке, а не собирает второй раз
+            with self.lock:
+                # До миграций (migrate на пустой базе) собирать нечего
+                if self.index is None and Product._meta.db_table in connection.introspection.table_names():
+                    self.install(*self.build(get_generation(NAMESPACE)))
+        except Exception:
+            logger.exception('Ошибка сборки индекса подсказок')
+        finally:
+            connections.close_all()
+            self.warming = False
+
+    def _rebuild_in_background(self, generation):
+        try:
+            state = self.build(generation)
+            with self.lock:
+                self.install(*state)
+        except Exception:
+            logger.exception('Ошибка сборки индекса подсказок')
+        finally:
+            connections.close_all()
+            self.rebuilding = False
+
+    def apply_changes(self, generation):
+        """Догружает в дельту товары из новых записей журнала"""
+        sequence = cache.get(self._sequence_key(generation), 0)
+        if sequence <= self.sequence:
+            return
+        with self.lock:
+            if sequence <= self.sequence or generation != self.generation:
+                return
+            config = get_config()
+            numbers = range(self.sequence + 1, sequence + 1)
+            changes = cache.get_many([self._change_key(generation, number) for number in numbers])
+            delta = self.overlay[0]
+            product_ids = set().union(*changes.values())
+            if len(changes) < len(numbers) or len(delta) + len(product_ids) > config['MAX_DELTA']:
+                # Журнал вытеснен или дельта разрослась - полная пересборка, как при новом поколении
+                self.generation = None
+                return
+            delta = {**delta, **{('product', pk): None for pk in product_ids}}
+            for entry in product_entries(config, Product.objects.filter(pk__in=product_ids)):
+                delta[entry[:2]] = entry
+            self.overlay = (delta, PrefixIndex([entry for entry in delta.values() if entry is not None]))
+            self.sequence = sequence
+
+    def get(self):
+        """Индекс и дельта процесса с учётом поколения и журнала изменений"""
+        generation = get_generation(NAMESPACE)
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.install(*self.build(generation))
+        elif generation != self.generation and not self.rebuilding:
+            if not get_config()['BACKGROUND_REBUILD']:
+                with self.lock:
+                    self.install(*self.build(generation))
+            else:
+                with self.lock:
+                    if not self.rebuilding:
+                        self.rebuilding = True
+                        threading.Thread(
+                            target=self._rebuild_in_background, args=(generation,), daemon=True
+                        ).start()
+        if generation == self.generation:
+            self.apply_changes(generation)
+        return self.index, self.overlay
+
+    def search(self, query, limit=None):
+        config = get_config()
+        limit = min(limit or config['LIMIT'], config['MAX_LIMIT'])
+        if len(normalize(query)) < config['MIN_QUERY_LENGTH']:
+            return []
+        index, (delta, delta_index) = self.get()
+        # Устойчивая сортировка: при равной оценке запись индекса раньше записи дельты
+        scored = heapq.nlargest(
+            limit,
+            index.search(query, limit, config['MAX_CANDIDATES'], exclude=delta)
+            + delta_index.search(query, limit, config['MAX_CANDIDATES']),
+            key=lambda item: item[0]
+        )
+        return [
+            {'type': kind, 'id': pk, 'label': label, **extra}
+            for _, (kind, pk, label, weight, extra) in scored
+        ]
+
+    def record_change(self, product_ids):
+        """Запись изменённых товаров в журнал; много товаров сразу - новое поколение"""
+        product_ids = set(product_ids)
+        config = get_config()
+        if len(product_ids) > config['MAX_DELTA']:
+            return self.invalidate()
+        generation = get_generation(NAMESPACE)
+        key = self._sequence_key(generation)
+        cache.add(key, 0, None)
+        sequence = cache.incr(key)
+        cache.set(self._change_key(generation, sequence), product_ids, config['JOURNAL_TIMEOUT'])
+
+    def invalidate(self):
+        bump_generation(NAMESPACE)
+
+
+suggest_index = SuggestIndex()
@@ -1,3 +1,1524 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import has_vary_header
+from rest_framework.renderers import JSONRenderer
+from PIL import Image
+
+from . import benchmarks, category_stats, renderers, search, similarity
+from .admin import AttributeValueInline
+from .attribute_index import attribute_index
+from .attribute_options import attribute_options
+from .category_stats import rebuild_category_stats, refresh_category_stats
+from .changefeed import get_changes
+from .documents import get_documents
+from .exporters import ProductExporter
+from .images import is_stale, render_variants
+from .importers import ProductImporter
+from .models import (
+    AttributeGroup,
+    AttributeOption,
+    AttributeValue,
+    Category,
+    CategoryStats,
+    Product,
+    ProductAttribute,
+    ProductDocument,
+    ProductImage,
+    ProductType
+)
+from .pagination import LimitedCountPaginator
+from .profiling import RequestProfile, fingerprint
+from .renderers import OrjsonRenderer
+from .replicas import primary_reads, read_database, replica_health
+from .response_cache import LocalLRUCache, ResponseCache, catalog_version, get_config as get_response_config
+from .services import CatalogService
+from .signals import products_bulk_changed
+from .suggest import PrefixIndex, suggest_index
+from .views import ProductViewSet
+
+
+class CatalogQueryBudgetTests(TestCase):
+    """Число SQL-запросов эндпоинтов каталога не растёт относительно базовой линии"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=10, products=40)
+        cls.baseline = benchmarks.load_baseline()
+
+    def test_query_counts(self):
+        for name, url in benchmarks.get_scenarios(self.catalog):
+            with self.subTest(scenario=name):
+                metrics = benchmarks.measure(self.client, url, repeat=1)
+                self.assertLessEqual(
+                    metrics['queries'],
+                    self.baseline['scenarios'][name]['queries'],
+                    f'{name}: возможен N+1'
+                )
+
+
+class ProductCursorPaginationTests(TestCase):
+    """Keyset-пагинация: стабильный обход, валидация сортировки и курсора, счётчик"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=5, products=30, images=0)
+        # Одинаковые цены: порядок внутри них задаёт id
+        Product.objects.filter(pk__in=[p.pk for p in cls.catalog['products'][:10]]).update(price=500)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return ids
+
+    def test_walk_is_stable_with_equal_values(self):
+        ids = self.walk(reverse('products-list') + '?pagination=cursor&ordering=price&page_size=7')
+        expected = list(Product.objects.filter(is_active=True).order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_same_page(self):
+        url = reverse('products-list') + '?pagination=cursor&ordering=-price&page_size=5'
+        first = self.client.get(url).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+
+    def test_invalid_ordering_falls_back_to_default(self):
+        url = reverse('products-list') + '?pagination=cursor'
+        default = [p['id'] for p in self.client.get(url).json()['results']]
+        doubled = [p['id'] for p in self.client.get(url + '&ordering=--price').json()['results']]
+        self.assertEqual(doubled, default)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('products-list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_count_follows_catalog_changes(self):
+        url = reverse('products-list') + '?pagination=cursor'
+        count = self.client.get(url).json()['count']
+        product = self.catalog['products'][0]
+        Product.objects.create(name='Новый', slug='cursor-new', category=product.category, price=1)
+        self.assertEqual(self.client.get(url).json()['count'], count + 1)
+
+
+class AttributeIndexTests(TestCase):
+    """Инвертированный индекс атрибутов: инвалидация и фильтр по большим спискам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=3, products=40, images=0)
+        cls.size = cls.catalog['attributes'][0]
+
+    def setUp(self):
+        cache.clear()
+
+    def ids_with(self, value):
+        return set(AttributeValue.objects.filter(
+            attribute=self.size, option__value=value
+        ).values_list('product_id', flat=True))
+
+    def test_invalidation_during_load_is_not_lost(self):
+        product = Product.objects.exclude(pk__in=self.ids_with('v0')).first()
+        option = self.size.options.get(value='v0')
+        set_many = cache.set_many
+
+        def concurrent_write(*args, **kwargs):
+            # Запись и инвалидация между чтением из БД и записью в кэш
+            if not AttributeValue.objects.filter(product=product, option=option).exists():
+                AttributeValue.objects.create(product=product, attribute=self.size, option=option)
+            return set_many(*args, **kwargs)
+
+        with mock.patch('catalog.attribute_index.cache.set_many', side_effect=concurrent_write):
+            attribute_index.get_postings([('size', 'v0')])
+        postings = attribute_index.get_postings([('size', 'v0')])[('size', 'v0')]
+        self.assertIn(product.pk, postings)
+
+    def test_value_change_updates_postings(self):
+        attribute_index.get_postings([('size', 'v1')])
+        value = AttributeValue.objects.filter(attribute=self.size, option__value='v1').first()
+        value.delete()
+        postings = attribute_index.get_postings([('size', 'v1')])[('size', 'v1')]
+        self.assertNotIn(value.product_id, postings)
+
+    def test_large_posting_lists_use_subquery(self):
+        filters = CatalogService.parse_filters({'size': 'v1,v2'})
+        inline = list(CatalogService.get_filtered_products(Product.objects.all(), filters).order_by('id'))
+        with mock.patch.object(CatalogService, 'MAX_INLINE_IDS', 2):
+            queryset = CatalogService.get_filtered_products(Product.objects.all(), filters).order_by('id')
+            self.assertIn('SELECT', str(queryset.query).split('WHERE', 1)[1])
+            self.assertEqual(list(queryset), inline)
+        self.assertEqual({p.pk for p in inline}, self.ids_with('v1') | self.ids_with('v2'))
+
+
+class FacetsTests(TestCase):
+    """Фасеты считаются по тем же товарам, что и список"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=3, products=30, images=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def option_total(self, data, code):
+        return sum(option['count'] for option in data['attributes'][code])
+
+    def test_search_narrows_facets(self):
+        url = reverse('products-facets')
+        everything = self.client.get(url).json()
+        found = self.client.get(url, {'search': 'хлопок'}).json()
+        expected = Product.objects.filter(is_active=True, name__icontains='хлопок').count()
+        self.assertEqual(self.option_total(found, 'size'), expected)
+        self.assertLess(self.option_total(found, 'size'), self.option_total(everything, 'size'))
+
+    def test_selected_attribute_counted_without_own_filter(self):
+        data = self.client.get(reverse('products-facets'), {'size': 'v1'}).json()
+        self.assertEqual(self.option_total(data, 'size'), Product.objects.filter(is_active=True).count())
+
+
+class ProductChangeTrackingTests(TestCase):
+    """Снимок отслеживаемых полей делается при save(), а не при каждой загрузке"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=3, images=0)
+
+    def test_loading_does_not_snapshot(self):
+        product = Product.objects.first()
+        self.assertFalse(hasattr(product, '_previous_values'))
+
+    def test_save_detects_changes(self):
+        product = Product.objects.get(pk=self.catalog['products'][0].pk)
+        product.stock += 1
+        product.save()
+        self.assertTrue(product.tracked_changes(['stock']))
+        self.assertFalse(product.tracked_changes(['price', 'category_id']))
+
+    def test_untracked_update_fields_skip_lookup(self):
+        product = Product.objects.get(pk=self.catalog['products'][0].pk)
+        product.description = 'Новое описание'
+        with self.assertNumQueries(0):
+            previous = product.previous_values(['description'])
+        self.assertEqual(previous['stock'], product.stock)
+
+    def test_deferred_fields_are_not_loaded(self):
+        product = Product.objects.only('id', 'stock').get(pk=self.catalog['products'][0].pk)
+        product.stock += 1
+        with self.assertNumQueries(1):
+            previous = product.previous_values(['stock'])
+        self.assertEqual(set(previous), {'stock'})
+
+
+class ProductDocumentTests(TestCase):
+    """Read model: чтение не пишет в БД, ссылки как у сериализатора"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=5, images=0)
+        cls.product = cls.catalog['products'][0]
+        Product.objects.filter(pk=cls.product.pk).update(main_image='products/main.jpg')
+        ProductDocument.objects.all().delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_read_does_not_write_documents(self):
+        response = self.client.get(reverse('products-detail', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ProductDocument.objects.exists())
+
+    def test_command_backfills_missing(self):
+        call_command('build_product_documents', stdout=io.StringIO())
+        self.assertEqual(ProductDocument.objects.count(), Product.objects.count())
+
+    def test_image_urls_match_serializer(self):
+        url = reverse('products-detail', args=[self.product.pk])
+        from_document = self.client.get(url).json()
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'use_read_model', False):
+            from_serializer = self.client.get(url).json()
+        self.assertTrue(from_document['main_image'].startswith('http://testserver/'))
+        self.assertEqual(from_document['main_image'], from_serializer['main_image'])
+
+    def test_outdated_documents_are_treated_as_missing(self):
+        # Документ прежнего формата: images - список id, нет main_image и main_image_srcset
+        old = {
+            'id': self.product.pk, 'name': 'Старое имя', 'slug': self.product.slug, 'category': None,
+            'category_name': '', 'category_slug': '', 'price': '1.00', 'stock': 0, 'is_active': True,
+            'description': '', 'images': [1, 2], 'attributes': {}, 'created_at': None
+        }
+        ProductDocument.objects.create(product=self.product, data=old)
+        detail = self.client.get(reverse('products-detail', args=[self.product.pk]))
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()['name'], self.product.name)
+        self.assertEqual(self.client.get(reverse('products-list')).status_code, 200)
+        batch = self.client.get(reverse('products-batch'), {'ids': str(self.product.pk)})
+        self.assertEqual(batch.json()['results'][0]['images'], [])
+
+        call_command('build_product_documents', stdout=io.StringIO())
+        self.assertEqual(ProductDocument.objects.get(product=self.product).data['name'], self.product.name)
+
+
+class ProductImportTests(TestCase):
+    """Импорт: ограничения полей модели, гонка slug, выгрузка и загрузка без потерь"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, attributes=2, products=3, images=0)
+        cls.category = cls.catalog['categories'][0]
+
+    def run_import(self, rows, **kwargs):
+        stream = io.StringIO(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        return ProductImporter(**kwargs).run(stream, 'jsonl')
+
+    def row(self, **fields):
+        return {'name': 'Новый товар', 'category': self.category.slug, 'price': '10', **fields}
+
+    def test_field_limits_are_row_errors(self):
+        report = self.run_import([
+            self.row(name='x' * 256),
+            self.row(slug='s' * 51),
+            self.row(price='123456789012'),
+            self.row(slug='valid-slug')
+        ])
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(
+            [list(error['errors']) for error in report['errors']],
+            [['name'], ['slug'], ['price']]
+        )
+
+    def test_generated_slugs_fit_field(self):
+        report = self.run_import([self.row(name='Длинное название ' + 'a' * 80)] * 2)
+        self.assertEqual(report['created'], 2)
+        slugs = list(Product.objects.filter(name__startswith='Длинное').values_list('slug', flat=True))
+        self.assertEqual(len(set(slugs)), 2)
+        self.assertTrue(all(len(slug) <= 50 for slug in slugs))
+
+    def test_slug_race_retries_chunk(self):
+        save_chunk = ProductImporter.save_chunk
+        calls = []
+
+        def flaky(importer, items):
+            calls.append(len(items))
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed: catalog_product.slug')
+            return save_chunk(importer, items)
+
+        with mock.patch.object(ProductImporter, 'save_chunk', flaky):
+            report = self.run_import([self.row(slug='race')])
+        self.assertEqual((report['created'], report['errors']), (1, []))
+        self.assertEqual(calls, [1, 1])
+
+    def test_slug_race_reports_rows_after_retry(self):
+        with mock.patch.object(ProductImporter, 'save_chunk', side_effect=IntegrityError('slug')):
+            report = self.run_import([self.row(slug='race-1'), self.row(slug='race-2')])
+        self.assertEqual((report['created'], report['skipped']), (0, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [1, 2])
+        self.assertFalse(Product.objects.filter(slug__startswith='race').exists())
+
+    def test_jsonl_roundtrip_keeps_multiple_values(self):
+        product = self.catalog['products'][0]
+        color = self.catalog['attributes'][1]
+        extra = color.options.exclude(product_values__product=product).first()
+        AttributeValue.objects.create(product=product, attribute=color, option=extra)
+        expected = sorted(product.attribute_values.values_list('attribute_id', 'option_id'))
+
+        exported = b''.join(ProductExporter('jsonl').stream()).decode()
+        item = next(json.loads(line) for line in exported.splitlines() if json.loads(line)['id'] == product.pk)
+        self.assertEqual(len(item['attributes'][color.code]), 2)
+
+        product.attribute_values.all().delete()
+        report = self.run_import([item], upsert=True)
+        self.assertEqual((report['updated'], report['errors']), (1, []))
+        self.assertEqual(sorted(product.attribute_values.values_list('attribute_id', 'option_id')), expected)
+
+    def test_upsert_replaces_values_without_per_row_queries(self):
+        exported = b''.join(ProductExporter('jsonl').stream()).decode()
+        items = [json.loads(line) for line in exported.splitlines()]
+        expected = sorted(AttributeValue.objects.values_list('product_id', 'attribute_id', 'option_id'))
+        counts = []
+        for rows in (items[:1], items):
+            with CaptureQueriesContext(connection) as queries:
+                report = self.run_import(rows, upsert=True)
+            self.assertEqual((report['updated'], report['errors']), (len(rows), []))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(sorted(AttributeValue.objects.values_list('product_id', 'attribute_id', 'option_id')), expected)
+
+
+class ResponseCacheTests(TestCase):
+    """Кэш ответов: попадание без запросов к БД, смена версии, блокировка холодного ключа"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=5, images=0)
+        cls.product = cls.catalog['products'][0]
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products-detail', args=[self.product.pk])
+
+    def test_hit_skips_database(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+
+    def test_product_save_invalidates(self):
+        self.client.get(self.url)
+        self.product.name = 'Переименованный товар'
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).json()['name'], 'Переименованный товар')
+
+    def test_bulk_change_invalidates(self):
+        self.client.get(self.url)
+        Product.objects.filter(pk=self.product.pk).update(name='Массовое изменение')
+        products_bulk_changed.send(sender=Product, product_ids=[self.product.pk])
+        self.assertEqual(self.client.get(self.url).json()['name'], 'Массовое изменение')
+
+    def test_errors_are_not_cached(self):
+        url = reverse('products-detail', args=[0])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_precompressed_response(self):
+        response = self.client.get(reverse('products-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(has_vary_header(response, 'Accept-Encoding'))
+        self.assertTrue(has_vary_header(response, 'Accept'))
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 5)
+
+    def test_locked_key_waits_for_other_worker(self):
+        response_cache = ResponseCache({**get_response_config(), 'LOCK_WAIT': 1.0})
+        key = response_cache.make_key('stampede')
+        cache.add(f'{key}:lock', 1)
+        compute = mock.Mock(return_value=({'from': 'compute'}, True))
+        # Другой воркер кладёт значение, пока этот ждёт
+        with mock.patch('catalog.response_cache.time.sleep', lambda _: response_cache.set(key, {'from': 'worker'})):
+            self.assertEqual(response_cache.get_or_compute(key, compute), {'from': 'worker'})
+        compute.assert_not_called()
+
+    def test_lock_wait_timeout_computes_without_storing(self):
+        response_cache = ResponseCache({**get_response_config(), 'LOCK_WAIT': 0.1})
+        key = response_cache.make_key('stampede')
+        cache.add(f'{key}:lock', 1)
+        compute = mock.Mock(return_value=({'from': 'compute'}, True))
+        self.assertEqual(response_cache.get_or_compute(key, compute), {'from': 'compute'})
+        compute.assert_called_once()
+        self.assertIsNone(response_cache.get(key))
+
+    def test_lock_released_after_failure(self):
+        response_cache = ResponseCache(get_response_config())
+        key = response_cache.make_key('failure')
+        with self.assertRaises(RuntimeError):
+            response_cache.get_or_compute(key, mock.Mock(side_effect=RuntimeError))
+        self.assertIsNone(cache.get(f'{key}:lock'))
+
+    def test_local_lru_limits(self):
+        local = LocalLRUCache(max_entries=2, max_bytes=10)
+        local.set('a', b'1234')
+        local.set('b', b'1234')
+        local.get('a')
+        local.set('c', b'1234')
+        self.assertEqual(list(local.entries), ['a', 'c'])
+        local.set('d', b'12345678')
+        self.assertEqual((list(local.entries), local.size), (['d'], 8))
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= и ?omit=: тот же набор и формат полей на всех путях чтения"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=5, images=0)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products-list')
+
+    def get_results(self, **params):
+        response = self.client.get(self.url, {'ordering': 'name', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_values_path_matches_serializer(self):
+        fields = 'id,name,price,created_at,category_slug'
+        sparse = self.get_results(fields=fields)
+        self.assertEqual(list(sparse[0]), ['id', 'name', 'category_slug', 'price', 'created_at'])
+        with mock.patch.object(ProductViewSet, 'use_read_model', False):
+            full = self.get_results()
+        self.assertEqual(sparse, [{name: item[name] for name in sparse[0]} for item in full])
+
+    def test_document_and_serializer_paths_agree(self):
+        params = {'fields': 'id,attributes,main_image_srcset', 'omit': 'main_image_srcset'}
+        from_documents = self.get_results(**params)
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'use_read_model', False):
+            from_serializer = self.get_results(**params)
+        self.assertEqual(list(from_documents[0]), ['id', 'attributes'])
+        self.assertEqual(from_documents, from_serializer)
+
+    def test_omit(self):
+        item = self.get_results(omit='description,attributes')[0]
+        self.assertNotIn('description', item)
+        self.assertNotIn('attributes', item)
+        self.assertIn('name', item)
+
+    def test_unknown_fields_fall_back_to_id(self):
+        self.assertEqual(list(self.get_results(fields='password')[0]), ['id'])
+
+    def test_retrieve(self):
+        product = self.catalog['products'][0]
+        response = self.client.get(reverse('products-detail', args=[product.pk]), {'fields': 'slug,id'})
+        self.assertEqual(response.json(), {'id': product.pk, 'slug': product.slug})
+
+    def test_fields_are_part_of_cache_key(self):
+        self.assertEqual(list(self.get_results(fields='id')[0]), ['id'])
+        self.assertEqual(list(self.get_results(fields='id,name')[0]), ['id', 'name'])
+
+
+class ProductBatchTests(TestCase):
+    """/products/batch/: порядок запроса, отсутствующие ключи, ошибки параметров"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=4, images=0)
+        cls.products = cls.catalog['products']
+        Product.objects.filter(pk=cls.products[3].pk).update(is_active=False)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products-batch')
+
+    def test_ids_in_request_order(self):
+        first, second, _, inactive = self.products
+        response = self.client.get(self.url, {'ids': f'{second.pk},0,{first.pk},{second.pk},{inactive.pk}'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['results']], [second.pk, first.pk])
+        self.assertEqual(data['missing'], [0, inactive.pk])
+
+    def test_slugs_with_fields(self):
+        first, second = self.products[:2]
+        data = self.client.get(self.url, {'slugs': f'{first.slug}, nope ,{second.slug}', 'fields': 'slug'}).json()
+        self.assertEqual(data, {'results': [{'slug': first.slug}, {'slug': second.slug}], 'missing': ['nope']})
+
+    def test_read_model_matches_serializer(self):
+        params = {'ids': ','.join(str(product.pk) for product in self.products[:3])}
+        from_documents = self.client.get(self.url, params).json()
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'use_read_model', False):
+            from_serializer = self.client.get(self.url, params).json()
+        self.assertEqual(from_documents, from_serializer)
+
+    def test_invalid_requests(self):
+        for params in ({}, {'ids': ''}, {'ids': '1,x'}, {'ids': ','.join(map(str, range(1, 102)))}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_deactivation_invalidates_cached_batch(self):
+        product = self.products[0]
+        params = {'ids': str(product.pk)}
+        self.assertEqual(self.client.get(self.url, params).json()['missing'], [])
+        product.is_active = False
+        product.save()
+        self.assertEqual(self.client.get(self.url, params).json()['missing'], [product.pk])
+
+
+@override_settings(CATALOG_CHANGEFEED={'SETTLE_SECONDS': 5})
+class ChangeFeedTests(TestCase):
+    """Лента изменений: окно записи не даёт водяному знаку обогнать поздний коммит"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=4, images=0)
+        cls.products = cls.catalog['products']
+        cls.start = timezone.now() - timedelta(hours=1)
+        for number, product in enumerate(cls.products):
+            Product.objects.filter(pk=product.pk).update(updated_at=cls.start + timedelta(seconds=number))
+
+    def poll(self, since, now, limit=500):
+        with mock.patch('catalog.changefeed.timezone.now', return_value=now):
+            return get_changes(since, limit)
+
+    def test_recent_changes_wait_for_window(self):
+        late, early = self.products[:2]
+        now = self.start + timedelta(seconds=10)
+        page = self.poll(None, now)
+        since = page['next']
+        # Транзакция началась раньше, но закоммитилась после первого опроса
+        Product.objects.filter(pk=late.pk).update(updated_at=now - timedelta(seconds=2))
+        Product.objects.filter(pk=early.pk).update(updated_at=now - timedelta(seconds=1))
+        self.assertEqual(self.poll(since, now)['changed'], [])
+        self.assertEqual(
+            [item['id'] for item in self.poll(since, now + timedelta(seconds=5))['changed']],
+            [late.pk, early.pk]
+        )
+
+    def test_pages_merge_changes_and_deletions(self):
+        deleted_id = self.products[1].pk
+        self.products[1].delete()
+        now = timezone.now() + timedelta(seconds=10)
+        seen, since = [], None
+        while True:
+            page = self.poll(since, now, limit=2)
+            seen += [('changed', item['id']) for item in page['changed']]
+            seen += [('deleted', item['id']) for item in page['deleted']]
+            since = page['next']
+            if not page['has_more']:
+                break
+        expected = [('changed', product.pk) for product in self.catalog['products'] if product.pk]
+        self.assertEqual(sorted(seen), sorted(expected + [('deleted', deleted_id)]))
+        self.assertEqual(self.poll(since, now)['changed'], [])
+
+    def test_invalid_watermark(self):
+        response = self.client.get(reverse('products-changes'), {'since': 'not-a-mark'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductExportTests(TestCase):
+    """Выгрузка: права, форматы, сжатие, пачки без роста числа запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, attributes=2, products=5, images=0)
+        cls.products = cls.catalog['products']
+        Product.objects.filter(pk=cls.products[0].pk).update(name='Чай & <кофе>', main_image='products/tea.jpg')
+        Product.objects.filter(pk=cls.products[4].pk).update(is_active=False)
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def export(self, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('products-export-products'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_requires_admin(self):
+        self.assertIn(self.client.get(reverse('products-export-products')).status_code, (401, 403))
+
+    def test_unknown_format(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('products-export-products'), {'type': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_jsonl_active_products(self):
+        items = [json.loads(line) for line in self.export().decode().splitlines()]
+        self.assertEqual([item['id'] for item in items], [product.pk for product in self.products[:4]])
+        self.assertEqual(items[0]['image'], 'http://testserver' + Product.objects.get(pk=items[0]['id']).main_image.url)
+
+    def test_gzip_matches_plain(self):
+        self.assertEqual(gzip.decompress(self.export(type='csv', gzip='true')), self.export(type='csv'))
+
+    def test_csv_columns(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(type='csv').decode())))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['name'], 'Чай & <кофе>')
+        self.assertEqual({key for key in rows[0] if key.startswith('attr_')}, {'attr_color', 'attr_size'})
+
+    def test_xml_is_escaped(self):
+        root = ElementTree.fromstring(self.export(type='xml'))
+        titles = [item.findtext('{http://base.google.com/ns/1.0}title') for item in root.iter('item')]
+        self.assertEqual(len(titles), 4)
+        self.assertEqual(titles[0], 'Чай & <кофе>')
+
+    def test_queries_per_chunk(self):
+        exporter = ProductExporter('jsonl', chunk_size=2)
+        # Справочники (3 запроса), по два на пачку из двух товаров, пустая пачка в конце
+        with self.assertNumQueries(3 + 2 * 2 + 1):
+            lines = b''.join(exporter.stream()).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl')
+            call_command('export_products', path, stderr=io.StringIO())
+            with open(path, encoding='utf-8') as output:
+                self.assertEqual(len(output.read().splitlines()), 4)
+
+
+class ImageVariantTests(TestCase):
+    """Варианты изображений: вложенные srcset, ошибки файлов, ключ по настройкам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=1, products=2, images=0)
+        cls.product = cls.catalog['products'][0]
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def save_image(self, name, size=(800, 600)):
+        output = io.BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'PNG')
+        return default_storage.save(name, ContentFile(output.getvalue()))
+
+    def add_image(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=name)
+
+    def test_nested_images_with_srcset(self):
+        image = self.add_image(self.save_image('products/photo.png'))
+        url = reverse('products-detail', args=[self.product.pk])
+        from_document = self.client.get(url).json()['images']
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'use_read_model', False):
+            from_serializer = self.client.get(url).json()['images']
+        self.assertEqual(from_document, from_serializer)
+        self.assertEqual([item['id'] for item in from_document], [image.pk])
+        self.assertEqual(sorted(from_document[0]['srcset'], key=int), ['320', '640'])
+        self.assertTrue(all(url.startswith('http://testserver/') for url in from_document[0]['srcset'].values()))
+
+    def test_broken_file_does_not_fail_save(self):
+        default_storage.save('products/broken.png', ContentFile(b'not an image'))
+        with self.assertLogs('catalog.images', 'ERROR'):
+            broken = self.add_image('products/broken.png')
+            missing = self.add_image('products/missing.png')
+        broken.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual((broken.variants, missing.variants), ({}, {}))
+
+    def test_settings_change_file_names(self):
+        name = self.save_image('products/photo.png')
+        webp = render_variants(name)
+        with override_settings(CATALOG_IMAGE_VARIANTS={'QUALITY': 50}):
+            lower_quality = render_variants(name)
+        self.assertEqual(render_variants(name), webp)
+        self.assertNotEqual(webp['files'], lower_quality['files'])
+
+    def test_command_reports_failures(self):
+        good = ProductImage.objects.create(product=self.product, image=self.save_image('products/good.png'))
+        default_storage.save('products/broken.png', ContentFile(b'not an image'))
+        broken = ProductImage.objects.create(product=self.product, image='products/broken.png')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('build_image_variants', workers=1, stdout=stdout, stderr=stderr)
+        good.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertFalse(is_stale(good.image.name, good.variants))
+        self.assertEqual(broken.variants, {})
+        self.assertIn('products/broken.png', stderr.getvalue())
+        self.assertIn('Обработано изображений: 1', stdout.getvalue())
+
+
+class StockReservationTests(TestCase):
+    """Резерв всё-или-ничего, возврат только администратором, точечная инвалидация"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=1, products=3, images=0)
+        cls.first, cls.second, cls.third = cls.catalog['products']
+        Product.objects.filter(pk=cls.first.pk).update(stock=5)
+        Product.objects.filter(pk=cls.second.pk).update(stock=1)
+        Product.objects.filter(pk=cls.third.pk).update(stock=3, is_active=False)
+        cls.user = User.objects.create_user('buyer')
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, name, data, user=None):
+        self.client.force_login(user or self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(f'products-{name}'), data, content_type='application/json')
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def items(self, *pairs):
+        return {'items': [{'product': product.pk, 'quantity': quantity} for product, quantity in pairs]}
+
+    def test_reserve(self):
+        response = self.post('reserve', self.items((self.first, 2), (self.first, 1)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'reserved': [{'product': self.first.pk, 'quantity': 3}]})
+        self.assertEqual(self.stock(self.first), 2)
+
+    def test_insufficient_stock_rolls_back_all_items(self):
+        response = self.post('reserve', self.items((self.first, 2), (self.second, 2)))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            {key: response.json()[key] for key in ('product', 'quantity')},
+            {'product': self.second.pk, 'quantity': 2}
+        )
+        self.assertEqual((self.stock(self.first), self.stock(self.second)), (5, 1))
+
+    def test_inactive_product_is_not_reserved(self):
+        self.assertEqual(self.post('reserve', self.items((self.third, 1))).status_code, 409)
+        self.assertEqual(self.stock(self.third), 3)
+
+    def test_invalid_bodies(self):
+        bodies = [
+            [{'product': self.first.pk}],
+            {'items': {'product': self.first.pk}},
+            {'items': 5},
+            {'items': []},
+            {'items': [{'product': 'x'}]},
+            {'items': [{'product': self.first.pk, 'quantity': 0}]},
+        ]
+        for name in ('reserve', 'release'):
+            for body in bodies:
+                with self.subTest(name=name, body=body):
+                    self.assertEqual(self.post(name, body).status_code, 400)
+        self.assertEqual(self.stock(self.first), 5)
+
+    def test_reserve_and_release_require_admin(self):
+        for name in ('reserve', 'release'):
+            with self.subTest(name=name):
+                self.assertEqual(self.post(name, self.items((self.first, 1)), self.user).status_code, 403)
+        self.assertEqual(self.stock(self.first), 5)
+        response = self.post('release', {'items': [{'product': self.first.pk, 'quantity': 2}, {'product': 0}]})
+        self.assertEqual(response.json()['missing'], [0])
+        self.assertEqual(self.stock(self.first), 7)
+
+    def test_quantity_change_keeps_catalog_version(self):
+        version = catalog_version()
+        with mock.patch('catalog.signals.schedule_category_stats') as schedule:
+            self.post('reserve', self.items((self.first, 1)))
+        self.assertEqual(catalog_version(), version)
+        schedule.assert_not_called()
+        self.assertEqual(get_documents([self.first.pk])[0]['stock'], 4)
+
+    def test_sold_out_and_back_in_stock_refresh_availability(self):
+        category = self.second.category
+        version = catalog_version()
+        self.post('reserve', self.items((self.second, 1)))
+        self.assertNotEqual(catalog_version(), version)
+        self.assertEqual(CategoryStats.objects.get(category=category).in_stock_count, 1)
+        self.post('release', self.items((self.second, 1)))
+        self.assertEqual(CategoryStats.objects.get(category=category).in_stock_count, 2)
+
+
+class AttributeOptionsTests(TestCase):
+    """Варианты атрибутов: ETag на набор атрибутов, 304 без запросов к БД"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=1, attributes=2, products=1, images=0)
+        cls.size, cls.color = cls.catalog['attributes']
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('attribute-options', args=[self.size.pk])
+
+    def test_options_with_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['value'] for row in response.json()], [f'v{i}' for i in range(8)])
+        self.assertTrue(response['ETag'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_not_modified_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_follows_own_attribute_only(self):
+        etag = self.client.get(self.url)['ETag']
+        self.color.options.filter(value='v0').update(display_value='Красный')
+        attribute_options.invalidate()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        option = self.size.options.get(value='v0')
+        option.display_value = 'XS'
+        option.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['display_value'], 'XS')
+
+    def test_batch(self):
+        url = reverse('attribute-options-batch')
+        response = self.client.get(url, {'ids': f'{self.color.pk},{self.size.pk},0'})
+        self.assertEqual(list(response.json()), [str(self.color.pk), str(self.size.pk), '0'])
+        self.assertEqual(response.json()['0'], [])
+        params = {'ids': f'{self.color.pk},{self.size.pk},0'}
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_invalid_ids(self):
+        url = reverse('attribute-options-batch')
+        for params in ({}, {'ids': '1,x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class CategoryStatsTests(TestCase):
+    """Агрегаты категорий: пересчёт только затронутых деревьев, чтение без пересчёта"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=6, products=30, images=0)
+        cls.categories = cls.catalog['categories']
+
+    def setUp(self):
+        cache.clear()
+
+    def stats(self):
+        return {
+            row['category_id']: row
+            for row in CategoryStats.objects.values('category_id', 'product_count', 'in_stock_count', 'min_price', 'max_price')
+        }
+
+    def test_incremental_matches_full_rebuild(self):
+        product = self.catalog['products'][0]
+        leaf = Category.objects.filter(children__isnull=True).exclude(pk=product.category_id).first()
+        previous = product.category_id
+        Product.objects.filter(pk=product.pk).update(category=leaf, price=1, stock=0)
+        refresh_category_stats([previous, leaf.pk])
+        incremental = self.stats()
+        rebuild_category_stats()
+        self.assertEqual(incremental, self.stats())
+
+    def test_refresh_reads_only_affected_trees(self):
+        leaf = Category.objects.filter(children__isnull=True).first()
+        other_trees = Category.objects.exclude(tree_id=leaf.tree_id)
+        self.assertTrue(other_trees.exists())
+        with CaptureQueriesContext(connection) as queries, mock.patch(
+            'catalog.category_stats._save', wraps=category_stats._save
+        ) as save:
+            refresh_category_stats([leaf.pk])
+        category_queries = [query['sql'] for query in queries if 'FROM "catalog_category"' in query['sql']]
+        aggregate = next(query['sql'] for query in queries if 'FROM "catalog_product"' in query['sql'])
+        self.assertEqual(len(category_queries), 2)
+        self.assertIn('"tree_id" =', aggregate)
+        self.assertEqual(set(save.call_args.args[0]), set(leaf.get_ancestors(include_self=True).values_list('id', flat=True)))
+
+    def test_tree_read_does_not_rebuild(self):
+        CategoryStats.objects.all().delete()
+        response = self.client.get(reverse('categories-tree'), {'counts': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['product_count'], 0)
+        self.assertFalse(CategoryStats.objects.exists())
+
+        call_command('catalog_category_stats', stdout=io.StringIO())
+        tree = self.client.get(reverse('categories-tree'), {'counts': 'true'}).json()
+        self.assertEqual(sum(node['product_count'] for node in tree), 30)
+
+
+class CategoryTreeTests(TestCase):
+    """/categories/tree/: сильный ETag, 304 и новый ETag после изменения категорий или типов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=4, products=5, images=0)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('categories-tree')
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_strong_etag_and_not_modified(self):
+        etag = self.get_etag()
+        self.assertTrue(etag.startswith('"'))
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_category_change_changes_etag(self):
+        etag = self.get_etag()
+        category = self.catalog['categories'][0]
+        category.name = 'Переименована'
+        category.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Переименована', response.content.decode())
+
+    def test_product_type_change_resets_tree(self):
+        etag = self.get_etag()
+        product_type = ProductType.objects.get()
+        product_type.name = 'Другой тип'
+        product_type.save()
+        # Дерево пересобирается; содержимое не изменилось - сильный ETag тот же
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_etag(), etag)
+
+        category = self.catalog['categories'][0]
+        category.product_type = ProductType.objects.create(name='Новый тип', slug='new-type')
+        category.save()
+        self.assertNotEqual(self.get_etag(), etag)
+
+
+class CatalogAdminTests(TestCase):
+    """Админка: счётчик с порогом и raw-id выбор вариантов в пределах типа товара"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, attributes=2, products=6, images=0)
+        cls.product = cls.catalog['products'][0]
+        other_type = ProductType.objects.create(name='Другой тип', slug='other-type')
+        group = AttributeGroup.objects.create(name='Другие', product_type=other_type)
+        attribute = ProductAttribute.objects.create(name='Вкус', code='taste', type='choice', attribute_group=group)
+        cls.foreign_option = AttributeOption.objects.create(attribute=attribute, value='sweet', display_value='Сладкий')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_paginator_caps_count(self):
+        self.assertEqual(LimitedCountPaginator(Product.objects.all(), 2).count, 6)
+        with mock.patch.object(LimitedCountPaginator, 'count_limit', 4):
+            with CaptureQueriesContext(connection) as queries:
+                count = LimitedCountPaginator(Product.objects.all(), 2).count
+        self.assertEqual(count, 4)
+        self.assertIn('LIMIT 5', queries[0]['sql'])
+
+    def test_changelist_has_no_full_count(self):
+        with mock.patch.object(LimitedCountPaginator, 'count_limit', 4):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('admin:catalog_product_changelist'))
+        self.assertEqual(response.status_code, 200)
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql'] and 'catalog_product' in query['sql']]
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql for sql in counts))
+
+    def test_option_widget_is_scoped_to_product_type(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:catalog_product_change', args=[self.product.pk]))
+        self.assertEqual(response.status_code, 200)
+        # Список атрибутов строится один раз на запрос, а не на каждую строку инлайна
+        self.assertEqual(
+            len([query for query in queries if query['sql'].startswith('SELECT "catalog_productattribute"')]), 1
+        )
+        product_type_id = self.product.category.product_type_id
+        lookup = f'attribute__attribute_group__product_type__id__exact={product_type_id}'
+        self.assertIn(lookup, response.content.decode())
+
+        popup = self.client.get(
+            reverse('admin:catalog_attributeoption_changelist'), {'_popup': 1, '_to_field': 'id', lookup.split('=')[0]: product_type_id}
+        )
+        self.assertEqual(popup.status_code, 200)
+        options = set(popup.context['cl'].result_list)
+        self.assertTrue(options)
+        self.assertNotIn(self.foreign_option, options)
+
+    def test_option_from_other_product_type_is_rejected(self):
+        formset = AttributeValueInline(Product, admin_site).get_formset(
+            self.request_for(self.product), self.product
+        )(instance=self.product, data={
+            'attribute_values-TOTAL_FORMS': 1,
+            'attribute_values-INITIAL_FORMS': 0,
+            'attribute_values-0-attribute': self.foreign_option.attribute_id,
+            'attribute_values-0-option': self.foreign_option.pk,
+        }, prefix='attribute_values')
+        self.assertFalse(formset.is_valid())
+        self.assertIn('option', formset.errors[0])
+
+    def request_for(self, product):
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        request._obj_ = product
+        return request
+
+
+@skipUnless(similarity.is_available(), 'нужны numpy и scipy')
+@override_settings(CATALOG_SIMILAR_PRODUCTS={'BACKGROUND': False})
+class SimilarProductsTests(TestCase):
+    """Похожие товары: 404 на любой неизвестный pk, пересчёт вне сохраняющего запроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=8, images=0)
+        cls.product = cls.catalog['products'][0]
+        similarity.rebuild_neighbors()
+
+    def setUp(self):
+        cache.clear()
+        # Очередь потока от сигналов setUpTestData: в TestCase коммита не было
+        similarity._pending.ids = set()
+
+    def test_similar(self):
+        response = self.client.get(reverse('products-similar', args=[self.product.pk]), {'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual([item['similarity'] for item in results], sorted((item['similarity'] for item in results), reverse=True))
+
+    def test_unknown_or_invalid_pk(self):
+        for pk in (0, 'abc'):
+            with self.subTest(pk=pk):
+                self.assertEqual(self.client.get(reverse('products-similar', args=[pk])).status_code, 404)
+
+    def test_save_defers_to_background(self):
+        with override_settings(CATALOG_SIMILAR_PRODUCTS={'BACKGROUND': True}), mock.patch.object(
+            similarity.background_refresher, 'add'
+        ) as add, mock.patch('catalog.similarity.refresh_neighbors') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.price += 1000
+                self.product.save()
+        add.assert_called_once_with({self.product.pk})
+        refresh.assert_not_called()
+
+    def test_background_refresher_debounces(self):
+        refresher = similarity.BackgroundRefresher()
+        with override_settings(CATALOG_SIMILAR_PRODUCTS={'DEBOUNCE_SECONDS': 0.05}), mock.patch(
+            'catalog.similarity.refresh_neighbors'
+        ) as refresh, mock.patch('catalog.similarity.connections'):
+            refresher.add({1})
+            refresher.add({2, 3})
+            worker = refresher.worker
+            worker.join(5)
+        self.assertFalse(worker.is_alive())
+        # Фоновый поток процесса из других тестов может вызвать тот же refresh_neighbors
+        self.assertIn(mock.call({1, 2, 3}), refresh.call_args_list)
+        self.assertNotIn(mock.call({1}), refresh.call_args_list)
+        self.assertIsNone(refresher.worker)
+
+    def test_background_errors_are_logged(self):
+        refresher = similarity.BackgroundRefresher()
+        with override_settings(CATALOG_SIMILAR_PRODUCTS={'DEBOUNCE_SECONDS': 0.05}), mock.patch(
+            'catalog.similarity.refresh_neighbors', side_effect=RuntimeError
+        ), mock.patch('catalog.similarity.connections'), self.assertLogs('catalog.similarity', 'ERROR'):
+            refresher.add({1})
+            refresher.worker.join(5)
+
+    def test_worker_is_cleared_after_unexpected_error(self):
+        refresher = similarity.BackgroundRefresher()
+        # run() в потоке теста, как будто это рабочий поток с накопленными id
+        refresher.pending = {1}
+        refresher.worker = threading.current_thread()
+        with mock.patch('catalog.similarity.get_config', side_effect=RuntimeError), mock.patch(
+            'catalog.similarity.connections'
+        ), self.assertLogs('catalog.similarity', 'ERROR'):
+            refresher.run()
+        self.assertIsNone(refresher.worker)
+        self.assertEqual(refresher.pending, {1})
+        with override_settings(CATALOG_SIMILAR_PRODUCTS={'DEBOUNCE_SECONDS': 0.05}), mock.patch(
+            'catalog.similarity.refresh_neighbors'
+        ) as refresh, mock.patch('catalog.similarity.connections'):
+            refresher.add({2})
+            refresher.worker.join(5)
+        self.assertIn(mock.call({1, 2}), refresh.call_args_list)
+
+
+class ProductPageTests(TransactionTestCase):
+    """Асинхронная страница: те же фильтры, поиск, поля и фасеты, что у синхронного API"""
+
+    def setUp(self):
+        cache.clear()
+        self.catalog = benchmarks.seed_catalog(categories=3, products=20, images=0)
+        self.url = reverse('product-page')
+
+    def assertSameAsList(self, params):
+        page = self.client.get(self.url, params)
+        self.assertEqual(page.status_code, 200, page.content)
+        expected = self.client.get(reverse('products-list'), params).json()
+        self.assertEqual(page.json()['count'], expected['count'])
+        self.assertEqual(page.json()['results'], expected['results'])
+        return page.json()
+
+    def test_matches_list(self):
+        self.assertSameAsList({'page': 2, 'page_size': 5, 'ordering': 'price'})
+        self.assertSameAsList({'size': 'v1,v2', 'ordering': '-name'})
+
+    def test_search(self):
+        data = self.assertSameAsList({'search': 'хлопок', 'ordering': 'name'})
+        expected = Product.objects.filter(is_active=True, name__icontains='хлопок').count()
+        self.assertEqual(data['count'], expected)
+        self.assertLess(data['count'], len(self.catalog['products']))
+
+    def test_fields(self):
+        data = self.assertSameAsList({'fields': 'id,name,price', 'ordering': 'name'})
+        self.assertEqual(list(data['results'][0]), ['id', 'name', 'price'])
+        data = self.assertSameAsList({'omit': 'description,attributes', 'ordering': 'name'})
+        self.assertNotIn('description', data['results'][0])
+
+    def test_facets_match_facets_action(self):
+        params = {'search': 'хлопок', 'size': 'v1', 'facets': 'true'}
+        data = self.client.get(self.url, params).json()
+        self.assertEqual(data['facets'], self.client.get(reverse('products-facets'), params).json())
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(self.url, {'page': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ordering': 'description'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page': 100}).status_code, 404)
+
+    async def test_concurrent_requests(self):
+        params = {'facets': 'true', 'page_size': 3, 'search': 'лён'}
+        responses = await asyncio.gather(*(self.async_client.get(self.url, params) for _ in range(5)))
+        self.assertEqual({response.status_code for response in responses}, {200})
+        bodies = [response.json() for response in responses]
+        self.assertTrue(all(body == bodies[0] for body in bodies))
+        expected = await Product.objects.filter(is_active=True, name__icontains='лён').acount()
+        self.assertEqual(bodies[0]['count'], expected)
+        self.assertEqual(sum(option['count'] for option in bodies[0]['facets']['attributes']['size']), expected)
+
+
+@override_settings(CATALOG_SUGGEST={'BACKGROUND_REBUILD': False})
+class SuggestTests(TestCase):
+    """Подсказки: отбор кандидатов по весу, компактный индекс, прогрев и дельта изменений"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=5, images=0)
+
+    def setUp(self):
+        cache.clear()
+        suggest_index.index = None
+
+    def test_candidates_are_heaviest_across_prefix(self):
+        # Слова на «к» по алфавиту: «кабель» лёгкий и идёт раньше тяжёлого «кресло»
+        entries = [('product', i, f'Кабель {i}', 1.0, {}) for i in range(50)]
+        entries.append(('product', 100, 'Кресло', 5.0, {}))
+        index = PrefixIndex(entries)
+        self.assertEqual(index.search('к', 1, 10)[0][1][1], 100)
+
+    def test_words_stored_once(self):
+        index = PrefixIndex([('product', i, f'Товар {i % 3}', 1.0, {}) for i in range(30)])
+        self.assertEqual(index.words, ['0', '1', '2', 'товар'])
+        self.assertEqual(len(index.postings), 60)
+        self.assertEqual(sorted(entry[1] for _, entry in index.search('тов 1', 20, 100)), list(range(1, 30, 3)))
+
+    def test_warm_up_builds_index(self):
+        suggest_index._warm_up()
+        self.assertIsNotNone(suggest_index.index)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('suggest'), {'q': 'товар'})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    @override_settings(CATALOG_SUGGEST={'WARM_UP': True})
+    def test_warm_up_on_first_request(self):
+        with mock.patch.object(suggest_index, 'warm_up') as warm_up:
+            self.client.get(reverse('products-list'))
+        warm_up.assert_called_once_with()
+
+    def test_warm_up_is_off_by_default(self):
+        with mock.patch.object(suggest_index, 'warm_up') as warm_up:
+            self.client.get(reverse('products-list'))
+        warm_up.assert_not_called()
+
+    def test_product_changes_go_to_delta(self):
+        self.client.get(reverse('suggest'), {'q': 'товар'})
+        index = suggest_index.index
+        renamed, deleted = self.catalog['products'][:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            renamed.name = 'Самовар'
+            renamed.save()
+            deleted.delete()
+            Product.objects.create(
+                name='Самокат', slug='samokat', category=renamed.category, price=100
+            )
+        results = self.client.get(reverse('suggest'), {'q': 'само'}).json()['results']
+        self.assertEqual({item['label'] for item in results}, {'Самовар', 'Самокат'})
+        labels = [item['label'] for item in self.client.get(reverse('suggest'), {'q': 'товар'}).json()['results']]
+        self.assertEqual(len(labels), 3)
+        self.assertNotIn(deleted.name, labels)
+        self.assertIs(suggest_index.index, index)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('suggest'), {'q': 'само'})
+
+    def test_lost_journal_rebuilds(self):
+        self.client.get(reverse('suggest'), {'q': 'товар'})
+        index = suggest_index.index
+        product = self.catalog['products'][0]
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=product.pk).update(name='Самовар')
+            suggest_index.record_change([product.pk])
+        cache.delete(suggest_index._change_key(suggest_index.generation, suggest_index.sequence + 1))
+        self.client.get(reverse('suggest'), {'q': 'само'})
+        results = self.client.get(reverse('suggest'), {'q': 'само'}).json()['results']
+        self.assertIsNot(suggest_index.index, index)
+        self.assertEqual([item['label'] for item in results], ['Самовар'])
+
+    def test_rebuild_after_change(self):
+        self.client.get(reverse('suggest'), {'q': 'товар'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Грибы', slug='griby')
+        results = self.client.get(reverse('suggest'), {'q': 'гриб'}).json()['results']
+        self.assertEqual([item['slug'] for item in results], ['griby'])
+
+
+class ReplicaRoutingTests(TestCase):
+    """Чтения с реплики: реплика - отдельный файл SQLite со схемой, но без данных default"""
+
+    # Алиас реплики добавляется в setUpClass, после настройки тестовых БД:
+    # это обычный временный файл, не тестовая копия default
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = connections.configure_settings({
+            **connections.settings,
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+            },
+        })['replica']
+        call_command('migrate', database='replica', run_syncdb=True, verbosity=0)
+        cls.enterClassContext(override_settings(
+            DATABASE_ROUTERS=['catalog.replicas.ReplicaRouter'],
+            CATALOG_REPLICAS={'DATABASES': ['replica']}
+        ))
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=3, images=0)
+        cls.user = User.objects.create_user('orders', password='x', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        replica_health.reset()
+
+    def test_safe_reads_use_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.json()['count'], 0)
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertNotIn('catalog_primary', response.cookies)
+
+    def test_unsafe_request_reads_primary_and_sticks(self):
+        self.client.force_login(self.user)
+        product = self.catalog['products'][0]
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.post(
+                reverse('products-reserve'), {'items': [{'product': product.pk}]}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica_queries.captured_queries, [])
+        self.assertIn('catalog_primary', response.cookies)
+        # Клиент с cookie после записи читает с основной БД
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(replica_queries.captured_queries, [])
+
+    def test_failed_write_is_not_sticky(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('products-reserve'), {'items': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('catalog_primary', response.cookies)
+
+    def test_unbounded_caches_fill_from_primary(self):
+        category = self.catalog['categories'][0]
+        token = read_database.set('replica')
+        try:
+            self.assertIsNotNone(CatalogService.get_category_range(category.slug))
+            self.assertTrue(attribute_options.options([self.catalog['attributes'][0].pk])[self.catalog['attributes'][0].pk])
+            self.assertTrue(attribute_index.resolve({'size': [f'v{i}' for i in range(8)]}))
+            with primary_reads():
+                self.assertEqual(Product.objects.count(), 3)
+            self.assertEqual(Product.objects.count(), 0)
+        finally:
+            read_database.reset(token)
+        tree = self.client.get(reverse('categories-tree')).json()
+        self.assertEqual(len(tree), Category.objects.filter(parent=None).count())
+
+
+class RendererTests(TestCase):
+    """Рендереры по CATALOG_RENDERERS и согласование формата у закэшированных ответов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=1, products=3, images=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_view_renderer_classes_are_kept(self):
+        class JsonOnlyViewSet(ProductViewSet):
+            renderer_classes = [JSONRenderer]
+
+        with override_settings(CATALOG_RENDERERS={'FAST_JSON': True}):
+            self.assertEqual([type(renderer) for renderer in JsonOnlyViewSet().get_renderers()], [OrjsonRenderer])
+        self.assertEqual([type(renderer) for renderer in JsonOnlyViewSet().get_renderers()], [JSONRenderer])
+
+    @skipUnless(renderers.msgpack, 'msgpack не установлен')
+    def test_cached_formats_vary_on_accept(self):
+        self.assertIn('msgpack', [renderer.format for renderer in ProductViewSet().get_renderers()])
+        url = reverse('products-list')
+        packed = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(packed['Content-Type'], 'application/msgpack')
+        self.assertTrue(has_vary_header(packed, 'Accept'))
+        self.assertEqual(renderers.msgpack.unpackb(packed.content)['count'], 3)
+        plain = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(plain['Content-Type'], 'application/json')
+        self.assertEqual(plain.json()['count'], 3)
+
+
+class CategorySubtreeFilterTests(TestCase):
+    """?category= отбирает всё поддерево по диапазону MPTT, диапазоны сбрасываются при перемещении"""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_type = ProductType.objects.create(name='Одежда', slug='clothes')
+        cls.root = Category.objects.create(name='Корень', slug='root', product_type=product_type)
+        cls.child = Category.objects.create(name='Потомок', slug='child', parent=cls.root, product_type=product_type)
+        cls.grandchild = Category.objects.create(
+            name='Внук', slug='grandchild', parent=cls.child, product_type=product_type
+        )
+        cls.other = Category.objects.create(name='Другой корень', slug='other', product_type=product_type)
+        cls.product = Product.objects.create(
+            name='Носки', slug='socks', category=cls.grandchild, price=100, stock=1
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, slug):
+        response = self.client.get(reverse('products-list'), {'category': slug})
+        return [item['id'] for item in response.json()['results']]
+
+    def test_root_includes_grandchildren(self):
+        self.assertEqual(self.get_ids('root'), [self.product.pk])
+        self.assertEqual(self.get_ids('child'), [self.product.pk])
+        self.assertEqual(self.get_ids('other'), [])
+        self.assertEqual(self.get_ids('missing'), [])
+
+    def test_ranges_reset_after_move(self):
+        self.assertEqual(self.get_ids('root'), [self.product.pk])
+        self.assertEqual(self.get_ids('other'), [])
+        # Свежие экземпляры: lft/rght в памяти устаревают после вставки потомков
+        Category.objects.get(pk=self.child.pk).move_to(Category.objects.get(pk=self.other.pk))
+        self.assertEqual(self.get_ids('root'), [])
+        self.assertEqual(self.get_ids('other'), [self.product.pk])
+
+
+class FullTextSearchTests(TestCase):
+    """FTS5: синхронизация индекса с товарами, релевантность, пустые термины"""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_type = ProductType.objects.create(name='Одежда', slug='clothes')
+        cls.category = Category.objects.create(name='Трикотаж', slug='knit', product_type=product_type)
+        cls.sweater = Product.objects.create(
+            name='Синий свитер', slug='sweater', category=cls.category, price=100, stock=1,
+            description='Шерсть'
+        )
+        cls.hat = Product.objects.create(
+            name='Шапка', slug='hat', category=cls.category, price=50, stock=1,
+            description='Шапка к свитеру'
+        )
+
+    def setUp(self):
+        cache.clear()
+        # Наличие индекса запоминается в процессе, а таблица FTS откатывается с тестом
+        search._backends.clear()
+        self.addCleanup(search._backends.clear)
+        call_command('catalog_search_index', stdout=io.StringIO())
+
+    def get_ids(self, **params):
+        response = self.client.get(reverse('products-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_index_follows_save_and_delete(self):
+        scarf = Product.objects.create(name='Кашемировый шарф', slug='scarf', category=self.category, price=10)
+        self.assertEqual(self.get_ids(search='кашемир'), [scarf.pk])
+        scarf.name = 'Льняной шарф'
+        scarf.save()
+        cache.clear()
+        self.assertEqual(self.get_ids(search='кашемир'), [])
+        self.assertEqual(self.get_ids(search='льнян'), [scarf.pk])
+        scarf_id = scarf.pk
+        scarf.delete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM catalog_product_fts WHERE rowid = %s', [scarf_id])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_relevance_ordering(self):
+        # Совпадение в названии весомее совпадения в описании
+        self.assertEqual(self.get_ids(search='свитер', ordering='-relevance'), [self.sweater.pk, self.hat.pk])
+
+    def test_empty_terms_are_ignored(self):
+        everything = sorted(self.get_ids())
+        self.assertEqual(sorted(self.get_ids(search='"')), everything)
+        self.assertEqual(sorted(self.get_ids(search='" "')), everything)
+        self.assertEqual(self.client.get(reverse('products-facets'), {'search': '"'}).status_code, 200)
+        self.assertEqual(search.SQLiteSearchBackend().search(Product.objects.all(), '').count(), 2)
+
+
+@modify_settings(MIDDLEWARE={'append': 'catalog.profiling.CatalogProfilingMiddleware'})
+@override_settings(CATALOG_PROFILING_ENABLED=True, CATALOG_PROFILING_SAMPLE_RATE=1.0)
+class ProfilingMiddlewareTests(TestCase):
+    """Профилирование: заголовок Server-Timing, выборка, повторы запросов по отпечатку"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = benchmarks.seed_catalog(categories=2, products=3, images=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_header(self):
+        with self.assertLogs('catalog.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('products-list'))
+        timing = response['Server-Timing']
+        self.assertIn('filter;dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries, \d+ duplicates"')
+        self.assertIn('total;dur=', timing)
+        profile = logs.records[0].catalog_profile
+        self.assertGreater(profile['queries'], 0)
+        self.assertIn('filter', profile['phases'])
+
+    @override_settings(CATALOG_PROFILING_SAMPLE_RATE=0.0)
+    def test_not_sampled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('products-list')))
+
+    @override_settings(CATALOG_PROFILING_ENABLED=False)
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('products-list')))
+
+    def test_duplicate_fingerprints(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x''y' AND price > 1.5"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND price > ?'
+        )
+        profile = RequestProfile()
+        execute = mock.Mock()
+        for sql in ('SELECT * FROM t WHERE id = 1', 'SELECT * FROM t WHERE id = 2', 'SELECT * FROM u'):
+            profile(execute, sql, None, False, {})
+        self.assertEqual(profile.queries, 3)
+        self.assertEqual(profile.duplicates(), [{'sql': 'SELECT * FROM t WHERE id = ?', 'count': 2}])
+        self.assertIn('3 queries, 1 duplicates', profile.server_timing())
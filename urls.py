@@ -7,14 +7,27 @@ router.register('products', views.ProductViewSet, basename='products')
 router.register('categories', views.CategoryViewSet, basename='categories')
 
 urlpatterns = [
+    # Асинхронный список (ASGI); до роутера, иначе совпадёт с products/<pk>/
+    path('products/page/',
+         views.product_page,
+         name='product-page'),
+    
     # API endpoints через роутер
     path('', include(router.urls)),
     
     # Дополнительные endpoints
+    path('attributes/options/',
+         views.get_attribute_options,
+         name='attribute-options-batch'),
+    
     path('attributes/<int:attribute_id>/options/', 
          views.get_attribute_options, 
          name='attribute-options'),
     
+    path('suggest/',
+         views.suggest,
+         name='suggest'),
+    
     path('products/create/',
          views.create_product,
          name='create-product'),
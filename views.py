@@ -1,31 +1,99 @@
-from rest_framework import viewsets
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import os
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.http import JsonResponse
-from .models import Category, Product, AttributeOption, ProductImage
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import condition, require_GET
+from .models import Category, Product, AttributeOption, ProductImage, ProductNeighbor
 from .serializers import (
     CategorySerializer, 
     ProductSerializer,
     ProductImageSerializer
 )
-from .filters import ProductFilter
-from django.db import transaction
+from .filters import ProductFilter, FullTextSearchFilter
+from django.db import connections, transaction
 from django_filters import rest_framework as filters
 from .services import CatalogService
+from .pagination import CountProfilingPaginator, ProductCursorPagination
+from .attribute_options import attribute_options
+from .caching import get_generation, make_key
+from .changefeed import get_changes
+from .documents import absolute_urls, build_documents, current_documents, get_documents
+from .suggest import suggest_index
+from .exporters import ProductExporter
+from .importers import ProductImporter
+from .profiling import profile_phase
+from .renderers import FastRenderersMixin, json_renderer
+from .replicas import ReplicaReadMixin, primary_reads, replica_reads
+from .stock import InsufficientStock, StockUpdater, parse_items, release_stock, reserve_stock
+from .response_cache import ResponseCacheMixin
+
+logger = logging.getLogger(__name__)
 
 class StandardResultsSetPagination(PageNumberPagination):
+    django_paginator_class = CountProfilingPaginator
     page_size = 12
     page_size_query_param = 'page_size'
     max_page_size = 100
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Category.objects.filter(is_active=True)
+class CategoryViewSet(ReplicaReadMixin, FastRenderersMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Category.objects.filter(is_active=True).select_related('parent', 'stats')
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = None  # Отключаем пагинацию для категорий
     search_fields = ['name']
+    tree_cache_timeout = None  # Инвалидация сигналами
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Дерево активных категорий; ?counts=true добавляет агрегаты товаров поддерева"""
+        with_counts = request.query_params.get('counts') == 'true'
+        cache_key = make_key(
+            'category-tree',
+            with_counts,
+            get_generation('category-counts') if with_counts else None
+        )
+        cached = cache.get(cache_key)
+        if cached is None:
+            # Кэш без срока заполняется с основной БД, не с отстающей реплики
+            with primary_reads():
+                tree = CatalogService.build_category_tree(with_counts)
+            content = json_renderer().render(tree)
+            cached = (quote_etag(hashlib.sha1(content).hexdigest()), content)
+            cache.set(cache_key, cached, self.tree_cache_timeout)
+        etag, content = cached
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+            if etag in etags or '*' in etags:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
 class ProductFilter(filters.FilterSet):
     min_price = filters.NumberFilter(field_name="price", lookup_expr='gte')
@@ -36,61 +104,520 @@ class ProductFilter(filters.FilterSet):
         model = Product
         fields = ['category', 'is_active', 'min_price', 'max_price']
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, FastRenderersMixin, ResponseCacheMixin, viewsets.ModelViewSet):
     """ViewSet для работы с товарами"""
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = StandardResultsSetPagination
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at', 'name']
+    ordering_fields = ['price', 'created_at', 'name', 'relevance']
     ordering = ['-created_at']
+    cursor_pagination_class = ProductCursorPagination
+    facets_cache_timeout = 300
+    use_read_model = True
+    batch_max_size = 100
+    similar_max_size = 24
+    changes_page_size = 500
+    changes_max_page_size = 5000
+    # Поля ProductSerializer, которые отдаются прямо из колонок (?fields=... без images/attributes)
+    VALUE_COLUMNS = {
+        'id': 'id',
+        'name': 'name',
+        'slug': 'slug',
+        'category': 'category',
+        'category_name': 'category__name',
+        'category_slug': 'category__slug',
+        'price': 'price',
+        'stock': 'stock',
+        'is_active': 'is_active',
+        'description': 'description',
+        'created_at': 'created_at',
+    }
+    # Поля изображения, которым нужна колонка модели, но не подходящие для .values()
+    IMAGE_COLUMNS = {
+        'main_image': 'main_image',
+        'main_image_srcset': 'main_image_variants',
+    }
+
+    @property
+    def paginator(self):
+        """Keyset-пагинация включается через ?pagination=cursor или ?cursor=..."""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request is not None else {}
+            if 'cursor' in params or params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
+
+    def serves_documents(self):
+        """Чтение списка и карточки из готовых документов ProductDocument"""
+        return self.use_read_model and self.action in ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        """Поля ответа с учётом ?fields= и ?omit= (порядок как в сериализаторе)"""
+        if not hasattr(self, '_requested_fields'):
+            params = self.request.query_params if self.request is not None else {}
+            fields = set(filter(None, params.get('fields', '').split(',')))
+            omit = set(filter(None, params.get('omit', '').split(',')))
+            self._requested_fields = [
+                name for name in ProductSerializer.Meta.fields
+                if (not fields or name in fields) and name not in omit
+            ] or ['id']
+        return self._requested_fields
+
+    def uses_values_path(self):
+        """Только плоские поля - строки собираются из .values() без сериализатора"""
+        return self.action == 'list' and set(self.get_requested_fields()) <= set(self.VALUE_COLUMNS)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method == 'GET':
+            kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         """Оптимизация запросов"""
-        queryset = super().get_queryset().prefetch_related(
-            'images',
-            'attribute_values',
-            'attribute_values__attribute',
-            'attribute_values__option'
+        queryset = super().get_queryset()
+        if self.serves_documents() or self.uses_values_path():
+            # Документы уже содержат связанные данные, нужны только поля сортировки
+            queryset = queryset.only('id', 'price', 'created_at', 'name')
+        elif self.request.method == 'GET':
+            # Колонки и prefetch только для запрошенных полей
+            fields = set(self.get_requested_fields())
+            queryset = queryset.only(
+                'id', 'price', 'created_at', 'name',
+                *(self.VALUE_COLUMNS[name] for name in fields & set(self.VALUE_COLUMNS)),
+                *(self.IMAGE_COLUMNS[name] for name in fields & set(self.IMAGE_COLUMNS))
+            )
+            if fields & {'category_name', 'category_slug'}:
+                queryset = queryset.select_related('category')
+            if 'images' in fields:
+                queryset = queryset.prefetch_related('images')
+            if 'attributes' in fields:
+                queryset = queryset.prefetch_related(
+                    'attribute_values',
+                    'attribute_values__attribute',
+                    'attribute_values__option'
+                )
+        else:
+            queryset = queryset.select_related('category').prefetch_related(
+                'images',
+                'attribute_values',
+                'attribute_values__attribute',
+                'attribute_values__option'
+            )
+
+        filters = CatalogService.parse_filters(self.request.query_params)
+        return CatalogService.get_filtered_products(queryset, filters)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.build_list_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, partial(self.build_retrieve_response, request, *args, **kwargs)
         )
-        
-        filters = {
-            'min_price': self.request.query_params.get('min_price'),
-            'max_price': self.request.query_params.get('max_price'),
-            'category': self.request.query_params.get('category'),
-            'in_stock': self.request.query_params.get('in_stock') == 'true',
-            'attributes': {
-                'size': self.request.query_params.get('size'),
-                'color': self.request.query_params.get('color')
+
+    def build_list_response(self):
+        fields = self.get_requested_fields()
+        values_path = self.uses_values_path()
+        with profile_phase('filter'):
+            queryset = self.filter_queryset(self.get_queryset())
+            if values_path:
+                queryset = queryset.values(
+                    'id', 'price', 'created_at', 'name',
+                    *(self.VALUE_COLUMNS[name] for name in fields)
+                )
+        with profile_phase('paginate'):
+            page = self.paginate_queryset(queryset)
+            products = page if page is not None else list(queryset)
+        if values_path:
+            with profile_phase('serialize'):
+                data = self.rows_to_data(products, fields)
+        elif self.serves_documents():
+            data = [
+                {name: document[name] for name in fields}
+                for document in get_documents([product.pk for product in products], self.request)
+            ]
+        else:
+            with profile_phase('serialize'):
+                data = self.get_serializer(products, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def rows_to_data(self, rows, fields):
+        """Словари ответа из строк .values() в формате ProductSerializer"""
+        serializer_fields = ProductSerializer().fields
+        convert = {
+            name: serializer_fields[name].to_representation
+            for name in ('price', 'created_at')
+            if name in fields
+        }
+        return [
+            {
+                name: convert[name](row[self.VALUE_COLUMNS[name]])
+                if name in convert and row[self.VALUE_COLUMNS[name]] is not None
+                else row[self.VALUE_COLUMNS[name]]
+                for name in fields
             }
+            for row in rows
+        ]
+
+    def build_retrieve_response(self, request, *args, **kwargs):
+        if not self.serves_documents():
+            return super().retrieve(request, *args, **kwargs)
+        with profile_phase('filter'):
+            instance = self.get_object()
+        document = get_documents([instance.pk], request)[0]
+        return Response({name: document[name] for name in self.get_requested_fields()})
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser]
+    )
+    def import_products(self, request):
+        """Импорт товаров из файла CSV/JSONL (поле file), ?upsert=true - обновление по slug"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Не передан файл'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('type') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if fmt not in ProductImporter.formats:
+            return Response({'error': f'Неизвестный формат: {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = ProductImporter(
+            upsert=request.query_params.get('upsert') == 'true',
+            create_options=request.query_params.get('create_options') == 'true'
+        )
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        return Response(importer.run(stream, fmt))
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='export',
+        permission_classes=[IsAdminUser]
+    )
+    def export_products(self, request):
+        """Потоковая выгрузка активного каталога: ?type=jsonl|csv|xml, ?gzip=true"""
+        try:
+            exporter = ProductExporter(
+                request.query_params.get('type', 'jsonl'),
+                compress=request.query_params.get('gzip') == 'true',
+                base_url=request.build_absolute_uri('/')
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(exporter.stream(), content_type=exporter.content_type)
+        response['Content-Disposition'] = f'attachment; filename="{exporter.filename}"'
+        return response
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def reserve(self, request):
+        """Атомарный резерв (внутренний вызов заказов, только администратор):
+        {"items": [{"product": id, "quantity": n}]} - всё или ничего
+        """
+        try:
+            quantities = parse_items(request.data)
+            reserve_stock(quantities)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock as e:
+            return Response(
+                {'error': str(e), 'product': e.product_id, 'quantity': e.quantity},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({'reserved': [
+            {'product': product_id, 'quantity': quantity} for product_id, quantity in quantities.items()
+        ]})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def release(self, request):
+        """Возврат резерва (внутренний вызов заказов, только администратор), формат как у reserve"""
+        try:
+            quantities = parse_items(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        missing = release_stock(quantities)
+        return Response({
+            'released': [
+                {'product': product_id, 'quantity': quantity}
+                for product_id, quantity in quantities.items() if product_id not in missing
+            ],
+            'missing': missing
+        })
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='stock',
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser]
+    )
+    def update_stock(self, request):
+        """Пакетное обновление остатков из файла склада CSV/JSONL (поле file)"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Не передан файл'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('type') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if fmt not in StockUpdater.formats:
+            return Response({'error': f'Неизвестный формат: {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        return Response(StockUpdater().run(stream, fmt))
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Несколько товаров за запрос: ?ids=1,2,3 или ?slugs=a,b в порядке запроса"""
+        return self.cached_response(request, partial(self.build_batch_response, request))
+
+    def build_batch_response(self, request):
+        if 'ids' in request.query_params:
+            lookup = 'id'
+            try:
+                keys = [int(pk) for pk in request.query_params['ids'].split(',') if pk.strip()]
+            except ValueError:
+                return Response({'error': 'ids должны быть числами'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            lookup = 'slug'
+            keys = [slug.strip() for slug in request.query_params.get('slugs', '').split(',') if slug.strip()]
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return Response({'error': 'Передайте ids или slugs'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(keys) > self.batch_max_size:
+            return Response(
+                {'error': f'Не больше {self.batch_max_size} товаров за запрос'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fields = self.get_requested_fields()
+        if self.use_read_model:
+            found = dict(
+                super().get_queryset().filter(**{f'{lookup}__in': keys}).order_by().values_list(
+                    lookup, 'id'
+                )
+            )
+            documents = get_documents([found[key] for key in keys if key in found], request)
+            results = [{name: document[name] for name in fields} for document in documents]
+        else:
+            products = super().get_queryset().filter(**{f'{lookup}__in': keys}).select_related(
+                'category'
+            ).prefetch_related(
+                'images',
+                'attribute_values',
+                'attribute_values__attribute',
+                'attribute_values__option'
+            )
+            found = {getattr(product, lookup): product for product in products}
+            results = self.get_serializer(
+                [found[key] for key in keys if key in found], many=True
+            ).data
+        return Response({
+            'results': results,
+            'missing': [key for key in keys if key not in found]
+        })
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Похожие товары из предрасчитанной таблицы, ?limit= до similar_max_size"""
+        return self.cached_response(request, partial(self.build_similar_response, request, pk))
+
+    def build_similar_response(self, request, pk):
+        try:
+            limit = min(int(request.query_params.get('limit', self.similar_max_size)), self.similar_max_size)
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+        product = get_object_or_404(super().get_queryset().only('id'), pk=pk)
+        scores = dict(
+            ProductNeighbor.objects.filter(product_id=product.pk, neighbor__is_active=True).order_by(
+                'rank'
+            ).values_list('neighbor_id', 'score')[:max(limit, 0)]
+        )
+        fields = self.get_requested_fields()
+        if self.use_read_model:
+            found = get_documents(list(scores), request)
+            items = [{name: document[name] for name in fields} for document in found]
+        else:
+            products = super().get_queryset().filter(pk__in=list(scores)).select_related(
+                'category'
+            ).prefetch_related(
+                'images',
+                'attribute_values',
+                'attribute_values__attribute',
+                'attribute_values__option'
+            ).in_bulk()
+            found = [products[key] for key in scores if key in products]
+            items = self.get_serializer(found, many=True).data
+        return Response({'results': [
+            dict(item, similarity=round(scores[source['id'] if self.use_read_model else source.pk], 4))
+            for item, source in zip(items, found)
+        ]})
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Изменённые и удалённые товары после водяного знака ?since=, до ?limit= штук"""
+        try:
+            limit = min(int(request.query_params.get('limit', self.changes_page_size)), self.changes_max_page_size)
+            data = get_changes(request.query_params.get('since'), max(limit, 1))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Счётчики фасетов (варианты атрибутов, категории, цены) для текущих фильтров и ?search="""
+        return Response(self.get_facets())
+
+    def get_facets(self):
+        """Фасеты запроса; общие для действия facets и async-страницы"""
+        search = FullTextSearchFilter()
+        return CatalogService.get_cached_facets(
+            search.filter_queryset(self.request, super().get_queryset(), self),
+            CatalogService.parse_filters(self.request.query_params),
+            self.facets_cache_timeout,
+            search=' '.join(search.get_search_terms(self.request))
+        )
+
+def _isolated(func):
+    """func для sync_to_async(thread_sensitive=False): своё соединение с БД в потоке пула"""
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Соединения потоков пула не переиспользуются между запросами
+            connections.close_all()
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+
+@replica_reads
+async def product_page(request):
+    """Асинхронная страница каталога: товары, количество и фасеты (?facets=true) одновременно.
+
+    Параметры как у списка ProductViewSet: фильтры, ?search=, ordering, ?fields=/?omit=,
+    page, page_size - разбирает тот же ProductViewSet.filter_queryset.
+    COUNT и фасеты выполняются в отдельных потоках со своими соединениями,
+    id страницы и документы - через асинхронный ORM; цикл событий не блокируется.
+    """
+    params = request.GET
+    pagination = StandardResultsSetPagination
+    try:
+        page = max(int(params.get('page', 1)), 1)
+        page_size = min(max(int(params.get('page_size', pagination.page_size)), 1), pagination.max_page_size)
+    except ValueError:
+        return JsonResponse({'detail': 'Некорректные page или page_size'}, status=400)
+    ordering = params.get('ordering', '')
+    for name in filter(None, ordering.split(',')):
+        if name.strip().removeprefix('-') not in ProductViewSet.ordering_fields:
+            return JsonResponse({'detail': f'Недопустимая сортировка: {ordering}'}, status=400)
+
+    view = ProductViewSet(request=Request(request), args=(), kwargs={}, format_kwarg=None, action='list')
+    # Диапазон категории, индекс атрибутов и поиск читаются синхронно
+    queryset = await sync_to_async(lambda: view.filter_queryset(view.get_queryset()))()
+    fields = view.get_requested_fields()
+
+    count_task = asyncio.ensure_future(_isolated(queryset.count)())
+    facets_task = None
+    if params.get('facets') == 'true':
+        facets_task = asyncio.ensure_future(_isolated(view.get_facets)())
+
+    try:
+        offset = (page - 1) * page_size
+        ids = [
+            pk async for pk in queryset.order_by(*queryset.query.order_by, 'id').values_list('id', flat=True)[
+                offset:offset + page_size
+            ]
+        ]
+        documents = {
+            product_id: data async for product_id, data in current_documents().filter(
+                product_id__in=ids
+            ).values_list('product_id', 'data')
         }
-        
-        return CatalogService.get_filtered_products(queryset, filters)
+        missing = [pk for pk in ids if pk not in documents]
+        if missing:
+            documents.update(await sync_to_async(build_documents)(missing))
+        count = await count_task
+        facets = await facets_task if facets_task is not None else None
+    except BaseException:
+        for task in (count_task, facets_task):
+            if task is not None:
+                task.cancel()
+        raise
+
+    total_pages = max(math.ceil(count / page_size), 1)
+    if page > total_pages:
+        return JsonResponse({'detail': 'Страница не найдена'}, status=404)
+    url = request.build_absolute_uri()
+    data = {
+        'count': count,
+        'total_pages': total_pages,
+        'current_page': page,
+        'next': replace_query_param(url, 'page', page + 1) if page < total_pages else None,
+        'previous': (
+            remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+        ) if page > 1 else None,
+        'results': [
+            {name: document[name] for name in fields}
+            for document in (absolute_urls(documents[pk], request) for pk in ids if pk in documents)
+        ],
+    }
+    if facets is not None:
+        data['facets'] = facets
+    return HttpResponse(json_renderer().render(data), content_type='application/json')
+
+
+def _attribute_ids(request, attribute_id=None):
+    """id атрибутов из URL или ?ids=1,2,3; None - некорректный список"""
+    if attribute_id is not None:
+        return [attribute_id]
+    try:
+        return list(dict.fromkeys(
+            int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()
+        ))
+    except ValueError:
+        return None
+
+
+def _attribute_options_etag(request, attribute_id=None):
+    attribute_ids = _attribute_ids(request, attribute_id)
+    return attribute_options.etag(attribute_ids) if attribute_ids else None
+
+
+def _attribute_options_last_modified(request, attribute_id=None):
+    return datetime.fromtimestamp(attribute_options.last_modified(), tz=dt_timezone.utc)
+
+
+@require_GET
+@condition(etag_func=_attribute_options_etag, last_modified_func=_attribute_options_last_modified)
+def get_attribute_options(request, attribute_id=None):
+    """Варианты значений атрибута; без attribute_id - несколько атрибутов по ?ids=1,2,3"""
+    attribute_ids = _attribute_ids(request, attribute_id)
+    if not attribute_ids:
+        return JsonResponse({'error': 'Ожидается ?ids=1,2,3'}, status=400)
+    options = attribute_options.options(attribute_ids)
+    if attribute_id is not None:
+        response = JsonResponse(options[attribute_id], safe=False)
+    else:
+        response = JsonResponse({str(pk): rows for pk, rows in options.items()})
+    # Кэшировать можно, но каждый раз перепроверять по ETag
+    patch_cache_control(response, no_cache=True)
+    return response
+
 
-def get_attribute_options(request, attribute_id):
-    """Получение вариантов значений для атрибута"""
+@require_GET
+def suggest(request):
+    """Подсказки по мере ввода: ?q=<начало слов>&limit=10"""
+    query = request.GET.get('q', '').strip()
     try:
-        # Добавляем отладочную информацию
-        print(f"Запрос опций для атрибута {attribute_id}")
-        
-        options = AttributeOption.objects.filter(
-            attribute_id=attribute_id
-        ).values(
-            'id',
-            'value',
-            'display_value',
-            'order'
-        ).order_by('order')
-        
-        data = list(options)
-        print(f"Отправляем данные: {data}")
-        
-        return JsonResponse(data, safe=False)
-    except Exception as e:
-        print(f"Ошибка: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный limit'}, status=400)
+    response = JsonResponse({'query': query, 'results': suggest_index.search(query, limit)})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
 
 @transaction.atomic
 def create_product(request):